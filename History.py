@@ -14,12 +14,15 @@ import sys
 import time
 
 import numpy as np
+import scipy.sparse
 
 import matplotlib.pyplot as plt
 import matplotlib.mlab as ml
 from mpl_toolkits.mplot3d.axes3d import *
 from matplotlib import cm
 
+import HistoryEvents as he
+
 
 def stop():
     sys.exit()
@@ -296,6 +299,50 @@ def is_local_minimum(elevation_grid, r_0, c_0):
 def is_local_maximum(elevation_grid, r_0, c_0):
     return is_critical_point_helper(elevation_grid,r_0,c_0,"max")
 
+def grid_disk_kernel(rad, kernel_rad):
+    """
+    Returns a square array of side 2*kernel_rad+1 that is 1 on the points within rad of its center (the same points as grid_circle) and 0 elsewhere.
+    """
+    offsets = np.arange(-kernel_rad, kernel_rad+1)
+    return (offsets[:,np.newaxis]**2 + offsets[np.newaxis,:]**2 <= rad**2).astype(float)
+
+def grid_disk_sum(height_shifts, radii, max_rad):
+    """
+    Adds height_shifts[r,c] to every point of the grid within radii[r,c] of (r,c), for every (r,c), and returns the resulting grid.
+    Each radius contributes an impulse field (its shifts, zero elsewhere) convolved with that radius's disk; the convolutions are done with FFTs
+    and summed before the single inverse transform, so this is O(n log n) in the number of points rather than O(n * rad^2) or worse.
+    """
+    r_size, c_size = height_shifts.shape
+    # pad by max_rad on every side so the (circular) FFT convolution does not wrap disks around the edges
+    shape = (r_size + 2*max_rad, c_size + 2*max_rad)
+    total = np.zeros((shape[0], shape[1]//2 + 1), dtype=complex)
+    for rad in range(1, max_rad+1):
+        impulses = np.where(radii == rad, height_shifts, 0)
+        if not impulses.any():
+            continue
+        total += np.fft.rfft2(impulses, s=shape) * np.fft.rfft2(grid_disk_kernel(rad, max_rad), s=shape)
+    result = np.fft.irfft2(total, s=shape)
+    # the kernel is centered at (max_rad, max_rad), so grid point (r,c) ends up at (r+max_rad, c+max_rad)
+    return result[max_rad:max_rad+r_size, max_rad:max_rad+c_size]
+
+def grid_neighbor_extremes(grid):
+    """
+    Returns arrays of the minimum and maximum over each point's 8 neighbors (not including the point itself), ignoring points off the grid.
+    A point with no neighbors gets inf and -inf.
+    """
+    r_size, c_size = grid.shape
+    padded_for_min = np.pad(grid, 1, constant_values=np.inf)
+    padded_for_max = np.pad(grid, 1, constant_values=-np.inf)
+    neighbor_min = np.full(grid.shape, np.inf)
+    neighbor_max = np.full(grid.shape, -np.inf)
+    for dr in [-1,0,1]:
+        for dc in [-1,0,1]:
+            if dr == 0 and dc == 0:
+                continue
+            np.minimum(neighbor_min, padded_for_min[1+dr:1+dr+r_size, 1+dc:1+dc+c_size], out=neighbor_min)
+            np.maximum(neighbor_max, padded_for_max[1+dr:1+dr+r_size, 1+dc:1+dc+c_size], out=neighbor_max)
+    return neighbor_min, neighbor_max
+
 def generate_name_global():
     """
     Creates super-fake fantasy-sounding word for city and kingdom names.
@@ -413,6 +460,7 @@ class City:
         
         self.point.add_stockpile_amount("population", city_dct["population"])
         self.name = city_dct["name"]
+        self.index = len(self.map.cities) # position in map.cities, for ordering cities without relying on hashes
         self.state = None
         self.trade_neighbors = None
 
@@ -420,13 +468,13 @@ class City:
         return self.state == state
 
     def get_routes(self):
-        return [route for route in self.map.routes[self].values() if route is not None]
+        return list(self.map.routes[self].values())
 
     def get_trade_routes(self):
-        return [route for route in self.map.trade_routes if self in route.cities and route is not None]
+        return list(self.map.trade_routes.get_routes(self))
 
     def get_land_trade_routes(self):
-        return [route for route in self.map.land_trade_routes if self in route.cities and route is not None]
+        return list(self.map.land_trade_routes.get_routes(self))
 
     def get_navigable_routes(self):
         return [route for route in self.get_routes() if route.is_navigable(self.get_navigation_technologies())]
@@ -439,9 +487,11 @@ class City:
 
     def construct_trade_neighbors(self):
         result = []
-        for pair in filter(lambda p: p.contains(self), self.state.land_trade_routes):
-            partner_city = pair[0] if pair[1] is self else pair[1]
-            result.append(partner_city)
+        state_cities = set(self.state.cities)
+        for pair in self.map.land_trade_routes.get_routes(self):
+            partner_city = pair.get_other_city(self)
+            if partner_city in state_cities:
+                result.append(partner_city)
         self.trade_neighbors = result
         return result
 
@@ -468,8 +518,8 @@ class City:
 
     def conquer(self, conquered_city):
         print("called conquer({0}, {1})".format(self.name, conquered_city.name))
-        self.map.output("{0} from {1} conquered {2} from {3}.".format(
-            self.name, self.state.name, conquered_city.name, conquered_city.state.name))
+        self.map.record_event("conquest", conqueror=self.name, conqueror_state=self.state.name,
+            conquered=conquered_city.name, conquered_state=conquered_city.state.name)
         # removal from old state
         conquered_city.state.cities.remove(conquered_city)
         conquered_city.state.refresh_routes()
@@ -490,10 +540,7 @@ class City:
         if "largest_city" in self.map.types[self.point.r][self.point.c]:
             self.map.types[self.point.r][self.point.c].remove("largest_city")
         for route in self.get_routes():
-            if route in self.map.trade_routes:
-                self.map.trade_routes.remove(route)
-            if route in self.map.land_trade_routes:
-                self.map.land_trade_routes.remove(route)
+            self.map.remove_route(route)
         self.state.cities.remove(self)
         self.state.refresh_routes()
         self.state = None
@@ -522,10 +569,15 @@ class State:
         return list(set([route for c in self.cities for route in c.get_routes()]))
 
     def get_trade_routes(self):
-        return [route for route in self.map.trade_routes if all([c in self.cities for c in route.cities])]
+        return self.get_internal_routes(self.map.trade_routes)
 
     def get_land_trade_routes(self):
-        return [route for route in self.map.land_trade_routes if all([c in self.cities for c in route.cities])]
+        return self.get_internal_routes(self.map.land_trade_routes)
+
+    def get_internal_routes(self, trade_routes):
+        # routes in the TradeRoutes index with both cities in this state, found from this state's cities rather than by scanning every route
+        cities = set(self.cities)
+        return list(dict.fromkeys(route for city in self.cities for route in trade_routes.get_routes(city) if route.get_other_city(city) in cities))
 
     def get_all_navigable_routes(self):
         all_routes = []
@@ -600,12 +652,7 @@ class Route:
         return city in self.cities
 
     def destroy(self):
-        del self.cities[0].map.routes[self.cities[0]][self.cities[1]]
-        del self.cities[0].map.routes[self.cities[1]][self.cities[0]]
-        if self in self.cities[0].map.trade_routes:
-            self.cities[0].map.trade_routes.remove(self)
-        if self in self.cities[0].map.land_trade_routes:
-            self.cities[0].map.land_trade_routes.remove(self)
+        self.cities[0].map.remove_route(self)
         del self.cities
 
     def __len__(self):
@@ -615,6 +662,115 @@ class Route:
         return self.cities[i]
 
 
+class DisjointSet:
+    """
+    Union-find over hashable items, also keeping the members of each set so that sets can be listed or taken apart.
+    """
+    def __init__(self, items=()):
+        self.parent = {}
+        self.members = {} # root: set of the items whose root it is
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.members[item] = {item}
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, item_1, item_2):
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return root_1
+        # union by size; also means the smaller member set is the one copied
+        if len(self.members[root_1]) < len(self.members[root_2]):
+            root_1, root_2 = root_2, root_1
+        self.parent[root_2] = root_1
+        self.members[root_1] |= self.members.pop(root_2)
+        return root_1
+
+    def remove_set(self, item):
+        """
+        Removes the whole set containing item and returns its members, so they can be added back in different sets.
+        """
+        members = self.members.pop(self.find(item))
+        for member in members:
+            del self.parent[member]
+        return members
+
+    def get_sets(self):
+        return {frozenset(members) for members in self.members.values()}
+
+
+class TradeRoutes:
+    """
+    The routes that are navigable with a given set of technologies, indexed by city, and the trade networks (connected components) they form.
+    Adding a route is a union, so near-constant time; removing a route only re-walks the routes of the network it was in.
+    The technology sets are fixed for the map (see Map.__init__), so a route's navigability is decided once, when it is added.
+    """
+    def __init__(self, techs, cities=()):
+        self.techs = set(techs)
+        self.routes_by_city = {}
+        self.networks = DisjointSet()
+        for city in cities:
+            self.add_city(city)
+
+    def add_city(self, city):
+        if city not in self.routes_by_city:
+            self.routes_by_city[city] = {} # used as an ordered set, so iteration order doesn't depend on object hashes
+            self.networks.add(city)
+
+    def get_routes(self, city):
+        return self.routes_by_city.get(city, {})
+
+    def add_route(self, route):
+        for city in route.cities:
+            self.add_city(city)
+            self.routes_by_city[city][route] = None
+        self.networks.union(*route.cities)
+
+    def add_route_if_navigable(self, route):
+        if route.is_navigable(self.techs):
+            self.add_route(route)
+
+    def remove_route(self, route):
+        for city in route.cities:
+            self.routes_by_city[city].pop(route, None)
+        self.rebuild_networks(self.networks.remove_set(route.cities[0]))
+
+    def rebuild_networks(self, cities):
+        for city in cities:
+            self.networks.add(city)
+        for city in cities:
+            for route in self.routes_by_city[city]:
+                self.networks.union(*route.cities)
+
+    def get_networks(self):
+        return self.networks.get_sets()
+
+    def __contains__(self, route):
+        return route in self.get_routes(route.cities[0])
+
+    def __iter__(self):
+        # each route once
+        for city, routes in self.routes_by_city.items():
+            for route in routes:
+                if route.cities[0] is city:
+                    yield route
+
+    def __len__(self):
+        return sum(1 for route in self)
+
+
 class Volcano:
     def __init__(self, point, name):
         self.point = point
@@ -637,29 +793,29 @@ class Volcano:
 
 
 class Map:
-    def __init__(self, r_size, c_size, output_mode):
+    def __init__(self, r_size, c_size, output_mode, event_log=None):
         self.r_size = r_size
         self.c_size = c_size
         self.output_mode = output_mode
-        self.output_string = ""
+        self.event_log = event_log if output_mode else None # a HistoryEvents.EventLog
+        self.period = None # set by the main loop, for the events
         self.points = {(r,c): Point((r,c)) for r in range(self.r_size) for c in range(self.c_size)}
         self.types = [[[] for i in range(c_size)] for r in range(r_size)]
         self.cities = []
         self.volcanoes = []
         self.largest_city = [-1,-1]
         self.max_population = 0
-        self.used_names = [] # list of names generated from generate_name() so we don't repeat them
+        self.used_names = set() # names generated from generate_name() so we don't repeat them; a set since there is one per point
         self.names = self.generate_all_names()
         
         self.elevation_grid = self.generate_elevation()
         self.fill_types()
 
-        self.routes = self.get_routes()
-        self.trade_routes = self.get_trade_routes()
-        self.land_trade_routes = self.get_trade_routes(overseas=False)
-
-        self.trade_networks = self.get_trade_networks()
-        self.land_trade_networks = self.get_trade_networks(overseas=False)
+        # self.routes[city][other_city] is the route between them; the trade route indexes also keep the trade networks up to date
+        self.routes = {city: {} for city in self.cities}
+        self.trade_routes = TradeRoutes({"ships"}, self.cities)
+        self.land_trade_routes = TradeRoutes(set(), self.cities)
+        self.add_all_routes()
 
         # the states dictionary contains keys corresponding to times at which changes were made to the political landscape
         # other dictionaries should be updated in a similar way to save memory
@@ -671,6 +827,7 @@ class Map:
         self.rainfall = self.generate_rainfall()
         self.generate_resources()
         self.initiate_stockpiles()
+        self.record_event("map", r_size=self.r_size, c_size=self.c_size, elevation=self.elevation_grid)
 
     # types of resources, class variables, to be constructed in self.generate_resources()
     natural_resources = set()
@@ -678,22 +835,26 @@ class Map:
     technological_resources = set()
 
     def output(self, thing):
-        if self.output_mode:
-            self.output_string += str(thing) + "\n"
-        else:
-            return
+        self.record_event("message", text=str(thing))
 
-        if len(self.output_string) > 1e4:
-            self.flush_output()
+    def record_event(self, event_type, **fields):
+        # the event log buffers events and writes them from another thread, so this is cheap in the simulation loop
+        if self.event_log is not None:
+            self.event_log.record(event_type, t=self.period, **fields)
 
-    def flush_output(self, filepath="HistoryOutput.txt"):
-        if self.output_mode:
-            f = open(filepath, "a")
-            f.write(self.output_string)
-            f.close() # improve speed drastically by not calling this until the end
-            self.output_string = ""
-        else:
-            pass
+    def record_events(self, event_type, **columns):
+        if self.event_log is not None:
+            self.event_log.record_many(event_type, t=self.period, **columns)
+
+    def flush_output(self):
+        if self.event_log is not None:
+            self.event_log.flush()
+
+    def record_stockpiles(self):
+        # a snapshot of every city's stockpiles, from which HistoryEvents can write what show_stockpiles would
+        for city in sorted(self.cities, key=lambda x: x.name):
+            r,c = city.coordinates
+            self.record_event("stockpiles", city=city.name, r=r, c=c, state=city.state.name, stockpiles=dict(city.point.stockpiles))
 
     def get_all_resource_names(self):
         return self.natural_resources | self.human_resources | self.technological_resources
@@ -716,59 +877,52 @@ class Map:
             n = generate_name_global()
             # print("generated name",n)
         # print("name {0} was accepted".format(n))
-        self.used_names.append(n)
+        self.used_names.add(n)
         return n
 
     def generate_elevation(self):
         """
-        this algorithm mandates an elevation shift of +1, 0, or -1 for a circle centered on each tile
-        radii in [1 ... 1/2*min(x,y)]
+        this algorithm mandates an elevation shift in [-2, 2] for a circle centered on each tile
+        radii in [1 ... 7]
+        returns a numpy array of shape (r_size, c_size)
         """
 
-        result = [[0 for c in range(self.c_size)] for r in range(self.r_size)]
-
-        # elevation grid creation part
-
-        # first algorithm; quite slow for larger inputs, but distribution representation must retain conditionality of adjacent elevations
-        # runs something like O(n^4) due to running through the whole grid for each spot, where n is grid side length
-        # O(n^2) in number of spots; still bad
-        # a lot of time was saved by rewriting grid_circle; self.generate_elevation() still runs in bad time, but practically I care less now
-
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                #height_shift = random.choice([-1,0,1])
-                height_shift = max(-2,min(2,random.normalvariate(0,1)))
-                #height_shift = random.choice([-2,-1,0,1,2])
-                #r = random.choice(range(1,math.ceil(0.5*min(self.r_size,self.c_size))))
-                r = random.choice(range(1,8)) # make the radius distribution independent of map size so larger maps don't necessarily have more variance
-                circle = grid_circle(self.r_size,self.c_size,row,col,r)
-                for c_row in range(self.r_size):
-                    for c_col_number in circle[c_row]:
-                        result[c_row][c_col_number] += height_shift
-
-        return result
+        # the old per-tile loop over grid_circle ran something like O(n^4), where n is grid side length
+        # now the shifts and radii are drawn all at once and summed as one FFT convolution per radius (see grid_disk_sum)
+        max_rad = 7 # make the radius distribution independent of map size so larger maps don't necessarily have more variance
+        # numpy generator seeded from random, so the map still depends only on the seed given to random
+        rng = np.random.default_rng(random.getrandbits(64))
+        height_shifts = np.clip(rng.normal(0, 1, size=(self.r_size, self.c_size)), -2, 2)
+        radii = rng.integers(1, max_rad+1, size=(self.r_size, self.c_size))
+        return grid_disk_sum(height_shifts, radii, max_rad)
 
     def fill_types(self):
         # area information filling part
+        el = self.elevation_grid
+        neighbor_min, neighbor_max = grid_neighbor_extremes(el)
+        is_water = (el < 0).tolist()
+        is_mountain = (el > 8).tolist()
+        is_peak = ((el > 8) & (el >= neighbor_max)).tolist()
+        is_shore = ((el >= 0) & (neighbor_min < 0)).tolist()
+        is_minimum = ((el >= 0) & (el <= neighbor_min)).tolist()
+
+        # the random draws (and cities and volcanoes) still happen tile by tile in row-major order
         for row in range(self.r_size):
             for col in range(self.c_size):
-                e = self.elevation_grid[row][col]
-                if e < 0:
-                    self.types[row][col].append("water")
-                if e >= 0:
-                    self.types[row][col].append("land")
-                if e > 8:
-                    self.types[row][col].append("mountain")
-                    if is_local_maximum(self.elevation_grid, row, col):
-                        self.types[row][col].append("peak")
+                types = self.types[row][col]
+                types.append("water" if is_water[row][col] else "land")
+                if is_mountain[row][col]:
+                    types.append("mountain")
+                    if is_peak[row][col]:
+                        types.append("peak")
                         if random.random() < 0.2:
-                            self.types[row][col].append("volcano")
+                            types.append("volcano")
                             self.add_volcano(row, col)
-                if is_on_shore(self.elevation_grid, row, col):
-                    self.types[row][col].append("shore")
+                if is_shore[row][col]:
+                    types.append("shore")
                     if random.random() < 0.1:
                         self.add_city(row,col)
-                if is_local_minimum(self.elevation_grid, row, col):
+                if is_minimum[row][col]:
                     if random.random() < 0.3:
                         self.add_city(row,col)
 
@@ -813,52 +967,31 @@ class Map:
     def get_route_between_cities(self, city1, city2):
         city1, city2 = sorted([city1, city2], key=lambda c: c.coordinates)
 
-        return self.routes[city1.coordinates][city2.coordinates]
+        return self.routes[city1][city2]
 
-    def get_routes(self):
+    def add_all_routes(self):
         """ All edges connecting nodes, not conditioned on navigability. """
-        d = {}
-        for city in sorted(self.cities, key=lambda c: c.coordinates):
-            # maintain upper-triangle form of this matrix
-            d[city] = {}
-            for other_city in self.cities:
-                if other_city is city:
-                    d[city][other_city] = None
-                elif other_city.coordinates < city.coordinates:
-                    d[city][other_city] = d[other_city][city]
-                else:
-                    route = Route([city, other_city], self.r_size, self.c_size, self.types)
-                    d[city][other_city] = route
-        return d
-
-    def get_trade_routes(self, overseas=True):
-        # because lists are not hashable, cannot use them as keys
-        # instead will just add lists with the coordinates of the cities to a list
-        # "list of lists of lists"
-
-        techs = {"ships"} if overseas else set()
-
-        result = []
-        for city in self.cities:
-            for other_city in self.cities:
-                route = self.routes[city][other_city]
-
-                # # trade route is unacceptable if line between cities contains mountains (allow water since ships exist)
-                # # will check types rather than elevations in case I later change the definitions of unacceptable types
-                # add_pair = True
-                # for type_lst in gl_types:
-                #     if bad_types & set(type_lst) != set([]): # if their intersection is nonempty, the line contains a bad type
-                #         add_pair = False
-                #         break
-                # if add_pair:
-                #     pair = {city,other_city}
-                #     if pair not in result:
-                #         # don't duplicate routes by having the other direction already added
-                #         result.append(pair)
-                if route is not None and route.is_navigable(techs):
-                    result.append(route)
-
-        return result
+        cities = sorted(self.cities, key=lambda c: c.coordinates)
+        for i, city in enumerate(cities):
+            # the city with the smaller coordinates is first in the route
+            for other_city in cities[i+1:]:
+                self.add_route(city, other_city)
+
+    def add_route(self, city, other_city):
+        route = Route([city, other_city], self.r_size, self.c_size, self.types)
+        self.routes[city][other_city] = route
+        self.routes[other_city][city] = route
+        self.trade_routes.add_route_if_navigable(route)
+        self.land_trade_routes.add_route_if_navigable(route)
+        return route
+
+    def remove_route(self, route):
+        city, other_city = route.cities
+        del self.routes[city][other_city]
+        del self.routes[other_city][city]
+        for trade_routes in [self.trade_routes, self.land_trade_routes]:
+            if route in trade_routes:
+                trade_routes.remove_route(route)
 
     def add_states(self, t):
         # t argument is not really used here except to access the right key in self.states
@@ -866,9 +999,11 @@ class Map:
         if t not in self.states:
             self.states[t] = {}
 
-        for n in self.land_trade_networks:
+        # networks and their cities are sorted by city index so that the same seed gives the same states
+        for n in sorted(self.get_trade_networks(overseas=False), key=lambda n: min(city.index for city in n)):
             #n = sorted(sorted(self.land_trade_networks, key = lambda c: c.coordinates)[j])
-            namesake_city = random.choice(list(n)) # get a random city in the network to name the state after
+            n_cities = sorted(n, key=lambda city: city.index)
+            namesake_city = random.choice(n_cities) # get a random city in the network to name the state after
             name = self.names[namesake_city.coordinates]
             name = name+(" City-State" if len(n) == 1 else " Kingdom") # name of state
             display_index = len(name) # we will only display the name itself in pretty output, omitting the establishment date
@@ -892,7 +1027,7 @@ class Map:
             })
 
             self.states[t][name] = state
-            for city in n:
+            for city in n_cities:
                 city.state = state
                 state.cities.append(city)
 
@@ -1045,46 +1180,9 @@ class Map:
         Takes an option to include water routes or not, defaulting to overseas=True.
         Returns a set whose elements are sets of towns in the same network of trade routes.
         """
-        if overseas:
-            tr = [i for i in self.trade_routes] # in case of mutation
-        else:
-            tr = [i for i in self.land_trade_routes]
-        networks = set()
-
-        # the set of cities left is the cities which have not been added to networks
-        cities_left = set(self.cities) #{city.coordinates for city in self.cities}
-        
-        while cities_left != set(): # make sure we get all the cities
-            network = set()
-            
-            start_city = random.choice(list(cities_left))
-            network.add(start_city)
-            cities_left -= {start_city}
-            
-            # set of cities whose connections should still be added to network
-            # the cities to consider will all already be in the network
-            cities_to_consider = {start_city}
-            
-            # steps:
-            # get a node from the set of cities to consider (seeded by each start city once a network is finished)
-            # add that node to the network
-            # remove that node from the set of cities to consider and the set of cities left
-            # add that node's connections to the set of cities to consider
-
-            while cities_to_consider != set():
-                node = random.choice(list(cities_to_consider))
-                network.add(node)
-                cities_to_consider -= {node}
-                cities_left -= {node}
-
-                connections = {i.get_other_city(node) for i in filter(lambda route: node in route.cities, tr)} # syntax works as a set as well as as a list
-                connections = {i for i in filter(lambda x: x in cities_left, connections)} # so we don't keep adding back cities that we already did
-                #network |= connections
-                cities_to_consider |= connections # "or equals" adds stuff using elementwise or operator (union); simil &= is intersection
-
-            networks.add(frozenset(network))
-
-        return networks
+        # the networks are kept up to date by the trade route index as routes are added and removed
+        trade_routes = self.trade_routes if overseas else self.land_trade_routes
+        return trade_routes.get_networks()
 
     def generate_rainfall(self):
         """
@@ -1094,24 +1192,14 @@ class Map:
         between sea level and some maximum height at that location.
         """
 
-        result = []
-
         default = 5
         addend = 2
         max_height = 15.0
 
-        for row in range(self.r_size):
-            row_result = []
-            reservoir = default
-            for col in range(self.c_size):
-                reservoir += addend
-                el = max(0,min(max_height,self.elevation_grid[row][col]))
-                ratio = float(el)/max_height
-                rainfall = ratio * reservoir
-                row_result.append(rainfall)
-            result.append(row_result)
-
-        return result
+        # the reservoir has picked up addend once per column by the time it reaches each column
+        reservoir = default + addend * np.arange(1, self.c_size+1)
+        ratio = np.clip(self.elevation_grid, 0, max_height)/max_height
+        return ratio * reservoir[np.newaxis,:]
 
     def generate_resources(self):
         """
@@ -1121,92 +1209,62 @@ class Map:
         """
 
         # resource_grid = [[{} for c in range(self.c_size)] for r in range(self.r_size)]
+        # each resource is computed as a whole grid from the numpy elevation and rainfall grids, then given to the points
+        resource_grids = {}
+        el = self.elevation_grid
+        is_water = np.array([["water" in types for types in row] for row in self.types], dtype=bool)
+        is_shore = np.array([["shore" in types for types in row] for row in self.types], dtype=bool)
 
         # human resources
 
         # population; works differently from all the others
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                if "city" in self.types[row][col]:
-                    city = [i for i in filter(lambda c: c.coordinates == (row,col), self.cities)][0]
-                    population = city.point.stockpiles["population"]
-                    # population = city.point.resources["population"]
-                else:
-                    population = 0
-                # resource_grid[row][col]["population"] = population
-                self.points[(row,col)].add_resource_amount("population", population)
+        # ints, as the stockpiles are; reversed so that when a tile has two cities the first one's population is used, as before
+        population = np.zeros(el.shape, dtype=int)
+        for city in reversed(self.cities):
+            population[city.coordinates] = city.point.stockpiles["population"]
+        resource_grids["population"] = population
         self.human_resources.add("population")
         
         # natural resources
 
         # oil
         oil_eg = self.generate_elevation()
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                oil = max(0, -10 - oil_eg[row][col])
-                # resource_grid[row][col]["oil"] = oil
-                self.points[(row,col)].add_resource_amount("oil", oil)
+        resource_grids["oil"] = np.maximum(0, -10 - oil_eg)
         self.natural_resources.add("oil")
 
         # fresh water
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                # only give the freshwater resource to inland places with rain
-                fw = self.rainfall[row][col]/5.0 if "shore" not in self.types[row][col] and "water" not in self.types[row][col] else 0
-                # resource_grid[row][col]["fresh_water"] = fw
-                self.points[(row,col)].add_resource_amount("fresh_water", fw)
+        # only give the freshwater resource to inland places with rain
+        resource_grids["fresh_water"] = np.where(is_shore | is_water, 0, self.rainfall/5.0)
         self.natural_resources.add("fresh_water")
 
         # rock
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                # rock = self.elevation_grid[row][col]/3.0 if "mountain" in self.types[row][col] else 0
-                rock = max(0, self.elevation_grid[row][col]/3.0)
-                # resource_grid[row][col]["rock"] = rock
-                self.points[(row,col)].add_resource_amount("rock", rock)
+        # rock = self.elevation_grid[row][col]/3.0 if "mountain" in self.types[row][col] else 0
+        resource_grids["rock"] = np.maximum(0, el/3.0)
         self.natural_resources.add("rock")
 
         # metal
         metal_eg = self.generate_elevation()
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                el = self.elevation_grid[row][col]
-                metal = max(0, 20 + metal_eg[row][col]) if el >= 2 else 0
-                # resource_grid[row][col]["metal"] = metal
-                self.points[(row,col)].add_resource_amount("metal", metal)
+        resource_grids["metal"] = np.where(el >= 2, np.maximum(0, 20 + metal_eg), 0)
         self.natural_resources.add("metal")
 
         # lava
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                # more lava is readily available next to low-lying volcanoes
-                neigh = neighbors(self.r_size,self.c_size,row,col,n=8)
-                next_to_volcano = False
-                for row_ in range(self.r_size):
-                    for col_ in neigh[row_]:
-                        if "volcano" in self.types[row_][col_]:
-                            next_to_volcano = True
-                lava = 20-self.elevation_grid[row][col] if next_to_volcano or random.random() < 0.05 else 0
-                # resource_grid[row][col]["lava"] = lava
-                self.points[(row,col)].add_resource_amount("lava", lava)
+        # more lava is readily available next to low-lying volcanoes
+        is_volcano = np.zeros(el.shape)
+        for volcano in self.volcanoes:
+            is_volcano[volcano.point.coordinates] = 1
+        next_to_volcano = grid_neighbor_extremes(is_volcano)[1] > 0
+        # the random draw is only made for tiles not next to a volcano, in row-major order
+        has_lava = next_to_volcano.copy()
+        has_lava[~next_to_volcano] = [random.random() < 0.05 for i in range(np.count_nonzero(~next_to_volcano))]
+        resource_grids["lava"] = np.where(has_lava, 20 - el, 0)
         self.natural_resources.add("lava")
 
         # grain
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                el = self.elevation_grid[row][col]
-                grain = (3.0-el)*self.rainfall[row][col]/3.0 if el >= 0 and el < 3 else 0
-                # resource_grid[row][col]["grain"] = grain
-                self.points[(row,col)].add_resource_amount("grain", grain)
+        resource_grids["grain"] = np.where((el >= 0) & (el < 3), (3.0-el)*self.rainfall/3.0, 0)
         self.natural_resources.add("grain")
 
         # wood
-        for row in range(self.r_size):
-            for col in range(self.c_size):
-                el = self.elevation_grid[row][col]
-                wood = abs(6.0-el)*self.rainfall[row][col]/3.0 if el >= 0 and el < 12 else 0
-                # resource_grid[row][col]["wood"] = wood
-                self.points[(row,col)].add_resource_amount("wood", wood)
+        resource_grids["wood"] = np.where((el >= 0) & (el < 12), abs(6.0-el)*self.rainfall/3.0, 0)
         self.natural_resources.add("wood")
 
         # technological resources
@@ -1214,12 +1272,14 @@ class Map:
         # their stockpiles will be built by self.develop_technology()
 
         for i in ["ships","guns","climbing_gear"]:
-            for row in range(self.r_size):
-                for col in range(self.c_size):
-                    # resource_grid[row][col][i] = 0
-                    self.points[(row,col)].add_resource_amount(i, 0)
+            resource_grids[i] = np.zeros(el.shape, dtype=int)
             self.technological_resources.add(i)
 
+        for resource_name, grid in resource_grids.items():
+            for row, amounts in enumerate(grid.tolist()):
+                for col, amount in enumerate(amounts):
+                    self.points[(row,col)].add_resource_amount(resource_name, amount)
+
         # return resource_grid
 
     def initiate_stockpiles(self):
@@ -1276,7 +1336,7 @@ class Map:
         #if city. != city.point.stockpiles["population"]:
             #raise Exception("The population of {0} is not working properly. city.population = {1}; city.point.stockpiles[\"population\"] = {2}".format(
                 #city.name, city.population, city.point.stockpiles["population"]))
-        for resource in self.get_all_resource_names():
+        for resource in sorted(self.get_all_resource_names()): # sorted so the random draws come in the same order every run
             if True: #resource != "population":
                 self.mine_resource(resource, city)
         city.point.stockpiles["population"] = int(city.point.stockpiles["population"])
@@ -1297,7 +1357,7 @@ class Map:
         #     from_city.point.stockpiles[resource], to_city.point.stockpiles[resource]))
 
     def trade_all_resources(self, from_city, to_city):
-        for resource in self.natural_resources | self.technological_resources:
+        for resource in sorted(self.natural_resources | self.technological_resources):
             self.trade_resource(resource, from_city, to_city)
 
     def kill_people(self, city, number):
@@ -1337,7 +1397,9 @@ class Map:
         to_city.point.add_stockpile_amount("population", n)
         from_city.point.add_stockpile_amount("population", -1*n)
         if from_city != to_city:
-            pass # self.output("Moved {n} people from {c_from} to {c_to}. Populations are now {p_from}, {p_to}.".format(
+            if n != 0:
+                self.record_event("migration", from_city=from_city.name, to_city=to_city.name, n=n)
+            # self.output("Moved {n} people from {c_from} to {c_to}. Populations are now {p_from}, {p_to}.".format(
             #     n=n, c_from=from_city.name, c_to=to_city.name, p_from=from_city.point.stockpiles["population"], p_to=to_city.point.stockpiles["population"]))
         else:
             pass # self.output("{n} people decided to stay in {c_from}. Population is {p_from}.".format(
@@ -1360,18 +1422,21 @@ class Map:
         self.points[coords].add_stockpile_amount(output_name, n_produced)
         for input_name in input_dict:
             self.points[coords].add_stockpile_amount(input_name, -1*n_produced*input_dict[input_name])
-
-    def develop_technology(self, city): # please note that order matters; don't use all the wood on ships and then get no climbing gear!
+        if n_produced > 0:
+            self.record_event("tech", city=self.names[coords], output=output_name, n=n_produced)
+
+    # outputs and the amount of each input per unit, in production order
+    # please note that order matters; don't use all the wood on ships and then get no climbing gear!
+    technology_recipes = [
+        ("climbing_gear", {"oil":10, "wood":20}), # think of it as heavy machinery but made of wood so we don't always need metal
+        ("ships", {"wood":10, "metal":20}),
+        ("guns", {"lava":3, "metal":5}),
+    ]
+
+    def develop_technology(self, city):
         coords = city.coordinates
-
-        # climbing gear # think of it as heavy machinery but made of wood so we don't always need metal
-        self.produce_resource(coords, "climbing_gear", {"oil":10, "wood":20})
-
-        # ships
-        self.produce_resource(coords, "ships", {"wood":10, "metal":20})
-
-        # guns
-        self.produce_resource(coords, "guns", {"lava":3, "metal":5})
+        for output_name, input_dict in self.technology_recipes:
+            self.produce_resource(coords, output_name, input_dict)
 
     def kill_people_at_random(self, city):
         kill_ratio = min(1, max(0, random.normalvariate(0, 0.05)))
@@ -1380,9 +1445,9 @@ class Map:
         self.kill_people(city, people_to_kill)
 
     def kill_people_from_volcano(self, volcano, power):
-        temp_output = ""
         people_killed = 0
-        temp_output += "Volcano {0} erupted with power {1:.2f}.".format(volcano.name, power) + "\n"
+        # one list entry per city with deaths
+        eruption = {"city": [], "effective_power": [], "deaths": [], "population": []}
         for city in self.cities:
             distance = d(city.point, volcano.point)
             # if distance == 0:
@@ -1398,13 +1463,175 @@ class Map:
             if people_to_kill > 0:
                 self.kill_people(city, people_to_kill)
                 people_killed += people_to_kill
-                temp_output += "Effective power in {1} was {0:.2f}, killing {2} people. New population is {3}.".format(
-                    effective_power, city.name, people_to_kill,
-                    city.point.stockpiles["population"]) + "\n"
+                eruption["city"].append(city.name)
+                eruption["effective_power"].append(effective_power)
+                eruption["deaths"].append(people_to_kill)
+                eruption["population"].append(city.point.stockpiles["population"])
 
         if people_killed > 0:
-            self.output(temp_output)
+            self.record_event("eruption", volcano=volcano.name, power=power, **eruption)
+
+
+
+class Economy:
+    """
+    The per-period economy of a Map (mining, technology, migration, mortality, trade) done for all cities at once.
+    Stockpiles and resource rates are (cities x resources) arrays, in the order of map.cities and sorted resource names,
+    and the trade graph is a sparse matrix over the cities' trade neighbors.
+    Each step updates every city from the same starting arrays rather than one city after another as the Map methods do,
+    so a run follows the city-by-city engine in distribution, not number for number.
+    The random numbers come from a numpy generator seeded from random, so a given seed always gives the same run.
+    """
+    def __init__(self, m):
+        self.map = m
+        self.cities = list(m.cities)
+        self.resource_names = sorted(m.get_all_resource_names())
+        self.resource_index = {name: i for i, name in enumerate(self.resource_names)}
+        self.population_index = self.resource_index["population"]
+        self.rates = np.array([[city.point.resources.get(name, 0) for name in self.resource_names] for city in self.cities], dtype=float)
+        self.stockpiles = np.array([[city.point.stockpiles.get(name, 0) for name in self.resource_names] for city in self.cities], dtype=float)
+        tradeable_names = m.natural_resources | m.technological_resources
+        self.is_tradeable = np.array([name in tradeable_names for name in self.resource_names])
+        self.is_scored = np.array([name != "population" for name in self.resource_names]) # as in Point.get_stockpile_score
+        self.coordinates = np.array([city.coordinates for city in self.cities], dtype=float)
+        self.city_names = np.array([city.name for city in self.cities], dtype=object) # for indexing by arrays in the events
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        self.population_history = [] # populations after each step
+        self.build_trade_graph()
+
+    def build_trade_graph(self):
+        """
+        Builds the sparse trade matrix from the cities' trade neighbors, as used for migration and trade in the city-by-city engine.
+        Call again if the trade neighbors change.
+        """
+        n_cities = len(self.cities)
+        city_index = {city: i for i, city in enumerate(self.cities)}
+        sources = []
+        destinations = []
+        for i, city in enumerate(self.cities):
+            for partner_city in city.get_trade_neighbors():
+                sources.append(i)
+                destinations.append(city_index[partner_city])
+        # trade_matrix[i, j] is 1 if j is a trade neighbor of i
+        self.trade_matrix = scipy.sparse.csr_matrix((np.ones(len(sources)), (sources, destinations)), shape=(n_cities, n_cities))
+        self.trade_sources, self.trade_destinations = self.trade_matrix.nonzero()
+        self.trade_degrees = np.diff(self.trade_matrix.indptr)
+        # trade_incidence @ (amount sent along each trade edge) is the change in each city's stockpile
+        n_edges = len(self.trade_sources)
+        edges = np.arange(n_edges)
+        self.trade_incidence = scipy.sparse.csr_matrix(
+            (np.r_[np.ones(n_edges), -np.ones(n_edges)], (np.r_[self.trade_destinations, self.trade_sources], np.r_[edges, edges])),
+            shape=(n_cities, n_edges))
+        # people can move to trade neighbors or stay put
+        self.migration_matrix = (self.trade_matrix + scipy.sparse.identity(n_cities, format="csr")).tocsr()
+        self.migration_matrix.sort_indices()
+
+    def get_populations(self):
+        return self.stockpiles[:, self.population_index].copy()
+
+    def set_populations(self, populations):
+        self.stockpiles[:, self.population_index] = populations
+
+    def get_stockpile_scores(self):
+        # as Point.get_stockpile_score
+        scores = (np.sqrt(1 + self.stockpiles[:, self.is_scored]) - 1).sum(axis=1)
+        return scores + (1 + self.get_populations())*100
+
+    def mine_all_resources(self):
+        # cannot mine resources without people there to do it
+        has_people = self.get_populations() >= 1
+        factors = np.clip(self.rng.normal(1, 0.3, size=self.rates.shape), 0.01, 100)
+        self.stockpiles += has_people[:, np.newaxis] * factors * self.rates
+        # Map.mine_resource's taxation factor is 1, so it is left out
+        self.set_populations(np.trunc(self.get_populations()))
+
+    def develop_technology(self):
+        for output_name, input_dict in Map.technology_recipes:
+            input_indices = [self.resource_index[name] for name in input_dict]
+            amounts_per_unit = np.array([input_dict[name] for name in input_dict], dtype=float)
+            n_produced = np.trunc((self.stockpiles[:, input_indices] / amounts_per_unit).min(axis=1))
+            self.stockpiles[:, self.resource_index[output_name]] += n_produced
+            self.stockpiles[:, input_indices] -= n_produced[:, np.newaxis] * amounts_per_unit
+            producers = np.nonzero(n_produced > 0)[0]
+            self.map.record_events("tech", city=self.city_names[producers], output=[output_name]*len(producers), n=n_produced[producers])
+
+    def move_people_out(self, n_moves=10):
+        """
+        Each city sends people n_moves times to itself or one of its trade neighbors, chosen with probability proportional to stockpile score
+        (scored once at the start), moving as many people as Map.move_people_between_cities does. All cities move at the same time in each round.
+        """
+        n_cities = len(self.cities)
+        indptr = self.migration_matrix.indptr
+        indices = self.migration_matrix.indices
+        # weighted choice within each row: a uniform draw scaled to the row's total weight, found in the cumulative weights of all rows
+        cumulative_weights = np.cumsum(self.get_stockpile_scores()[indices])
+        row_starts = np.r_[0, cumulative_weights][indptr[:-1]]
+        row_totals = cumulative_weights[indptr[1:] - 1] - row_starts
+        targets = row_starts[:, np.newaxis] + self.rng.random((n_cities, n_moves)) * row_totals[:, np.newaxis]
+        choices = np.searchsorted(cumulative_weights, targets, side="right")
+        choices = np.minimum(choices, (indptr[1:] - 1)[:, np.newaxis]) # in case of rounding at the end of a row
+        destinations = indices[choices]
+
+        staying = destinations == np.arange(n_cities)[:, np.newaxis]
+        for move_i in range(n_moves):
+            populations = self.get_populations()
+            to_cities = destinations[:, move_i]
+            amounts = np.maximum(np.ceil(populations/n_moves), np.minimum(populations, populations[to_cities]))
+            amounts[staying[:, move_i]] = 0
+            self.set_populations(populations - amounts + np.bincount(to_cities, weights=amounts, minlength=n_cities))
+            movers = np.nonzero(amounts > 0)[0]
+            self.map.record_events("migration", from_city=self.city_names[movers], to_city=self.city_names[to_cities[movers]], n=amounts[movers])
+
+    def kill_people_at_random(self):
+        kill_ratios = np.clip(self.rng.normal(0, 0.05, size=len(self.cities)), 0, 1)
+        populations = self.get_populations()
+        self.set_populations(populations - np.clip(np.trunc(populations * kill_ratios), 0, populations))
 
+    def kill_people_from_volcano(self, volcano, power):
+        # as Map.kill_people_from_volcano
+        distances = np.linalg.norm(self.coordinates - np.array(volcano.point.coordinates, dtype=float), axis=1)
+        with np.errstate(divide="ignore"):
+            effective_powers = power / distances**2 # inf in the volcano itself
+        effective_power_to_kill_half = 5
+        denom = effective_power_to_kill_half / 2.0
+        kill_ratios = np.maximum(0, 1 - denom / effective_powers) # should kill everyone if and only if city is in volcano
+        populations = self.get_populations()
+        people_to_kill = np.trunc(populations * kill_ratios)
+        self.set_populations(populations - people_to_kill)
+
+        killed = np.nonzero(people_to_kill > 0)[0]
+        if len(killed) > 0:
+            self.map.record_event("eruption", volcano=volcano.name, power=power, city=self.city_names[killed].tolist(),
+                effective_power=effective_powers[killed], deaths=people_to_kill[killed].astype(int),
+                population=(populations - people_to_kill)[killed].astype(int))
+
+    def trade_all_resources(self):
+        """
+        Every city gives each trade neighbor that has people part of the difference between their stockpiles, for the natural and technological resources.
+        Map.trade_resource gives half the difference to one neighbor after another; here all transfers are computed from the same stockpiles,
+        so each is also divided by the giver's number of trade neighbors, which keeps stockpiles from going negative.
+        """
+        if len(self.trade_sources) == 0:
+            return
+        tradeable = self.stockpiles[:, self.is_tradeable]
+        differences = tradeable[self.trade_sources] - tradeable[self.trade_destinations]
+        transfers = np.maximum(0, differences) / (2.0 * self.trade_degrees[self.trade_sources])[:, np.newaxis]
+        transfers[self.get_populations()[self.trade_destinations] < 1] = 0
+        self.stockpiles[:, self.is_tradeable] = tradeable + self.trade_incidence @ transfers
+
+    def step(self):
+        # the same order as the city-by-city engine in the main loop
+        self.mine_all_resources()
+        self.develop_technology()
+        self.move_people_out()
+        self.kill_people_at_random()
+        self.trade_all_resources()
+        self.population_history.append(self.get_populations())
+
+    def write_stockpiles(self):
+        # copy the arrays back to the cities' points, for what still reads them there (conquest, show_stockpiles)
+        for city, amounts in zip(self.cities, self.stockpiles.tolist()):
+            city.point.stockpiles.update(zip(self.resource_names, amounts))
 
 
 if __name__ == "__main__":
@@ -1414,6 +1641,9 @@ if __name__ == "__main__":
     parser.add_argument("-p", type=int, default=100, help="Number of periods to simulate")
     parser.add_argument("--no-show", dest="show_mode", action="store_false", help="Show plots, etc.; store_false")
     parser.add_argument("--no-output", dest="output_mode", action="store_false", help="Output to file; store_false")
+    parser.add_argument("--event-log", default="HistoryEvents.jsonl", help="Event log file")
+    parser.add_argument("-e", "--economy", choices=["matrix", "cities"], default="matrix",
+        help="Economy engine: arrays for all cities at once (Economy), or the Map methods city by city")
 
     args = parser.parse_args()
 
@@ -1424,57 +1654,82 @@ if __name__ == "__main__":
     map_dimensions = [int(i) for i in map_dimensions_input.split(",")]
 
     output_mode = args.output_mode
-    if output_mode:
-        open("HistoryOutput.txt", "w").close() # clear file
-
-    M = Map(map_dimensions[0], map_dimensions[1], output_mode)
+    # events go to the log during the simulation; HistoryOutput.txt is written from it at the end (or later with HistoryEvents.py)
+    event_log = he.EventLog(args.event_log) if output_mode else None
 
-    n_p = args.p
-    show_mode = args.show_mode
+    # the log is closed however the simulation ends, so its writer thread is stopped and what was recorded is written
+    try:
+        M = Map(map_dimensions[0], map_dimensions[1], output_mode, event_log)
+
+        n_p = args.p
+        show_mode = args.show_mode
+
+        if output_mode:
+            M.show_types()
+            #print("Populations:",sorted([city["population"] for city in M.cities]))
+            #print(M.states)
+            #print(M.rainfall)
+            #M.show_resources()
+
+        population_histories = {city.name:[] for city in M.cities}
+        economy = Economy(M) if args.economy == "matrix" else None
+        empty_cities = set()
+
+        print("Simulating {0} periods.".format(n_p))
+        if show_mode:
+            M.show_2d(style="contour", cities=True, t=0, trade_routes="all")
+        for t in range(n_p):
+            M.period = t
+            M.record_event("period")
+            print("Current period: {0}".format(t), end="\r")
+            for volcano in M.volcanoes:
+                power = int(volcano.erupt())
+                if power > 0:
+                    if economy is not None:
+                        economy.kill_people_from_volcano(volcano, power)
+                    else:
+                        M.kill_people_from_volcano(volcano, power)
+
+            if economy is not None:
+                economy.step()
+                economy.write_stockpiles()
+            else:
+                for city in sorted(M.cities, key = lambda x: x.name):
+                    M.mine_all_resources(city)
+                    M.develop_technology(city)
+                    M.move_people_out(city)
+                    M.kill_people_at_random(city)
+                    # to get the entire state for trade only along routes within the state
+                    for partner_city in city.trade_neighbors:
+                        M.trade_all_resources(city, partner_city)
+                    population_histories[city.name].append(city.point.stockpiles["population"])
+
+            # empty cities are left in place (City.destroy is not usable yet); they can't mine and don't receive trade
+            for city in M.cities:
+                if city.point.stockpiles["population"] < 1 and city not in empty_cities:
+                    print("No one lives in {0}.".format(city.name))
+                    empty_cities.add(city)
+
+            for state in M.get_states_as_of_time(t):
+                state.go_on_conquest()
+
+            if show_mode:
+                M.show_2d(style="contour", cities=True, t=t, trade_routes="all")
+
+            if output_mode:
+                M.record_stockpiles()
+        print()
+        if economy is not None and n_p > 0:
+            population_history = np.array(economy.population_history)
+            population_histories = {city.name: population_history[:, i].tolist() for i, city in enumerate(economy.cities)}
+        if output_mode:
+            M.show_stockpiles()
+    finally:
+        if event_log is not None:
+            event_log.close()
 
     if output_mode:
-        M.show_types()
-        #print("Populations:",sorted([city["population"] for city in M.cities]))
-        #print(M.states)
-        #print(M.rainfall)
-        #M.show_resources()
-
-    population_histories = {city.name:[] for city in M.cities}
-
-    print("Simulating {0} periods.".format(n_p))
-    M.show_2d(style="contour", cities=True, t=0, trade_routes="all")
-    for t in range(n_p):
-        M.output("\nCurrent period: {0}".format(t))
-        print("Current period: {0}".format(t), end="\r")
-        for volcano in M.volcanoes:
-            power = int(volcano.erupt())
-            if power > 0:
-                M.kill_people_from_volcano(volcano, power)
-
-        for city in sorted(M.cities, key = lambda x: x.name):
-            M.mine_all_resources(city)
-            M.develop_technology(city)
-            M.move_people_out(city)
-            M.kill_people_at_random(city)
-            # to get the entire state for trade only along routes within the state
-            for partner_city in city.trade_neighbors:
-                M.trade_all_resources(city, partner_city)
-            population_histories[city.name].append(city.point.stockpiles["population"])
-            if city.point.stockpiles["population"] < 1:
-                print("No one lives in {0}. Attempting to destroy it.".format(city.name))
-                city.destroy()
-
-        for state in M.get_states_as_of_time(t):
-            state.go_on_conquest()
-
-        M.show_2d(style="contour", cities=True, t=t, trade_routes="all")
-
-        M.show_stockpiles()
-    print()
-    if output_mode:
-        M.show_stockpiles()
-
-    M.flush_output("HistoryOutput.txt")
+        he.write_text_output(he.read_events(args.event_log), "HistoryOutput.txt")
 
     if show_mode:
         M.show_2d(style="contour", cities=True, t=0, trade_routes="all") # this is the one I like the most
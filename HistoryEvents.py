@@ -0,0 +1,224 @@
+# event log for History.py
+# the simulation records typed events (eruptions, conquests, migration, technology, stockpile snapshots, text messages)
+# into column buffers, one list per field per event type, which are handed in batches to a background thread that appends them
+# to a JSON lines file, one line per event type per batch with the columns as lists ("columnar" lines, like a row group)
+# text output and plots are made from the log afterwards (see write_text_output, plot_populations, and main below),
+# rather than during the simulation
+
+import argparse
+import json
+import queue
+import threading
+
+import matplotlib.pyplot as plt
+
+
+# fields of each event type, besides "seq" (order of recording, over all types) and "t" (period)
+EVENT_FIELDS = {
+    "map": ["r_size", "c_size", "elevation"],
+    "message": ["text"],
+    "period": [],
+    "eruption": ["volcano", "power", "city", "effective_power", "deaths", "population"], # city onward are lists, one entry per city with deaths
+    "conquest": ["conqueror", "conqueror_state", "conquered", "conquered_state"],
+    "migration": ["from_city", "to_city", "n"],
+    "tech": ["city", "output", "n"],
+    "stockpiles": ["city", "r", "c", "state", "stockpiles"], # stockpiles is a dict of resource amounts
+}
+
+
+def get_empty_columns(event_type):
+    return {field: [] for field in ["seq", "t"] + EVENT_FIELDS[event_type]}
+
+
+def to_json_value(x):
+    # numpy arrays and scalars
+    return x.tolist()
+
+
+class EventLog:
+    def __init__(self, filepath, batch_size=10000):
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.seq = 0
+        self.n_buffered = 0
+        self.buffers = {}
+        self.batches = queue.Queue()
+        self.error = None # set by the writer thread if writing fails
+        open(self.filepath, "w").close() # clear file
+        # daemon, so a simulation that dies without calling close() doesn't leave the process waiting on it
+        self.writer = threading.Thread(target=self.write_batches, name="EventLogWriter", daemon=True)
+        self.writer.start()
+
+    def record(self, event_type, t=None, **fields):
+        buffer = self.get_buffer(event_type)
+        buffer["seq"].append(self.seq)
+        buffer["t"].append(t)
+        for field in EVENT_FIELDS[event_type]:
+            buffer[field].append(fields[field])
+        self.seq += 1
+        self.n_buffered += 1
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def record_many(self, event_type, t=None, **columns):
+        # columns are sequences of the same length, one entry per event, e.g. numpy arrays from the Economy
+        n = len(columns[EVENT_FIELDS[event_type][0]])
+        if n == 0:
+            return
+        buffer = self.get_buffer(event_type)
+        buffer["seq"].extend(range(self.seq, self.seq + n))
+        buffer["t"].extend([t]*n)
+        for field in EVENT_FIELDS[event_type]:
+            values = columns[field]
+            assert len(values) == n, "column {0} of {1} event has {2} values, expected {3}".format(field, event_type, len(values), n)
+            buffer[field].extend(values.tolist() if hasattr(values, "tolist") else values)
+        self.seq += n
+        self.n_buffered += n
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def get_buffer(self, event_type):
+        if event_type not in self.buffers:
+            self.buffers[event_type] = get_empty_columns(event_type)
+        return self.buffers[event_type]
+
+    def flush(self):
+        # hand the current buffers to the writer and start new ones
+        self.raise_error() # nothing more is queued once the writer has failed
+        if self.n_buffered > 0:
+            self.batches.put(self.buffers)
+            self.buffers = {}
+            self.n_buffered = 0
+
+    def write_batches(self):
+        # runs in the writer thread until close() sends None, or until a write fails
+        try:
+            with open(self.filepath, "a") as f:
+                while True:
+                    batch = self.batches.get()
+                    if batch is None:
+                        return
+                    for event_type, columns in batch.items():
+                        f.write(json.dumps({"event": event_type, "n": len(columns["seq"]), "columns": columns}, default=to_json_value) + "\n")
+        except Exception as e:
+            self.error = e # raised on the simulation's thread by the next flush() or close()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.batches.put(None)
+            self.writer.join()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_events(filepath, event_types=None):
+    """
+    Returns the events in the log as a list of dicts with an "event" key for the type, in the order they were recorded.
+    """
+    events = []
+    with open(filepath) as f:
+        for line in f:
+            batch = json.loads(line)
+            if event_types is not None and batch["event"] not in event_types:
+                continue
+            columns = batch["columns"]
+            fields = list(columns.keys())
+            for values in zip(*[columns[field] for field in fields]):
+                event = dict(zip(fields, values))
+                event["event"] = batch["event"]
+                events.append(event)
+    events.sort(key=lambda e: e["seq"])
+    return events
+
+
+def get_event_text(event):
+    # the text History.py used to write to HistoryOutput.txt for this event, or None
+    event_type = event["event"]
+    if event_type == "message":
+        return event["text"]
+    if event_type == "period":
+        return "\nCurrent period: {0}".format(event["t"])
+    if event_type == "conquest":
+        return "{0} from {1} conquered {2} from {3}.".format(event["conqueror"], event["conqueror_state"], event["conquered"], event["conquered_state"])
+    if event_type == "eruption":
+        s = "Volcano {0} erupted with power {1:.2f}.".format(event["volcano"], event["power"]) + "\n"
+        for city, effective_power, deaths, population in zip(event["city"], event["effective_power"], event["deaths"], event["population"]):
+            s += "Effective power in {1} was {0:.2f}, killing {2} people. New population is {3}.".format(effective_power, city, deaths, population) + "\n"
+        return s
+    if event_type == "stockpiles":
+        stock = event["stockpiles"]
+        return "{0} ({1}, {2}) from {3}:".format(event["city"], event["r"], event["c"], event["state"]) + "\n" + \
+            str({key:("%.2f" % stock[key]) for key in sorted(stock)})
+    return None
+
+
+def write_text_output(events, filepath="HistoryOutput.txt"):
+    with open(filepath, "w") as f:
+        for event in events:
+            text = get_event_text(event)
+            if text is not None:
+                f.write(text + "\n")
+
+
+def get_population_histories(events):
+    # city name: list of (period, population) from the stockpile snapshots
+    histories = {}
+    for event in events:
+        if event["event"] == "stockpiles":
+            histories.setdefault(event["city"], []).append((event["t"], event["stockpiles"]["population"]))
+    return histories
+
+
+def plot_populations(events):
+    histories = get_population_histories(events)
+    world_population = {}
+    for history in histories.values():
+        plt.plot([t for t, population in history], [population for t, population in history])
+        for t, population in history:
+            world_population[t] = world_population.get(t, 0) + population
+    plt.show()
+    plt.close()
+    periods = sorted(world_population)
+    plt.plot(periods, [world_population[t] for t in periods])
+    plt.show()
+
+
+def plot_map(events, t=None):
+    # elevation with the cities sized by population at period t (default the last period with stockpiles)
+    map_event = [e for e in events if e["event"] == "map"][0]
+    stockpile_events = [e for e in events if e["event"] == "stockpiles"]
+    if t is None:
+        t = max(e["t"] for e in stockpile_events)
+    populations = [e["stockpiles"]["population"] for e in stockpile_events if e["t"] == t]
+    rs = [e["r"] for e in stockpile_events if e["t"] == t]
+    cs = [e["c"] for e in stockpile_events if e["t"] == t]
+    plt.imshow(map_event["elevation"], cmap="terrain")
+    plt.colorbar()
+    plt.scatter(cs, rs, s=[max(1, p)**0.5 for p in populations], c="r")
+    plt.title("period {0}".format(t))
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", nargs="?", default="HistoryEvents.jsonl", help="Event log written by History.py")
+    parser.add_argument("-o", default="HistoryOutput.txt", help="Text output to write")
+    parser.add_argument("--plot", action="store_true", help="Plot populations and the map")
+    args = parser.parse_args()
+
+    events = read_events(args.log)
+    write_text_output(events, args.o)
+    if args.plot:
+        plot_populations(events)
+        plot_map(events)
@@ -43,7 +43,7 @@ def exponential(d, max_d, max_change):
     return max_change * y
 
 def constant(d, max_d, max_change):
-    return max_change
+    return max_change * np.ones_like(d, dtype=float)
 
 ELEVATION_CHANGE_FUNCTIONS = {
     # function, spikiness
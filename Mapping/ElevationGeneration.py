@@ -18,9 +18,10 @@ import PlottingUtil as pu
 from ElevationGenerationMap import ElevationGenerationMap
 from IcosahedralGeodesicLattice import IcosahedralGeodesicLattice
 from LatitudeLongitudeLattice import LatitudeLongitudeLattice
+import ProjectStoreUtil as pstore
 
 
-MAPPING_PROJECT_DIR = "/home/wesley/programming/Mapping/Projects/"
+MAPPING_PROJECT_DIR = pstore.get_mapping_project_dir()  # set the MAPPING_PROJECT_DIR environment variable to change it
 
 
 def get_parameter_input(var_name, default_value):
@@ -71,12 +72,18 @@ def convert_expected_change_size_to_proportion(expected_change_size, n_points_to
 
 
 def get_project_versions_in_data_dir(data_dir, project_name):
-    regex = "EGD_{}_.*_v(.*).txt".format(project_name)
-    versions = [re.match(regex, f).group(1) for f in os.listdir(data_dir) if re.match(regex, f)]
-    return versions
+    # versions saved as one container per version, and older ones saved as one text file per key
+    # a version is numbers joined by "-", so checkpoints and the temp files of interrupted saves (EGD_P_v3.npz.tmp.npz) don't match
+    version_regex = "(\\d+(?:-\\d+)*)"
+    regexes = ["EGD_{}_v{}\\.npz$".format(project_name, version_regex), "EGD_{}_.*_v{}\\.txt$".format(project_name, version_regex)]
+    versions = {re.match(regex, f).group(1) for regex in regexes for f in os.listdir(data_dir) if re.match(regex, f)}
+    return list(versions)
 
 
 def get_key_strs_in_data_dir(data_dir, project_name, project_version):
+    data_fp = pstore.get_project_data_fp(project_name, project_version)
+    if os.path.exists(data_fp):
+        return pstore.read_metadata(data_fp)["keys"]
     regex = "EGD_{}_(.*)_v{}.txt".format(project_name, project_version)
     key_strs = [re.match(regex, f).group(1) for f in os.listdir(data_dir) if re.match(regex, f)]
     return key_strs
@@ -143,9 +150,9 @@ def get_map_and_version(from_image, from_data, project_name, load_project_versio
         m = ElevationGenerationMap(lattice)
         m.fill_all("elevation", 0)
         project_dir = MAPPING_PROJECT_DIR + "{}/".format(project_name)
-        os.mkdir(project_dir)
-        os.mkdir(project_dir + "Data/")
-        os.mkdir(project_dir + "Plots/")
+        # may already exist if an interrupted run is being resumed from its checkpoint
+        os.makedirs(project_dir + "Data/", exist_ok=True)
+        os.makedirs(project_dir + "Plots/", exist_ok=True)
         new_project_version = 0
 
     return m, new_project_version
@@ -155,6 +162,7 @@ if __name__ == "__main__":
     params = get_parameters_from_config_file()
 
     big_abs = params["big_abs"]
+    checkpoint_every_n_steps = params["checkpoint_every_n_steps"]
     critical_abs = params["critical_abs"]
     expected_change_size_proportion_or_n_points = params["expected_change_size_proportion_or_n_points"]
     expected_touches_per_point = params["expected_touches_per_point"]
@@ -179,6 +187,7 @@ if __name__ == "__main__":
     project_name = params["project_name"]
     reference_area_ratio_at_big_abs = params["reference_area_ratio_at_big_abs"]
     reference_area_ratio_at_sea_level = params["reference_area_ratio_at_sea_level"]
+    save_plot_frames = params["save_plot_frames"]
     sigma_when_big = params["sigma_when_big"]
     sigma_when_critical = params["sigma_when_critical"]
     sigma_when_small = params["sigma_when_small"]
@@ -245,6 +254,7 @@ if __name__ == "__main__":
             el_array = m.get_value_array("elevation")
             if max(el_array) - min(el_array) < 1:
                 raise Exception("elevation array might be all zero; double check it was loaded properly")
+        checkpoint_fp = pstore.get_checkpoint_fp(project_name, new_project_version)
         m.fill_elevations(
             n_steps=n_steps,
             plot_every_n_steps=plot_every_n_steps,
@@ -264,9 +274,14 @@ if __name__ == "__main__":
             spikiness=spikiness,
             volcanism_coefficient_for_elevation=volcanism_coefficient_for_elevation,
             volcanism_exponent_for_elevation=volcanism_exponent_for_elevation,
+            checkpoint_fp=checkpoint_fp,
+            checkpoint_every_n_steps=checkpoint_every_n_steps,
+            frame_dir=os.path.join(pstore.get_plots_dir(project_name), "Frames_v{}".format(new_project_version)) if save_plot_frames else None,
         )
-        m.save_data("elevation", project_name, new_project_version)
-        m.save_data("volcanism", project_name, new_project_version)
+        m.save_data(project_name, new_project_version, key_strs=["elevation", "volcanism"], metadata={"params": params, "n_steps": n_steps})
+        if os.path.exists(checkpoint_fp):
+            # only now that the map is saved; if saving failed, the next run resumes from the checkpoint
+            os.remove(checkpoint_fp)
         m.save_plot_image("elevation", project_name, new_project_version, size_inches=(36, 24))
         if generate_initial_elevation_changes:
             m.save_plot_image("volcanism", project_name, new_project_version, size_inches=(72, 48), cmap=pu.get_volcanism_colormap())
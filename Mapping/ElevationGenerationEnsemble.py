@@ -0,0 +1,184 @@
+# run many independent, seeded ElevationGeneration maps in parallel to explore parameters
+# configured by ParamConfigEnsemble.json: a base ParamConfig plus a grid and/or random sample of parameter overrides
+# the lattice is built once and shared read-only with the worker processes through shared memory
+
+import random
+import time
+import os
+import sys
+import csv
+import json
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from ElevationGenerationMap import ElevationGenerationMap
+from IcosahedralGeodesicLattice import IcosahedralGeodesicLattice
+from ElevationGeneration import MAPPING_PROJECT_DIR, convert_expected_change_size_to_proportion
+import ProjectStoreUtil as pstore
+
+
+FAULT_LINE_PARAM_NAMES = [
+    "n_fault_tripoints", "n_volcanism_steps", "max_volcanism_change_magnitude",
+    "min_volcanism_wavenumber", "max_volcanism_wavenumber",
+]
+HOTSPOT_PARAM_NAMES = ["n_hotspots", "hotspot_min_magnitude_factor", "hotspot_max_magnitude_factor"]
+FILL_ELEVATIONS_PARAM_NAMES = [
+    "positive_feedback_in_elevation", "reference_area_ratio_at_sea_level", "reference_area_ratio_at_big_abs",
+    "big_abs", "critical_abs", "mu_when_small", "mu_when_critical", "mu_when_big",
+    "sigma_when_small", "sigma_when_critical", "sigma_when_big", "land_proportion", "spikiness",
+    "volcanism_coefficient_for_elevation", "volcanism_exponent_for_elevation",
+]
+ELEVATION_PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+LATTICE_ARRAY_NAMES = ["xyz_coords", "latlondeg_coords", "adjacency_indptr", "adjacency_indices"]
+
+# set in each worker process by init_worker
+worker_lattice = None
+worker_shared_memory_blocks = []
+
+
+def get_ensemble_config(fp="ParamConfigEnsemble.json"):
+    with open(fp) as f:
+        return json.load(f)
+
+
+def get_run_specs(ensemble_config, base_params):
+    # one spec per map to generate: its run number, seed, and the parameter overrides it uses
+    rng = random.Random(ensemble_config["seed"])
+    settings = []
+    grid = ensemble_config.get("grid", {})
+    if len(grid) > 0:
+        names = sorted(grid)
+        for values in itertools.product(*[grid[name] for name in names]):
+            settings.append(dict(zip(names, values)))
+    random_ranges = ensemble_config.get("random_ranges", {})
+    for _ in range(ensemble_config.get("n_random_samples", 0)):
+        settings.append({name: rng.uniform(*random_ranges[name]) for name in sorted(random_ranges)})
+    if len(settings) == 0:
+        settings.append({})  # just replicate the base parameters
+
+    unknown_names = {name for setting in settings for name in setting} - set(base_params)
+    assert len(unknown_names) == 0, "ensemble varies parameters not in the base config: {}".format(sorted(unknown_names))
+
+    run_specs = []
+    for setting in settings:
+        for _ in range(ensemble_config.get("runs_per_setting", 1)):
+            run_number = len(run_specs)
+            run_specs.append({"run_number": run_number, "seed": ensemble_config["seed"] + run_number, "overrides": setting})
+    return run_specs
+
+
+def put_lattice_in_shared_memory(lattice):
+    # returns the SharedMemory blocks (the caller must unlink them) and picklable descriptions for the workers
+    blocks = []
+    descriptions = {}
+    for name in LATTICE_ARRAY_NAMES:
+        arr = np.asarray(getattr(lattice, name))
+        block = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)
+        shared[...] = arr
+        blocks.append(block)
+        descriptions[name] = (block.name, arr.shape, arr.dtype.str)
+    return blocks, descriptions
+
+
+def init_worker(iterations, shared_array_descriptions, kdtree):
+    global worker_lattice
+    arrays = {}
+    for name, (block_name, shape, dtype_str) in shared_array_descriptions.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        worker_shared_memory_blocks.append(block)  # keep a reference so the buffer stays mapped
+        arr = np.ndarray(shape, dtype=np.dtype(dtype_str), buffer=block.buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+    worker_lattice = IcosahedralGeodesicLattice.from_arrays(iterations, kdtree=kdtree, **arrays)
+
+
+def run_ensemble_member(run_spec, base_params, output_dir):
+    t0 = time.time()
+    params = dict(base_params)
+    params.update(run_spec["overrides"])
+    random.seed(run_spec["seed"])
+    np.random.seed(run_spec["seed"])
+
+    m = ElevationGenerationMap(worker_lattice)
+    m.fill_all("elevation", 0)
+    n_points_total = m.size()
+    expected_change_sphere_proportion = convert_expected_change_size_to_proportion(params["expected_change_size_proportion_or_n_points"], n_points_total)
+    n_steps = int(round(params["expected_touches_per_point"] / expected_change_sphere_proportion))
+
+    m.add_fault_lines(**{name: params[name] for name in FAULT_LINE_PARAM_NAMES})
+    m.add_hotspots(**{name: params[name] for name in HOTSPOT_PARAM_NAMES})
+    m.fill_elevations(
+        n_steps=n_steps,
+        plot_every_n_steps=0,
+        expected_change_sphere_proportion=expected_change_sphere_proportion,
+        **{name: params[name] for name in FILL_ELEVATIONS_PARAM_NAMES}
+    )
+
+    data_fp = os.path.join(output_dir, "EGD_run{:04d}.npz".format(run_spec["run_number"]))
+    run_metadata = {"run_number": run_spec["run_number"], "seed": run_spec["seed"], "params": params, "n_steps": n_steps, "n_points": n_points_total}
+    pstore.write_container(data_fp, {key_str: m.get_data_array(key_str) for key_str in ["elevation", "volcanism"]}, run_metadata)
+
+    elevation = m.get_data_array("elevation")
+    row = {"run_number": run_spec["run_number"], "seed": run_spec["seed"]}
+    row.update(run_spec["overrides"])
+    row["n_steps"] = n_steps
+    row["land_fraction"] = float(m.get_land_mask().mean())  # the map's own definition of land, elevation >= 0
+    for q, value in zip(ELEVATION_PERCENTILES, np.percentile(elevation, ELEVATION_PERCENTILES)):
+        row["elevation_p{}".format(q)] = float(value)
+    row["runtime_seconds"] = time.time() - t0
+    row["data_fp"] = data_fp
+    return row
+
+
+def write_summary_table(rows, output_fp):
+    fieldnames = []
+    for row in rows:
+        for k in row:
+            if k not in fieldnames:
+                fieldnames.append(k)
+    with open(output_fp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in sorted(rows, key=lambda r: r["run_number"]):
+            writer.writerow(row)
+
+
+def run_ensemble(ensemble_config, base_params, output_dir):
+    run_specs = get_run_specs(ensemble_config, base_params)
+    n_workers = ensemble_config.get("n_workers") or os.cpu_count()
+    print("running ensemble of {} maps on {} workers, output to {}".format(len(run_specs), n_workers, output_dir))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "ParamConfigEnsemble.json"), "w") as f:
+        json.dump({"ensemble_config": ensemble_config, "base_params": base_params, "run_specs": run_specs}, f, indent=4)
+
+    iterations = ensemble_config["lattice_iterations"]
+    lattice = IcosahedralGeodesicLattice(iterations=iterations)
+    blocks, descriptions = put_lattice_in_shared_memory(lattice)
+    rows = []
+    try:
+        with multiprocessing.Pool(n_workers, initializer=init_worker, initargs=(iterations, descriptions, lattice.kdtree)) as pool:
+            results = [pool.apply_async(run_ensemble_member, (run_spec, base_params, output_dir)) for run_spec in run_specs]
+            for result in results:
+                row = result.get()
+                rows.append(row)
+                print("finished run {} ({}/{}): land fraction {:.3f}, {:.1f} s".format(row["run_number"], len(rows), len(run_specs), row["land_fraction"], row["runtime_seconds"]))
+                # rewrite as we go so a long ensemble can be inspected before it finishes
+                write_summary_table(rows, os.path.join(output_dir, "EnsembleSummary.csv"))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    print("- done running ensemble")
+    return rows
+
+
+if __name__ == "__main__":
+    ensemble_config_fp = sys.argv[1] if len(sys.argv) > 1 else "ParamConfigEnsemble.json"
+    ensemble_config = get_ensemble_config(ensemble_config_fp)
+    with open(ensemble_config["base_param_config"]) as f:
+        base_params = json.load(f)
+    output_dir = os.path.join(MAPPING_PROJECT_DIR, "Ensembles", ensemble_config["ensemble_name"])
+    run_ensemble(ensemble_config, base_params, output_dir)
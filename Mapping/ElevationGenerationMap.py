@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.collections as mcollections
 import json
 import random
 import os
@@ -8,12 +9,15 @@ import networkx as nx
 from PIL import Image
 from sklearn.neighbors import KDTree
 from ArrayUtil import make_blank_condition_array, make_nan_array
-from LatitudeLongitudeLattice import LatitudeLongitudeLattice
 from IcosahedralGeodesicLattice import IcosahedralGeodesicLattice
 import PlottingUtil as pu
 from UnitSpherePoint import UnitSpherePoint
 import ElevationChangeFunctions as elfs
 import MapCoordinateMath as mcm
+import GraphUtil as gu
+import HydrologyUtil as hu
+import ProjectStoreUtil as pstore
+import LatticeRenderer as lr
 
 
 def add_datetime_to_fp(fp):
@@ -30,117 +34,175 @@ def check_is_point_index(p):
 
 
 class ElevationGenerationMap:
-    def __init__(self, lattice, data_dict=None, default_elevation=0):
+    def __init__(self, lattice, data_dict=None, data_arrays=None, default_elevation=0):
         self.lattice = lattice
-        self.data_dict = {p_i: {} for p_i in range(len(self.lattice.points))}
+        n_points = self.size()
+        # columnar storage: one contiguous float array per key, indexed by point index
+        self.data_arrays = {}
+        if data_arrays is not None:
+            for key_str, arr in data_arrays.items():
+                arr = np.array(arr, dtype=float)
+                assert arr.shape == (n_points,), "data array for {} has shape {}, expected ({},)".format(key_str, arr.shape, n_points)
+                self.data_arrays[key_str] = arr
         if data_dict is not None:
-            self.data_dict.update(data_dict)
+            # legacy format {p_i: {key_str: value}}
+            for p_i, d in data_dict.items():
+                for key_str, value in d.items():
+                    self.get_data_array(key_str)[p_i] = value
+        # conditions are stored as an index into a short list of callables, since many points share the same one
         default_condition = lambda x: True
-        self.condition_dict = {p_i: default_condition for p_i in range(len(self.lattice.points))}
-        self.frozen_points = set()
+        self.conditions = [default_condition]
+        self.condition_index_array = np.zeros(n_points, dtype=int)
+        self.frozen_mask = np.zeros(n_points, dtype=bool)
+        self.renderer = None  # made on the first draw and reused, see get_renderer
+
+    @property
+    def frozen_points(self):
+        return set(np.nonzero(self.frozen_mask)[0].tolist())
+
+    def get_data_array(self, key_str):
+        # the underlying array itself (not a copy), created as zeros if this key has no data yet
+        if key_str not in self.data_arrays:
+            self.data_arrays[key_str] = np.zeros(self.size(), dtype=float)
+        return self.data_arrays[key_str]
 
     def new_value_satisfies_condition(self, p, value):
         check_is_point_index(p)
-        condition = self.condition_dict.get(p)
+        condition = self.conditions[self.condition_index_array[p]]
         if callable(condition):
             res = condition(value)
-            assert type(res) in [bool, np.bool_], "invalid condition return value at {} for value {}: {} of type {}".format((x, y), value, res, type(res))
+            assert type(res) in [bool, np.bool_], "invalid condition return value at {} for value {}: {} of type {}".format(p, value, res, type(res))
             return res
         else:
             raise ValueError("invalid condition type {}".format(type(condition)))
 
+    def new_values_satisfy_conditions(self, point_indices, values):
+        # vectorized version of new_value_satisfies_condition, evaluates each distinct condition once on all of its points
+        res = np.ones(len(point_indices), dtype=bool)
+        condition_indices = self.condition_index_array[point_indices]
+        for condition_i in np.unique(condition_indices):
+            if condition_i == 0:
+                continue  # default condition, always satisfied
+            mask = condition_indices == condition_i
+            condition = np.vectorize(self.conditions[condition_i], otypes=[bool])
+            res[mask] = condition(values[mask])
+        return res
+
+    def add_changes_where_allowed(self, point_indices, key_str, changes):
+        # point_indices must not repeat; changes are skipped at frozen points and where the new value would violate the point's condition
+        arr = self.get_data_array(key_str)
+        new_values = arr[point_indices] + changes
+        allowed = ~self.frozen_mask[point_indices]
+        allowed[allowed] = self.new_values_satisfy_conditions(point_indices[allowed], new_values[allowed])
+        arr[point_indices[allowed]] = new_values[allowed]
+
     def fill_position(self, p, key_str, value):
         check_is_point_index(p)
-        assert p not in self.frozen_points, "can't change frozen point {}".format(p)
-        self.data_dict[p][key_str] = value
+        assert not self.frozen_mask[p], "can't change frozen point {}".format(p)
+        self.get_data_array(key_str)[p] = value
 
     def fill_point_set(self, point_set, key_str, value):
-        for p in point_set:
-            check_is_point_index(p)
-            if p not in self.frozen_points:
-                self.fill_position(p, key_str, value)
+        point_indices = np.fromiter(point_set, dtype=int, count=len(point_set))
+        point_indices = point_indices[~self.frozen_mask[point_indices]]
+        self.get_data_array(key_str)[point_indices] = value
 
     def fill_all(self, key_str, value):
-        for p in range(len(self.lattice.points)):
-            check_is_point_index(p)
-            self.fill_position(p, key_str, value)
+        assert not self.frozen_mask.any(), "can't change frozen points {}".format(sorted(self.frozen_points))
+        self.get_data_array(key_str)[:] = value
 
     def add_value_at_position(self, p, key_str, change):
-        if key_str not in self.data_dict[p]:
-            self.data_dict[p][key_str] = 0
-        self.data_dict[p][key_str] += change
+        # p and change can also be arrays; repeated indices accumulate
+        np.add.at(self.get_data_array(key_str), p, change)
 
     def get_value_at_position(self, p, key_str):
         check_is_point_index(p)
-        return self.data_dict[p].get(key_str, 0)
+        if key_str not in self.data_arrays:
+            return 0
+        return self.data_arrays[key_str][p]
 
     def get_value_array(self, key_str, points=None):
         # return all values of this str in order of point index
+        arr = self.get_data_array(key_str)
         if points is None:
-            points = list(range(len(self.lattice.points)))
-        return np.array([self.get_value_at_position(p, key_str) for p in points])
+            return arr.copy()
+        if not isinstance(points, np.ndarray):
+            points = np.fromiter(points, dtype=int, count=len(points))
+        return arr[points]
 
     def freeze_point(self, p):
         check_is_point_index(p)
-        self.frozen_points.add(p)
+        self.frozen_mask[p] = True
 
     def unfreeze_point(self, p):
         check_is_point_index(p)
-        self.frozen_points.remove(p)
+        assert self.frozen_mask[p], "point {} is not frozen".format(p)
+        self.frozen_mask[p] = False
 
     def unfreeze_all(self):
-        self.frozen_points = set()
+        self.frozen_mask[:] = False
 
     def size(self):
         return self.lattice.n_points()
 
     def add_condition_at_position(self, p, func):
-        assert callable(func)
         check_is_point_index(p)
-        self.condition_dict[p] = func
+        self.condition_index_array[p] = self.get_condition_index(func)
+
+    def get_condition_index(self, func):
+        assert callable(func)
+        for condition_i, condition in enumerate(self.conditions):
+            if condition is func:
+                return condition_i
+        self.conditions.append(func)
+        return len(self.conditions) - 1
 
     def get_neighbors(self, p):
         check_is_point_index(p)
         return self.lattice.adjacencies_by_point_index[p]
 
     def get_random_contiguous_region(self, p=None, radius=None, n_points=None, points_to_avoid=None, prioritize_internal_unfilled=False):
-        check_is_point_index(p)
+        region = self.get_random_contiguous_region_indices(p=p, radius=radius, n_points=n_points, points_to_avoid=points_to_avoid)
+        return set(region.tolist())
+
+    def get_random_contiguous_region_indices(self, p=None, radius=None, n_points=None, points_to_avoid=None):
+        if p is not None:
+            check_is_point_index(p)
         assert int(radius is None) + int(n_points is None) == 1, "need either radius or n_points but not both, got {} and {}".format(radius, n_points)
-        if points_to_avoid is None:
-            points_to_avoid = set()
-        points_to_avoid |= self.frozen_points
-        assert all(type(x) is int for x in points_to_avoid), "points to avoid needs all indices (int) but contains other things too: {}".format(points_to_avoid)
+        barrier_mask = self.frozen_mask.copy()
+        if points_to_avoid is not None:
+            assert all(type(x) in [int, np.int64] for x in points_to_avoid), "points to avoid needs all indices (int) but contains other things too: {}".format(points_to_avoid)
+            barrier_mask[list(points_to_avoid)] = True
         center_index = p
-        while center_index is None or center_index in points_to_avoid:
+        while center_index is None or barrier_mask[center_index]:
             center_index = self.lattice.get_random_point_index()
-        neighbors = [p_i for p_i in self.get_neighbors(center_index) if p_i not in points_to_avoid]
-        circle = self.get_circle_around_point(center_index, radius=radius, n_points=n_points, barrier_points=points_to_avoid)
-        return circle
+        return self.get_circle_indices_around_point(center_index, radius=radius, n_points=n_points, barrier_mask=barrier_mask)
 
     def get_circle_around_point(self, p, radius=None, n_points=None, barrier_points=None):
-        check_is_point_index(p)
         if barrier_points is None:
-            barrier_points = set()
+            barrier_mask = None
         else:
-            assert all(type(x) is int for x in barrier_points), "barrier points should be all point indices (int) but contains other types: {}".format(barrier_points)
-        assert p not in barrier_points, "can't make circle with center in barrier"
+            assert all(type(x) in [int, np.int64] for x in barrier_points), "barrier points should be all point indices (int) but contains other types: {}".format(barrier_points)
+            barrier_mask = np.zeros(self.size(), dtype=bool)
+            barrier_mask[list(barrier_points)] = True
+        circle = self.get_circle_indices_around_point(p, radius=radius, n_points=n_points, barrier_mask=barrier_mask)
+        return set(circle.tolist())
 
+    def get_circle_indices_around_point(self, p, radius=None, n_points=None, barrier_mask=None):
+        check_is_point_index(p)
+        assert barrier_mask is None or not barrier_mask[p], "can't make circle with center in barrier"
         assert int(radius is None) + int(n_points is None) == 1, "need either radius or n_points but not both, got {} and {}".format(radius, n_points)
 
         # can tell which points are on inside vs outside of barrier wall by doing this:
-        # assign weight of 0.5 to each transition into and out of the barrier (edges in the lattice's graph)
-        # so each point in the lattice is associated with a number of barrier crossings
-        # those ending in 0.5 are in the barrier itself, those == 1 mod 2 are on the other side
-        # so take those == 0 mod 2
+        # count each transition into and out of the barrier (edges in the lattice's graph) as one crossing
+        # so each point in the lattice is associated with a minimum number of barrier crossings
+        # odd counts are in the barrier itself, those == 2 mod 4 are on the other side
+        # so take those == 0 mod 4
 
-        g = self.lattice.graph
-        xyz_as_one_sample = np.array([self.lattice.points[p].get_coords("xyz"),])
+        xyz_as_one_sample = self.lattice.xyz_coords[p].reshape(1, 3)
         if n_points is not None:
             subgraph_node_indices = self.lattice.kdtree.query(xyz_as_one_sample, k=n_points, return_distance=False)
             # print("queried n_points {}, got {}".format(n_points, subgraph_node_indices))
         elif radius is not None:
-            # subgraph = nx.ego_graph(g, p, radius=radius)
-            # print("subgraph from radius={} has {} nodes".format(radius, subgraph.number_of_nodes()))
             subgraph_node_indices = self.lattice.kdtree.query_radius(xyz_as_one_sample, radius)
             # print("queried radius {}, got {}".format(radius, subgraph_node_indices))
         else:
@@ -150,107 +212,41 @@ class ElevationGenerationMap:
         assert len(subgraph_node_indices) == 1  # scikit-learn gives an array of indices for each queried point, here we only queried one
         index_array = subgraph_node_indices[0]
         assert index_array.ndim == 1  # 1D array of point indices
-        subgraph_node_indices = list(index_array)
-        # print("resulting subgraph node indices (len {}):".format(len(subgraph_node_indices)))
-        # print(subgraph_node_indices)
-
-        subgraph = g.subgraph(subgraph_node_indices)
-        # print("subgraph from radius={}, n_points={} has {} nodes".format(radius, n_points, subgraph.number_of_nodes()))
-        # print("some nodes from g: {}".format(list(g.nodes())[:5]))  # debugging what kinds of objects are in the graph
-
-        if len(barrier_points) == 0:
-            # don't do any graph computation, just return whole subgraph
-            return set(subgraph.nodes)
-        # add weights of 0.5 to any edge transitioning between barrier and non-barrier
-        for n in subgraph.nodes:
-            subgraph.nodes[n]["in_barrier"] = n in barrier_points
-        for e in subgraph.edges:
-            p0, p1 = e
-            in_0 = p0 in barrier_points
-            in_1 = p1 in barrier_points
-            is_crossing = (in_0 and not in_1) or (in_1 and not in_0)
-            subgraph.edges[p0, p1]["weight"] = 0.5 if is_crossing else 0
-
-        # # debug
-        # for e in subgraph.edges:
-        #     p0, p1 = e
-        #     print("edge {} -> {} = {}".format(p0.get_coords("latlondeg"), p1.get_coords("latlondeg"), subgraph.edges[e]["weight"]))
-
-        # now get shortest paths from the center to every other point in the ego graph
-        # the weights of these paths will indicate whether they are on the same side of the barrier or not
-        points_on_same_side_of_barrier = set()
-        other_points = set()  # for debugging, can look at what was selected and what wasn't
-        for p1 in subgraph.nodes:
-            shortest_path_length = nx.shortest_path_length(subgraph, source=p, target=p1, weight="weight")
-            # print("path {} -> {} = {}".format(p.get_coords("latlondeg"), p1.get_coords("latlondeg"), shortest_path_length))
-            # if weight param is a string, it will use the edge data attribute with that name
-            if shortest_path_length % 2 == 0:
-                points_on_same_side_of_barrier.add(p1)
-            else:
-                other_points.add(p1)
-
-        # # debug: plot the subgraph and whether points were chosen or not
-        # print("plotting subgraph for circle with radius {}".format(radius))
-        # chosen_points_latlon = [p.get_coords("latlondeg") for p in points_on_same_side_of_barrier]
-        # other_points_latlon = [p.get_coords("latlondeg") for p in other_points]
-        # xs = [ll[0] for ll in chosen_points_latlon] + [ll[0] for ll in other_points_latlon]
-        # ys = [ll[1] for ll in chosen_points_latlon] + [ll[1] for ll in other_points_latlon]
-        # colors = ["r" for ll in chosen_points_latlon] + ["b" for ll in other_points_latlon]
-        # plt.scatter(xs, ys, c=colors)
+
+        if barrier_mask is None or not barrier_mask[index_array].any():
+            # no barrier in the region, don't do any graph computation, just return all of it
+            return index_array
+
+        region_mask = np.zeros(self.size(), dtype=bool)
+        region_mask[index_array] = True
+        indptr, indices = self.lattice.get_adjacency_csr()
+        crossings = gu.get_barrier_crossing_counts(indptr, indices, p, region_mask, barrier_mask)
+        crossings_in_region = crossings[index_array]
+        points_on_same_side_of_barrier = index_array[(crossings_in_region >= 0) & (crossings_in_region % 4 == 0)]
+
+        # # debug: plot the region and whether points were chosen or not
+        # chosen = (crossings_in_region >= 0) & (crossings_in_region % 4 == 0)
+        # latlons = mcm.unit_vector_cartesian_to_lat_lon(*self.lattice.xyz_coords[index_array].T)
+        # plt.scatter(latlons[0], latlons[1], c=np.where(chosen, "r", "b"))
         # plt.show()
 
-        assert p in points_on_same_side_of_barrier  # should return itself
         return points_on_same_side_of_barrier
 
-    def get_distances_from_edge(self, point_set, use_scipy_method=True):
-        # if use_scipy_method:  # TODO see if there is an equivalent "distance transform" function for arbitrary lattice points
-        if False:
-            pass
-        #     min_x = np.inf
-        #     max_x = -np.inf
-        #     min_y = np.inf
-        #     max_y = -np.inf
-        #     for p in point_set:
-        #         x, y = p
-        #         min_x = min(x, min_x)
-        #         max_x = max(x, max_x)
-        #         min_y = min(y, min_y)
-        #         max_y = max(y, max_y)
-        #     
-        #     # put them in an array
-        #     to_relative_coords = lambda p: (p[0]-min_x, p[1]-min_y)
-        #     to_absolute_coords = lambda p: (p[0]+min_x, p[1]+min_y)
-        #     arr_x_size = max_x - min_x + 1
-        #     arr_y_size = max_y - min_y + 1
-        #     arr = np.zeros((arr_x_size, arr_y_size))
-        #     rels = {}
-        #     for p in point_set:
-        #         xrel, yrel = to_relative_coords(p)
-        #         rels[p] = (xrel, yrel)
-        #         arr[xrel, yrel] = 1
-        #     distance_transform_matrix = ndimage.morphology.distance_transform_edt(arr)
-        #     res = {}
-        #     for p in point_set:
-        #         xrel, yrel = rels[p]
-        #         d = distance_transform_matrix[xrel, yrel]
-        #         res[p] = d - 1
-        #     return res
-
-        else:
-            # old way, slower than scipy
-            if len(point_set) == 0:
-                return {}
-            res = {}
-            points_on_edge = [p for p in point_set if any(n not in point_set for n in self.get_neighbors(p))]  # flagged as slow: genexpr
-            assert len(points_on_edge) > 0, "point set has no edge members:\n{}".format(sorted(point_set))
-            for p in points_on_edge:
-                res[p] = 0
-            interior_point_set = point_set - set(points_on_edge)
-            if len(interior_point_set) > 0:
-                interior_distances = self.get_distances_from_edge(interior_point_set, use_scipy_method=False)
-                for p, d in interior_distances.items():
-                    res[p] = d + 1
-            return res
+    def get_distances_from_edge(self, point_set):
+        if len(point_set) == 0:
+            return {}
+        point_indices = np.fromiter(point_set, dtype=int, count=len(point_set))
+        distance_array = self.get_distance_array_from_edge(point_indices)
+        return dict(zip(point_indices.tolist(), distance_array.tolist()))
+
+    def get_distance_array_from_edge(self, point_indices):
+        # hop distance of each point from the edge of the region (edge points are 0), aligned with point_indices
+        region_mask = np.zeros(self.size(), dtype=bool)
+        region_mask[point_indices] = True
+        indptr, indices = self.lattice.get_adjacency_csr()
+        distances = gu.get_distances_from_boundary(indptr, indices, region_mask)[point_indices]
+        assert (distances >= 0).all(), "point set has no edge members:\n{}".format(sorted(point_indices[distances < 0]))
+        return distances
 
     def make_random_elevation_change(self, 
             expected_change_sphere_proportion=None,
@@ -297,22 +293,15 @@ class ElevationGenerationMap:
         else:
             raise Exception("making elevation change on non-geodesic lattice is deprecated, this lattice is a {}".format(type(self.lattice)))
 
-        changing_reg = self.get_random_contiguous_region(center_index, radius=radius_from_center_in_3d, points_to_avoid=self.frozen_points)
+        changing_reg = self.get_random_contiguous_region_indices(center_index, radius=radius_from_center_in_3d)
         changing_reg_n_points = len(changing_reg)
         # print("proportion {} got {} changing points from lattice with {} points (got proportion {})".format(expected_change_sphere_proportion, changing_reg_n_points, len(self.lattice.points), changing_reg_n_points/len(self.lattice.points)))
-        changing_reg_usps = [self.lattice.points[p_i] for p_i in changing_reg]
-        ps_xyz = [np.array(p.get_coords("xyz")) for p in changing_reg_usps]
-        mean_ps_xyz = sum(ps_xyz) / len(ps_xyz)  # don't use np.mean here or it will give you a single scalar, mean of all values
-        assert len(mean_ps_xyz) == 3, "ya done goofed. look -> {}".format(mean_ps_xyz)
-        mean_ps_xyz = np.array(mean_ps_xyz)
+        elevation_array = self.get_data_array("elevation")
+        mean_ps_xyz = self.lattice.xyz_coords[changing_reg].mean(axis=0)
+        assert mean_ps_xyz.shape == (3,), "ya done goofed. look -> {}".format(mean_ps_xyz)
         mean_ps_xyz /= np.linalg.norm(mean_ps_xyz)  # normalize
-        mean_ps_latlon = mcm.unit_vector_cartesian_to_lat_lon(*mean_ps_xyz, deg=True)
-        coords_dict = {"xyz": tuple(mean_ps_xyz), "latlondeg": tuple(mean_ps_latlon)}
-        changing_reg_center_of_mass_raw = UnitSpherePoint(coords_dict)
-        changing_reg_center_of_mass = self.lattice.closest_point_to(changing_reg_center_of_mass_raw)
-        com_index = self.lattice.usp_to_index[changing_reg_center_of_mass]
-        e_center_of_mass = self.get_value_at_position(com_index, "elevation")
-        reference_p = changing_reg_center_of_mass
+        com_index = self.lattice.closest_point_indices_to_xyz(mean_ps_xyz.reshape(1, 3))[0]
+        e_center_of_mass = elevation_array[com_index]
 
         # try to get mountain chains to propagate:
         # if center point is low abs, look at bigger region, might catch mountain
@@ -325,17 +314,16 @@ class ElevationGenerationMap:
 
         assert np.isfinite(reference_area_ratio), "reference area ratio = {}, from e_center_of_mass={}, big_abs={}".format(reference_area_ratio, e_center_of_mass, big_abs)
 
-        reference_p_i = self.lattice.usp_to_index[reference_p] 
         reference_n_points = max(1, int(round(reference_area_ratio * changing_reg_n_points)))
-        reference_reg = self.get_circle_around_point(reference_p_i, n_points=reference_n_points)
-        elevations_in_refreg = [self.get_value_at_position(p_i, "elevation") for p_i in reference_reg]
+        reference_reg = self.get_circle_indices_around_point(com_index, n_points=reference_n_points)
+        elevations_in_refreg = elevation_array[reference_reg]
         e_avg = np.mean(elevations_in_refreg)
         e_max = np.max(elevations_in_refreg)
         e_min = np.min(elevations_in_refreg)
         elevation_sign = (1 if e_avg > 0 else -1)
 
-        distances = self.get_distances_from_edge(changing_reg)
-        max_d = max(distances.values())
+        distance_array = self.get_distance_array_from_edge(changing_reg)
+        max_d = distance_array.max()
         if max_d == 0:
             raw_func = elfs.constant
         else:
@@ -406,7 +394,7 @@ class ElevationGenerationMap:
 
         # add effects of volcanism, crude approximation for now
         # volcanism_array_of_refreg = self.get_value_array("volcanism", reference_reg)  # slow?
-        volcanism_array_of_refreg = np.array([self.get_value_at_position(p_i, "volcanism") for p_i in reference_reg])
+        volcanism_array_of_refreg = self.get_data_array("volcanism")[reference_reg]
         average_volcanism_in_refreg = volcanism_array_of_refreg.mean()
         assert np.isfinite(average_volcanism_in_refreg)
         if abs(e_avg) > big_abs:
@@ -425,13 +413,8 @@ class ElevationGenerationMap:
 
         max_change = np.random.normal(mu, sigma)
 
-        func = lambda d: raw_func(d, max_d, max_change)
-        changes = {p: func(d) for p, d in distances.items() if p not in self.frozen_points}
-        for p, d_el in changes.items():
-            current_el = self.get_value_at_position(p, "elevation")
-            new_el = current_el + d_el
-            if self.new_value_satisfies_condition(p, new_el):
-                self.fill_position(p, "elevation", new_el)
+        changes = raw_func(distance_array, max_d, max_change)
+        self.add_changes_where_allowed(changing_reg, "elevation", changes)
 
     # def get_random_zero_loop(self):
     #     x0_0, y0_0 = self.get_random_point(border_width=2)
@@ -477,11 +460,24 @@ class ElevationGenerationMap:
         spikiness=None,
         volcanism_coefficient_for_elevation=None,
         volcanism_exponent_for_elevation=None,
+        checkpoint_fp=None,
+        checkpoint_every_n_steps=None,
+        frame_dir=None,
     ):
+        # with frame_dir, the progress plots are written there as PNG frames instead of shown
         plot_progress = type(plot_every_n_steps) is int and plot_every_n_steps > 0
         if plot_progress:
-            plt.ion()
+            if frame_dir is None:
+                plt.ion()
+            else:
+                os.makedirs(frame_dir, exist_ok=True)
         i = 0
+        # a checkpoint left by an interrupted run is picked up here and the run continues from its step
+        if checkpoint_fp is not None and os.path.exists(checkpoint_fp):
+            i = self.load_checkpoint(checkpoint_fp, n_steps)
+            print("resuming from checkpoint {} at step {}".format(checkpoint_fp, i))
+        save_checkpoints = checkpoint_fp is not None and type(checkpoint_every_n_steps) is int and checkpoint_every_n_steps > 0
+        start_i = i
         t0 = datetime.now()
         while True:
             if n_steps is None:
@@ -495,7 +491,7 @@ class ElevationGenerationMap:
                 try:
                     dt = datetime.now() - t0
                     n_left = n_steps - i
-                    secs_per_step = dt/i
+                    secs_per_step = dt/(i - start_i)
                     eta = secs_per_step * n_left
                     eta_str = str(eta)
                     print("step {}, {} elapsed, {} ETA".format(i, dt, eta_str))
@@ -520,11 +516,44 @@ class ElevationGenerationMap:
                 volcanism_exponent_for_elevation=volcanism_exponent_for_elevation,
             )
             if plot_progress and i % plot_every_n_steps == 0:
-                try:
+                if frame_dir is None:
                     self.draw()
-                except ValueError:
-                    print("skipping ValueError in ElevationGenerationMap.draw()")
+                else:
+                    self.save_frame("elevation", os.path.join(frame_dir, "EGF_step{:07d}.png".format(i)))
             i += 1
+            if save_checkpoints and i % checkpoint_every_n_steps == 0 and i < n_steps:
+                self.save_checkpoint(checkpoint_fp, i, n_steps)
+        if save_checkpoints and i > start_i:
+            # the finished map, so that if the caller's save fails, rerunning picks it up at the end instead of losing the run
+            # the checkpoint is left in place; the caller deletes it once the map is saved
+            self.save_checkpoint(checkpoint_fp, i, n_steps)
+
+    def save_checkpoint(self, checkpoint_fp, step, n_steps):
+        # everything needed to continue fill_elevations exactly where it left off, including the random number generator states
+        # conditions are functions and are not saved; a resumed map must set up the same conditions in the same order (as from_image does)
+        random_state_metadata, numpy_random_keys = pstore.get_random_states()
+        arrays = dict(self.data_arrays)
+        arrays["__frozen_mask__"] = self.frozen_mask
+        arrays["__condition_index_array__"] = self.condition_index_array
+        arrays["__numpy_random_keys__"] = numpy_random_keys
+        metadata = {"step": step, "n_steps": n_steps, "n_points": self.size()}
+        metadata.update(random_state_metadata)
+        pstore.write_container(checkpoint_fp, arrays, metadata, compress=False)  # uncompressed since it is rewritten often
+
+    def load_checkpoint(self, checkpoint_fp, n_steps):
+        # returns the step to continue from
+        metadata = pstore.read_metadata(checkpoint_fp)
+        assert metadata["n_points"] == self.size(), "checkpoint {} has {} points, map has {}".format(checkpoint_fp, metadata["n_points"], self.size())
+        assert metadata["n_steps"] == n_steps, "checkpoint {} is for a run of {} steps, not {}; delete it to start over".format(checkpoint_fp, metadata["n_steps"], n_steps)
+        arrays = pstore.read_all_arrays(checkpoint_fp)
+        self.frozen_mask = arrays.pop("__frozen_mask__")
+        condition_index_array = arrays.pop("__condition_index_array__")
+        assert condition_index_array.max() < len(self.conditions), "checkpoint {} uses conditions this map does not have".format(checkpoint_fp)
+        self.condition_index_array = condition_index_array
+        numpy_random_keys = arrays.pop("__numpy_random_keys__")
+        self.data_arrays = {key_str: np.array(arr, dtype=float) for key_str, arr in arrays.items()}
+        pstore.set_random_states(metadata, numpy_random_keys)
+        return metadata["step"]
 
     def add_fault_lines(self, 
             n_fault_tripoints=None, 
@@ -534,57 +563,24 @@ class ElevationGenerationMap:
             max_volcanism_wavenumber=None,
     ):
         print("adding fault lines")
-        # draw a fault line between each pair of tripoints
+        # draw a fault line between each tripoint and its three nearest other tripoints
         tripoints = set()
         while len(tripoints) < n_fault_tripoints:
             new_tripoint = self.lattice.get_random_point_index()
             tripoints.add(new_tripoint)
-        # edge_assignments = {}
-        # unhappy_points = set(tripoints)  # put points here if they have 0 or 1 fault line touching them; they must have 2 or 3
-        # saturated_points = set()  # put points here once they have 3 fault lines; don't accept more
+        tripoint_list = list(tripoints)
+        # one query for all tripoints; the nearest result for each is itself, so skip it
+        tripoint_kdtree = KDTree(self.lattice.xyz_coords[tripoint_list])
+        n_nearest = min(4, len(tripoint_list))
+        nearest_raw = tripoint_kdtree.query(self.lattice.xyz_coords[tripoint_list], k=n_nearest, return_distance=False)
         existing_fault_points = set()  # put points here so the faults won't cross
-        # fault_lines_by_point = {p: 0 for p in tripoints}
-        # while len(unhappy_points) > 0:
-        # for a in edge_assignments:
-        #     for b in edge_assignments[a]:
-        #         ?
-            # useable_points = tripoints - saturated_points
-            # a = random.choice(list(useable_points))
-            # b_candidates = list(useable_points - {a})
-        for a in tripoints:
-            b_candidates = list(tripoints - {a})
-            xyz_a = np.array(self.lattice.points[a].get_coords("xyz"))
-            b_xyzs = [np.array(self.lattice.points[bc].get_coords("xyz")) for bc in b_candidates]
-            ds = [np.linalg.norm(xyz - xyz_a) for xyz in b_xyzs]
-            three_neighbors = []
-            for i in range(3):
-                min_i = ds.index(min(ds))
-                three_neighbors.append(b_candidates[min_i])
-                ds.remove(ds[min_i])
-            # b = b_candidates[min_index]
-            # if len(useable_points) > 1:
-            #     pair = random.sample(useable_points, 2)
-            # except ValueError:
-            #     # sample larger than population, allow a saturated point to be used
-            #     assert len(useable_points) == 1, "useable points has len {}".format(len(useable_points))
-            #     u_p = list(useable_points)[0]
-            #     s_p = random.choice(list(tripoints))
-            #     pair = (u_p, s_p)
-            # a, b = pair
+        for a, nearest_row in zip(tripoint_list, nearest_raw):
+            three_neighbors = [tripoint_list[n_i] for n_i in nearest_row if tripoint_list[n_i] != a][:3]
             for b in three_neighbors:
                 other_tripoints = tripoints - {a, b}
                 points_to_avoid = existing_fault_points | other_tripoints
                 path = self.lattice.get_random_path(a, b, points_to_avoid)
                 existing_fault_points |= path
-                # fault_lines_by_point[a] += 1
-                # fault_lines_by_point[b] += 1
-            # for p in {a, b}:
-            #     if fault_lines_by_point[p] > 1:
-            #         unhappy_points -= {p}
-            #     if fault_lines_by_point[p] > 2:
-            #         saturated_points.add(p)
-                # for p in path:
-                #     self.fill_position(p, "volcanism", abs(random.normalvariate(1, 0.5)))
 
         # after all the lines are created
         # self.fill_point_set(existing_fault_points, "volcanism", 1)  # simplest case, use for debugging path placement
@@ -595,7 +591,7 @@ class ElevationGenerationMap:
             min_volcanism_wavenumber=min_volcanism_wavenumber,
             max_volcanism_wavenumber=max_volcanism_wavenumber,
         )
-        print("there are {} fault points out of {} total".format(len(existing_fault_points), len(self.lattice.points)))
+        print("there are {} fault points out of {} total".format(len(existing_fault_points), self.size()))
         print("- done adding fault lines")
 
     def fill_fault_points_with_volcanism_values(self, 
@@ -611,53 +607,44 @@ class ElevationGenerationMap:
 
         # TODO might be nice to implement a more general "create data" function that uses the elevation logic
         # - and apply that to any subgraph/lattice, so here can just pass it only the fault points instead of the whole globe
-        ps = list(fault_points)  # order them in case they're not
-        sg = self.lattice.graph.subgraph(ps)
-        # print("cycles:", nx.cycle_basis(sg))
-        xyz_coords = np.array([self.lattice.points[p].get_coords("xyz") for p in ps])
-        sg_kdtree = KDTree(xyz_coords)
+        ps = np.array(list(fault_points), dtype=int)  # order them in case they're not
+        xyz_coords = self.lattice.xyz_coords[ps]
         n_steps = n_volcanism_steps  # more steps adds more noise, makes the individual waves less obvious, so it looks more natural
+
+        # draw all the waves' parameters first, then apply them all at once
+        center_indices = np.zeros(n_steps, dtype=int)
+        max_changes = np.zeros(n_steps)
+        wavenumbers = np.zeros(n_steps, dtype=int)
         for step_i in range(n_steps):
-            i = random.randrange(len(ps))
-            p = ps[i]
-            xyz_p = xyz_coords[i]
-            print("chose point i={} p={} with coords {}".format(i, p, xyz_p))
-            # apply some sin wave to every point on the map based on distance from p
-            query = np.array([xyz_p])
-            distances, neighbors = sg_kdtree.query(query, k=len(ps))
-            assert distances.shape[0] == 1  # one sub-array corresponding to the single query point
-            assert neighbors.shape[0] == 1  # one sub-array corresponding to the single query point
-            distances = distances[0]
-            neighbors_raw = neighbors[0]
-            # note that neighbors here is the indices of the points IN THE KDTREE, NOT THEIR POINT INDEX IN THE LATTICE
-            # - this was the source of the Sierpinski error (it reflected how I numbered the points in icosahedron construction)
-            neighbors = [ps[n_i] for n_i in neighbors_raw]
-            # maximum distance can be 2 (2 radii away along diameter of unit sphere)
-            assert max(distances) <= 2
-            assert all(n in ps for n in neighbors), "got neighbors outside of point set"
-            # ideally function is smooth
-            # set p to some value, set antipodes to zero
-            # sigmoid_01 = lambda x, b=-2: 1/(1+(x/(1-x))**-b)  # https://stats.stackexchange.com/questions/214877/
-            sin_wave = lambda x, k: (1+np.sin(((-1)**k)*(2*k+1)*np.pi*(x+0.5)))/2  # for k >= 0, this gives sin wave from [0,1] to [0,1] with f(0)=1, f(1)=0, and k+1 crests
+            center_indices[step_i] = random.randrange(len(ps))
             volcanism_sign = [-1, 1][step_i % 2]  # alternate so you don't get too much bias in either direction
-            max_change = random.uniform(0, max_volcanism_change_magnitude) * volcanism_sign
-            get_k = lambda: random.randint(min_volcanism_wavenumber, max_volcanism_wavenumber)
-            f = lambda d, y=max_change: sin_wave(d/2, k=get_k()) * y
-            # f = lambda d: 10 + random.random() * 5 + 0*d  # debug
-            changes = f(distances)
-            for neighbor, change in zip(neighbors, changes):
-                self.add_value_at_position(neighbor, "volcanism", change)
+            max_changes[step_i] = random.uniform(0, max_volcanism_change_magnitude) * volcanism_sign
+            wavenumbers[step_i] = random.randint(min_volcanism_wavenumber, max_volcanism_wavenumber)
+
+        # apply some sin wave to every fault point based on distance from each wave's center
+        # ideally function is smooth
+        # set center to some value, set antipodes to zero
+        # for k >= 0, this gives sin wave from [0,1] to [0,1] with f(0)=1, f(1)=0, and k+1 crests
+        sin_wave = lambda x, k: (1+np.sin(np.where(k % 2 == 0, 1, -1)*(2*k+1)*np.pi*(x+0.5)))/2
+        total_changes = np.zeros(len(ps))
+        # (steps x fault points) distance matrix, in row chunks so it stays small on fine lattices
+        steps_per_chunk = max(1, 2**22 // max(1, len(ps)))
+        for chunk_start in range(0, n_steps, steps_per_chunk):
+            chunk = slice(chunk_start, chunk_start + steps_per_chunk)
+            center_xyzs = xyz_coords[center_indices[chunk]]
+            # straight-line distance between unit vectors, at most 2 (2 radii away along diameter of unit sphere)
+            distances = np.sqrt(np.clip(2 - 2 * (center_xyzs @ xyz_coords.T), 0, 4))
+            changes = sin_wave(distances/2, wavenumbers[chunk, np.newaxis]) * max_changes[chunk, np.newaxis]
+            total_changes += changes.sum(axis=0)
+        self.add_value_at_position(ps, "volcanism", total_changes)
 
         # now even it out to total volcanism of zero
-        volcanism_array = self.get_value_array("volcanism")
-        total_volcanism = sum(volcanism_array)
+        total_volcanism = self.get_data_array("volcanism").sum()
         # only apply the adjustment to fault-line points
         n_fault_points = len(ps)
-        # print("total pre-adjustment volcanism is {} over {} points".format(total_volcanism, n_fault_points))
         adjustment_per_point = -1 * total_volcanism / n_fault_points
-        for p in ps:
-            self.add_value_at_position(p, "volcanism", adjustment_per_point)
-        post_adjustment_total_volcanism = sum(self.get_value_array("volcanism"))
+        self.add_value_at_position(ps, "volcanism", adjustment_per_point)
+        post_adjustment_total_volcanism = self.get_data_array("volcanism").sum()
         if abs(post_adjustment_total_volcanism) > 1e-6:
             raise Exception("non-zero total volcanism persists: {}".format(post_adjustment_total_volcanism))
         
@@ -669,20 +656,29 @@ class ElevationGenerationMap:
             p = self.lattice.get_random_point_index()
             self.add_value_at_position(p, "volcanism", random.uniform(hotspot_min_val, hotspot_max_val))
 
-    def plot(self):
-        # plt.gcf()
-        self.pre_plot()
+    def plot(self, key_str="elevation"):
+        self.pre_plot(key_str)
         plt.show()
 
-    def draw(self):
-        plt.gcf().clear()
-        self.pre_plot()
+    def get_renderer(self, headless=False):
+        # one renderer per map, so successive frames only recolor the triangles it already has
+        if self.renderer is None or self.renderer.headless != headless:
+            self.renderer = lr.LatticeRenderer(self.lattice, headless=headless)
+        return self.renderer
+
+    def draw(self, key_str="elevation"):
+        self.get_renderer().render(self.get_data_array(key_str), key_str)
         plt.draw()
         plt.pause(0.001)
 
+    def save_frame(self, key_str, output_fp, cmap=None):
+        renderer = self.get_renderer(headless=True)
+        renderer.render(self.get_data_array(key_str), key_str, cmap=cmap)
+        renderer.save_frame(output_fp)
+
     def save_plot_image(self, key_str, project_name, project_version, size_inches=None, cmap=None):
         # output_fp = add_datetime_to_fp(output_fp)
-        output_fp = "/home/wesley/programming/Mapping/Projects/{project_name}/Plots/EGP_{project_name}_{key_str}_v{project_version}.png".format(**locals())
+        output_fp = os.path.join(pstore.get_plots_dir(project_name), "EGP_{project_name}_{key_str}_v{project_version}.png".format(**locals()))
         while os.path.exists(output_fp):
             print("file {} exists, renaming output fp".format(output_fp))
             output_fp = output_fp.replace(".png", "-1.png")
@@ -692,7 +688,7 @@ class ElevationGenerationMap:
         print("- done saving plot image")
 
     def pre_plot(self, key_str, size_inches=None, cmap=None):
-        self.lattice.plot_data(self.data_dict, key_str, size_inches=size_inches, cmap=cmap)
+        self.lattice.plot_data(self.get_data_array(key_str), key_str, size_inches=size_inches, cmap=cmap)
 
     def plot_gradient(self):
         ax1 = plt.subplot(1, 2, 1)
@@ -733,15 +729,21 @@ class ElevationGenerationMap:
 
     def plot_volcanism_data(self):
         cmap = pu.get_volcanism_colormap()
-        self.lattice.plot_data(self.data_dict, "volcanism", cmap=cmap)
+        self.lattice.plot_data(self.get_data_array("volcanism"), "volcanism", cmap=cmap)
         plt.show()
 
+    def is_land(self, p):
+        # TODO: make it possible for land to be below sea level
+        return self.get_value_at_position(p, "elevation") >= 0
+
+    def get_land_mask(self):
+        return self.get_data_array("elevation") >= 0
+
     def create_rainfall_array(self):
         if hasattr(self, "rainfall_array") and self.rainfall_array is not None:
             return
-        self.rainfall_array = np.random.uniform(0, 1, size=self.array.shape)
-        water_points = self.array < 0  # is_land changes means this changes
-        self.rainfall_array[water_points] = 0
+        self.rainfall_array = np.random.uniform(0, 1, size=self.size())
+        self.rainfall_array[~self.get_land_mask()] = 0
         # could have negative values correspond to more evaporation than rain
         # treat units as height units per tick of time, for flow simulation
 
@@ -749,168 +751,25 @@ class ElevationGenerationMap:
         # div(water_flow) is zero everywhere, whether it leaves by flowing or evaporating or whatever
         # so water flow array should tell what the volumetric flow *through* the point is
         self.create_rainfall_array()
-        flow_array = np.zeros((self.x_size, self.y_size))
-        flow_destination_array = np.full((self.x_size, self.y_size), None)
-        # treat sea level as fixed, water flow into and out of elevations below 0 is ignored
-        points_sorted_by_decreasing_elevation = []
-        for x in self.x_range:
-            for y in self.y_range:
-                if self.is_land(x, y):
-                    elevation = self.array[x, y]
-                    tup = (elevation, x, y)
-                    points_sorted_by_decreasing_elevation.append(tup)
-        points_sorted_by_decreasing_elevation = sorted(points_sorted_by_decreasing_elevation, reverse=True)
-        gx, gy = np.gradient(-1*self.array)
-        downhill_neighbor_offset = {
-            -180: (-1, 0),
-            # -135: (-1, -1),
-            -90:  (0, -1),
-            # -45:  (1, -1),
-            0:    (1, 0),
-            # 45:   (1, 1),
-            90:   (0, 1),
-            # 135:  (-1, 1),
-            180:  (-1, 0),
-        }
-        # 8 neighbors allows rivers to cross each other diagonally, so use 4
-        for el, x, y in points_sorted_by_decreasing_elevation:
-            dx = gx[x, y]
-            dy = gy[x, y]
-            grad_angle = np.angle(dx + 1j*dy, deg=True)
-            # print("dx {} dy {} angle {} deg".format(dx, dy, grad_angle))
-            # rounded_to_45_deg = int(45*round(grad_angle/45))
-            rounded_to_90_deg = int(90*round(grad_angle/90))
-            # input("rounded to {}".format(rounded_to_45_deg))
-            downhill_x_offset, downhill_y_offset = downhill_neighbor_offset[rounded_to_90_deg]
-            downhill_neighbor = (x + downhill_x_offset, y + downhill_y_offset)
-            nx, ny = downhill_neighbor
-            flow_array[x, y] += self.rainfall_array[x, y]
-            if self.is_valid_point(nx, ny):
-                flow_array[nx, ny] += flow_array[x, y]
-                flow_destination_array[x, y] = (nx, ny)
-            # else:
-            #     input("invalid neighbor {}".format((nx, ny)))
-        self.flow_array = flow_array
-        self.flow_destination_array = flow_destination_array
-
-        qs = np.linspace(0, 1, 100)
-        flow_array_no_zeros = flow_array[flow_array != 0]
-        quantiles = {q: np.quantile(flow_array_no_zeros, q) for q in qs}
-        def get_nearest_quantile(x):
-            if x < quantiles[qs[0]]:
-                return 0
-            if x > quantiles[qs[-1]]:
-                return 1
-            for q0, q1 in zip(qs[:-1], qs[1:]):
-                v0 = quantiles[q0]
-                v1 = quantiles[q1]
-                # print(v0, x, v1)
-                if v0 <= x <= v1:
-                    # input("match")
-                    if abs(q0-x) > abs(q1-x):
-                        return q0
-                    else:
-                        return q1
-            raise RuntimeError("no quantile found for value {}".format(x))
-
-        flow_quantile_array = np.zeros((self.x_size, self.y_size))
-        for x in self.x_range:
-            for y in self.y_range:
-                flow_quantile_array[x, y] = get_nearest_quantile(flow_array[x, y])
-        self.flow_quantile_array = flow_quantile_array
-
-        self.water_depth_array = np.zeros((self.x_size, self.y_size))
-        water_points = self.array < 0  # is_land change means this changes
-        self.water_depth_array[water_points] = -1*self.array[water_points]
-        
-    def is_land(self, x, y):
-        # TODO: make it possible for land to be below sea level
-        return self.array[x, y] >= 0
+        elevation = self.get_data_array("elevation")
+        land_mask = self.get_land_mask()
+        indptr, indices = self.lattice.get_adjacency_csr()
+        # treat sea level as fixed: only land points pass water on, and water flowing into the sea stops there
+        self.flow_destination_array = hu.get_flow_receivers(elevation, self.lattice.xyz_coords, indptr, indices, land_mask)
+        self.flow_array = hu.get_flow_accumulation(self.flow_destination_array, self.rainfall_array)
+        self.flow_quantile_array = hu.get_nearest_quantile_levels(self.flow_array)
+
+        self.water_depth_array = np.zeros(self.size())
+        self.water_depth_array[~land_mask] = -1*elevation[~land_mask]
 
     def apply_rainfall(self):
         self.water_depth_array += self.rainfall_array
-        total_height_array = self.array + self.water_depth_array
-        depth_changes_array = np.zeros((self.x_size, self.y_size))
-        for x in self.x_range:
-            for y in self.y_range:
-                if not self.is_land(x, y):
-                    # don't transfer from sea to anywhere else
-                    continue
-                h_this_point = total_height_array[x, y]
-                ns = self.get_neighbors(x, y, mode=4)
-                neighbors_leq_total = [n for n in ns if total_height_array[n[0], n[1]] <= h_this_point]
-                if len(neighbors_leq_total) == 0:
-                    continue
-                n_heights = [total_height_array[n[0], n[1]] for n in neighbors_leq_total]
-                heights_and_neighbors_increasing = sorted(zip(n_heights, neighbors_leq_total))
-                # print("\n{} h={}\nneighbors sorted {}".format((x, y), h_this_point, heights_and_neighbors_increasing))
-                # now distribute the height difference to the neighbors such that:
-                # lowest heights first, add to all the heights currently ranked lowest until they tie with the next rank
-                # then add to all those equally, etc. until they are equal to the remaining height of this point
-                while True:
-                    lowest_h = heights_and_neighbors_increasing[0][0]
-                    lowest_to_this_point_dh = h_this_point - lowest_h
-                    current_water_depth_this_point = self.water_depth_array[x, y] + depth_changes_array[x, y]
-                    max_amount_can_transfer = current_water_depth_this_point  # times 1 for the area of the spot it is on
-                    max_amount_can_transfer /= 4  # viscosity?? will hopefully prevent checkerboard alternation
-                    next_h = None
-                    lowest_rank = [heights_and_neighbors_increasing[0]]
-                    for nh, n in heights_and_neighbors_increasing[1:]:
-                        if nh > lowest_h:
-                            next_h = nh
-                            break  # for
-                        lowest_rank.append((nh, n))
-                    if next_h is None:
-                        # everything in neighbors was same height
-                        next_h = h_this_point
-
-                    # all points that are tied for lowest height will get an equal share of the flow
-                    n_receivers = len(lowest_rank)
-                    # first, get how much would be transferred to them to equalize with this point
-                    average_h = 1/(n_receivers+1) * (n_receivers*lowest_h + 1*h_this_point)
-                    lowest_to_average_dh = average_h - lowest_h
-                    # but if this is more than they would take to go to the next highest neighbor,
-                    # then they will equilibrate with it so we loop again
-                    lowest_to_next_dh = next_h - lowest_h
-                    dh_to_implement = min(lowest_to_average_dh, lowest_to_next_dh)
-                    assert dh_to_implement >= 0
-
-                    amount_to_transfer = dh_to_implement * n_receivers
-                    if amount_to_transfer > max_amount_can_transfer:
-                        amount_to_transfer = max_amount_can_transfer
-                        will_break = True
-                    else:
-                        will_break = False
-
-                    amount_to_transfer_to_each = amount_to_transfer / n_receivers
-                    # print("lowest_rank {} with {} receivers".format(lowest_rank, n_receivers))
-                    
-                    if amount_to_transfer == 0:
-                        break
-                    for i in range(n_receivers):
-                        n = lowest_rank[i][1]
-                        if not self.is_land(*n):
-                            # sea will pull higher water level toward it, but then acts like an infinite sink, sea level will not rise
-                            continue
-                        depth_changes_array[n[0], n[1]] += amount_to_transfer_to_each
-                        heights_and_neighbors_increasing[i] = (
-                            heights_and_neighbors_increasing[i][0] + amount_to_transfer_to_each,
-                            heights_and_neighbors_increasing[i][1]
-                        )
-                    depth_changes_array[x, y] -= amount_to_transfer  # total transferred
-                    resulting_depth = self.water_depth_array[x, y] + depth_changes_array[x, y]
-                    # print("depth change at {} -= {} --> {}\nwill give depth {}".format((x, y), amount_to_transfer, depth_changes_array[x, y], resulting_depth))
-                    if resulting_depth < 0:
-                        if abs(resulting_depth) > 1e-6:
-                            print("uh oh, negative depth created")
-                            input("check")
-                    if will_break:
-                        break  # while
-                # next point, don't apply depth changes until very end so you do all points at once based on what they wanted to do at this time
-        # print("\ngot depth changes array with sum {}, max abs {}:\n{}".format(depth_changes_array.sum(), abs(depth_changes_array).max(), depth_changes_array))
+        land_mask = self.get_land_mask()
+        total_height_array = self.get_data_array("elevation") + self.water_depth_array
+        indptr, indices = self.lattice.get_adjacency_csr()
+        # don't transfer from sea to anywhere else; sea acts as an infinite sink
+        depth_changes_array = hu.get_water_depth_changes(total_height_array, self.water_depth_array, indptr, indices, donor_mask=land_mask, sink_mask=~land_mask)
         self.water_depth_array += depth_changes_array
-        # print("resulting water depth array:\n{}".format(self.water_depth_array))
-        # input("check")
         assert self.water_depth_array.min() >= -1e-6, "no negative water depth allowed"
 
     def get_average_water_depth(self, initial_steps, averaging_steps):
@@ -918,7 +777,7 @@ class ElevationGenerationMap:
             print("initialization step", i)
             # don't average over these, let it try to reach a stable state
             self.apply_rainfall()
-        sum_water_depth_array = np.zeros((self.x_size, self.y_size))
+        sum_water_depth_array = np.zeros(self.size())
         for i in range(averaging_steps):
             print("averaging step", i)
             self.apply_rainfall()
@@ -927,35 +786,29 @@ class ElevationGenerationMap:
 
     def plot_flow_steps(self, n_steps):
         plt.ion()
+        renderer = self.get_renderer()
         for _ in range(n_steps):
             self.apply_rainfall()
-            plt.gcf().clear()
-            plt.imshow(self.array + self.water_depth_array)
-            plt.colorbar()
+            renderer.render(self.get_data_array("elevation") + self.water_depth_array, "water height")
             plt.draw()
             plt.pause(0.001)
 
     def plot_average_water_location(self):
+        self.create_flow_arrays()
         average_water_depth_array = self.get_average_water_depth(100, 100)
-        average_water_depth_array[self.array < 0] = 0  # is_land changes means this changes
-        average_height_array = self.array + average_water_depth_array
-        plt.subplot(1, 2, 1)
-        plt.imshow(average_water_depth_array)
-        plt.subplot(1, 2, 2)
-        plt.imshow(average_height_array)
-        plt.colorbar()
+        average_water_depth_array[~self.get_land_mask()] = 0  # is_land changes means this changes
+        average_height_array = self.get_data_array("elevation") + average_water_depth_array
+        self.lattice.plot_data(average_water_depth_array, "water depth", cmap=plt.cm.Blues)
+        self.lattice.plot_data(average_height_array, "water height")
         plt.show()
 
     def plot_flow_amounts(self):
         self.create_flow_arrays()
         # arr = self.flow_array  # max is too high for linear cmap
-        arr = self.flow_quantile_array
-        plt.imshow(arr, cmap=plt.cm.inferno)
-        plt.colorbar()
+        self.lattice.plot_data(self.flow_quantile_array, "flow quantile", cmap=plt.cm.inferno)
         plt.show()
 
     def plot_rivers(self):
-        self.pre_plot(alpha=1)
         self.create_flow_arrays()
         print("flow stats: min {} median {} mean {} max {}".format(
             np.min(self.flow_array),
@@ -963,45 +816,25 @@ class ElevationGenerationMap:
             np.mean(self.flow_array),
             np.max(self.flow_array),
         ))
-        mean_flow = np.mean(self.flow_array)
-
-        # blue_value = lambda x: get_nearest_quantile(x)
-        # alpha_value = lambda x: get_nearest_quantile(x)
-        # river_rgba_array = []
-        line_segments = []
-        colors = []
-        for x in self.x_range:
-            # this_row = []
-            for y in self.y_range:
-                flow = self.flow_array[x, y]
-                flow_destination = self.flow_destination_array[x, y]
-                flow_quantile = self.flow_quantile_array[x, y]
-                if flow_destination is not None:
-                    # seg = [(x, y), flow_destination]
-                    # transpose
-                    seg = [(y, x), flow_destination[::-1]]
-                    # print(seg)
-                    line_segments.append(seg)
-                    # b = blue_value(flow)
-                    # a = alpha_value(flow)
-                    # r = 0
-                    # g = b  # make it cyan
-                    # color = (r, g, b, a)
-                    # color = (0, 0, 1, a)
-                    # if a > 0:
-                    #     input("flow {} from {} to {} gave rgba {}".format(flow, (x, y), flow_destination, color))
-                    cmap = plt.cm.GnBu
-                    r, g, b, a = cmap(flow_quantile)
-                    color = (r, g, b, a*0.5)
-                    colors.append(color)
-                # this_row.append(color)
-            # river_rgba_array.append(this_row)
-        # river_rgba_array = np.array(river_rgba_array)
-        # print(test_array)
-        # print(f(test_array))
-        # print(river_rgba_array[150:152, 150:153])
-        # plt.imshow(self.water_flow_array)
-        # plt.imshow(river_rgba_array, origin="lower")
+        # plotted in (lon, lat) since the segments must be drawn in the same coordinates as the map
+        lats_deg = self.lattice.latlondeg_coords[:, 0]
+        lons_deg = self.lattice.latlondeg_coords[:, 1]
+        elevation = self.get_data_array("elevation")
+        contour_levels = pu.get_contour_levels(elevation.min(), elevation.max(), prefer_positive=True)
+        plt.tricontourf(lons_deg, lats_deg, elevation, levels=contour_levels, cmap=pu.get_land_and_sea_colormap())
+        plt.colorbar()
+
+        sources = np.nonzero(self.flow_destination_array >= 0)[0]
+        destinations = self.flow_destination_array[sources]
+        # don't draw segments the long way around the map when they cross the antimeridian
+        sources = sources[abs(lons_deg[sources] - lons_deg[destinations]) < 180]
+        destinations = self.flow_destination_array[sources]
+        line_segments = np.stack([
+            np.stack([lons_deg[sources], lats_deg[sources]], axis=-1),
+            np.stack([lons_deg[destinations], lats_deg[destinations]], axis=-1),
+        ], axis=1)
+        colors = plt.cm.GnBu(self.flow_quantile_array[sources])
+        colors[:, 3] *= 0.5
         lc = mcollections.LineCollection(line_segments, colors=colors)
         plt.gca().add_collection(lc)
         plt.gca().autoscale()
@@ -1017,76 +850,69 @@ class ElevationGenerationMap:
         if any(len(x) != 4 for x in color_condition_dict.keys()):
             raise ValueError("all color keys must have length 4, RGBA:\n{}".format(color_condition_dict.keys()))
 
-        im = Image.open(image_fp)
+        im = Image.open(image_fp).convert("RGBA")
         width, height = im.size
-        print("creating image lattice")
-        image_lattice = LatitudeLongitudeLattice(
-            height, width,  # rows, columns
-            latlon00, latlon01, latlon10, latlon11
-        )  # we are not actually going to add data to this lattice, but we will use it to get point coordinates more easily
-        # later will need to be able to adjust edge length dynamically based on how fine the image grid is
-        print("- done creating image lattice")
-        m = ElevationGenerationMap(map_lattice)
         arr = np.array(im)
-        color_and_first_seen = {}
-        usp_to_fill_value = {}
-        usp_to_condition = {}
-        print("mapping image points to value and condition")
-        for x in range(height):
-            if x % 100 == 0:
-                print("x = {}/{}".format(x, height))
-            for y in range(width):
-                color = tuple(arr[x, y])
-                if color not in color_condition_dict:
-                    color = default_color
-                    arr[x, y] = color
-                if color not in color_and_first_seen:
-                    print("got new color {} at {}".format(color, (x, y)))
-                    color_and_first_seen[color] = (x, y)
-                if color in color_condition_dict:
-                    fill_value, condition, is_frozen = color_condition_dict[color]
-                    if fill_value is None:
-                        fill_value = 0
-                    xy = (x, y)
-                    p = image_lattice.get_usp_from_lattice_position(xy)
-                    usp_to_fill_value[p] = fill_value
-                    usp_to_condition[p] = condition
-        print("- done mapping points to value and condition")
+        m = ElevationGenerationMap(map_lattice)
+
+        print("mapping image colors to value and condition")
+        # lookup tables indexed by color number, pixels that match no color (and default_color is not in the dict) get -1
+        colors = list(color_condition_dict.keys())
+        fill_value_table = np.array([0 if color_condition_dict[c][0] is None else color_condition_dict[c][0] for c in colors], dtype=float)
+        condition_table = [color_condition_dict[c][1] for c in colors]
+        is_frozen_table = np.array([color_condition_dict[c][2] for c in colors], dtype=bool)
+        pack_rgba = lambda a: (a[..., 0].astype(np.uint32) << 24) | (a[..., 1].astype(np.uint32) << 16) | (a[..., 2].astype(np.uint32) << 8) | a[..., 3].astype(np.uint32)
+        packed_colors = pack_rgba(np.array(colors, dtype=np.uint8))
+        sort_order = np.argsort(packed_colors)
+        packed_colors_sorted = packed_colors[sort_order]
+        packed_pixels = pack_rgba(arr).reshape(-1)  # point numbers are row * width + column
+        positions = np.minimum(np.searchsorted(packed_colors_sorted, packed_pixels), len(colors) - 1)
+        pixel_color_numbers = np.where(packed_colors_sorted[positions] == packed_pixels, sort_order[positions], -1)
+        default_color_number = colors.index(tuple(default_color)) if tuple(default_color) in color_condition_dict else -1
+        pixel_color_numbers[pixel_color_numbers == -1] = default_color_number
+        for color_number, n in zip(*np.unique(pixel_color_numbers, return_counts=True)):
+            print("got {} pixels of color {}".format(n, colors[color_number] if color_number >= 0 else "not in color dict"))
+        print("- done mapping image colors to value and condition")
+
+        print("getting image point coordinates")
+        image_xyz = np.empty((height * width, 3), dtype=float)
+        rows_per_chunk = max(1, 2**20 // width)  # keep the intermediate arrays of the coordinate math bounded
+        for row_start in range(0, height, rows_per_chunk):
+            rows, cols = np.meshgrid(np.arange(row_start, min(height, row_start + rows_per_chunk)), np.arange(width), indexing="ij")
+            xyz = mcm.get_xyz_of_point_on_map(rows, cols, height, width, *latlon00, *latlon01, *latlon10, *latlon11, deg=True)
+            image_xyz[row_start * width : row_start * width + rows.size] = xyz.reshape(3, -1).T
+        image_kdtree = KDTree(image_xyz)
+        print("- done getting image point coordinates")
+
+        # only query map lattice points inside a spherical cap around the image, plus a margin of a few lattice edges
+        image_center = image_xyz.mean(axis=0)
+        image_center /= np.linalg.norm(image_center)
+        image_max_angle = np.arccos(np.clip(image_xyz @ image_center, -1, 1)).max()
+        indptr, indices = map_lattice.get_adjacency_csr()
+        map_edge_angle = np.arccos(np.clip(map_lattice.xyz_coords[indices[indptr[0]:indptr[1]]] @ map_lattice.xyz_coords[0], -1, 1)).max()
+        cap_cos = np.cos(min(np.pi, image_max_angle + 3 * map_edge_angle))
+        map_candidates = np.nonzero(map_lattice.xyz_coords @ image_center >= cap_cos)[0]
+        print("{} of {} map lattice points are near the image".format(len(map_candidates), map_lattice.n_points()))
 
         print("creating map from lattice points to image points")
-        map_lattice_points = map_lattice.points
-        print("creating image points that will be referenced")
-        image_points_that_will_be_referenced = set()
-        for i, lattice_p in enumerate(map_lattice_points):
-            if i % 100 == 0:
-                # can be optimized by not checking map lattice points that are too far away from the image edges, reduce number of distance calculations that will just be wasted
-                print("map point {}/{}".format(i, len(map_lattice_points)))
-            image_point = image_lattice.closest_point_to(lattice_p)
-            image_points_that_will_be_referenced.add(image_point)
-        print("- done creating image points that will be referenced")
+        nearest_image_points = image_kdtree.query(map_lattice.xyz_coords[map_candidates], k=1, return_distance=False)[:, 0]
+        image_points_that_will_be_referenced = np.unique(nearest_image_points)
         # now for each of these image points, get the closest lattice point and use the image point for that lattice point, not others
         # because the others claiming the same closest image point will be outside the image boundaries, I think
-        lattice_points_to_image_points = {}
-        for i, image_p in enumerate(image_points_that_will_be_referenced):
-            if i % 100 == 0:
-                print("image point {}/{}".format(i, len(image_points_that_will_be_referenced)))
-            key = map_lattice.closest_point_to(image_p)
-            val = image_p
-            lattice_points_to_image_points[key] = val
+        lattice_points = map_lattice.closest_point_indices_to_xyz(image_xyz[image_points_that_will_be_referenced])
+        lattice_points, first_indices = np.unique(lattice_points, return_index=True)
+        image_points = image_points_that_will_be_referenced[first_indices]
         print("- done creating map from lattice points to image points")
 
         print("filling map values and conditions")
-        for lattice_p, image_p in lattice_points_to_image_points.items():
-            # faster to get the image point near each lattice point than the other way around, if the lattice is lower-resolution
-            # if the image is lower-resolution than the lattice, then start doing things the other way around, maybe?
-                # image_point = image_lattice.point_dict[(x, y)] 
-                # p = map_lattice.closest_point_to(image_point)  # closest point on lattice to this x, y point on the image
-            fill_value = usp_to_fill_value[image_p]
-            condition = usp_to_condition[image_p]
-            m.fill_position(lattice_p, "elevation", fill_value)
-            m.add_condition_at_position(lattice_p, condition)
-            if is_frozen:
-                m.freeze_point(lattice_p)
+        color_numbers = pixel_color_numbers[image_points]
+        has_color = color_numbers >= 0
+        lattice_points = lattice_points[has_color]
+        color_numbers = color_numbers[has_color]
+        m.get_data_array("elevation")[lattice_points] = fill_value_table[color_numbers]
+        for color_number, condition in enumerate(condition_table):
+            m.condition_index_array[lattice_points[color_numbers == color_number]] = m.get_condition_index(condition)
+        m.frozen_mask[lattice_points[is_frozen_table[color_numbers]]] = True
         print("- done filling map values and conditions")
 
         print("- returning ElevationGenerationMap from image")
@@ -1094,40 +920,43 @@ class ElevationGenerationMap:
 
     @staticmethod
     def from_data(key_strs, project_name, project_version):
-        assert type(key_strs) is list, "invalid key_strs: {}".format(key_strs)
+        # key_strs=None loads every key in the version's container
         print("loading data {} for project {} v{}".format(key_strs, project_name, project_version))
-        data_dict = {}
+        data_fp = pstore.get_project_data_fp(project_name, project_version)
+        if os.path.exists(data_fp):
+            metadata = pstore.read_metadata(data_fp)
+            if key_strs is None:
+                key_strs = metadata["keys"]
+        else:
+            metadata = {}
+            assert type(key_strs) is list, "invalid key_strs: {}".format(key_strs)
+        data_arrays = {}
         for key_str in key_strs:
             if False: #key_str == "volcanism":  # TODO make certain things version-invariant
                 file_version_to_load = 0
             else:
                 file_version_to_load = project_version
-            data_dict_this_key = ElevationGenerationMap.load_single_data_file(key_str, project_name, file_version_to_load)
-            for p_i in data_dict_this_key:
-                if p_i not in data_dict:
-                    data_dict[p_i] = {}
-                data_dict[p_i][key_str] = data_dict_this_key[p_i][key_str]
-        n_iterations = IcosahedralGeodesicLattice.get_iterations_from_number_of_points(len(data_dict))
+            data_arrays[key_str] = ElevationGenerationMap.load_single_data_file(key_str, project_name, file_version_to_load, mmap=False)
+        n_points_by_key = {key_str: len(arr) for key_str, arr in data_arrays.items()}
+        assert len(set(n_points_by_key.values())) == 1, "data files have different numbers of points: {}".format(n_points_by_key)
+        n_points = list(n_points_by_key.values())[0]
+        n_iterations = metadata.get("lattice_iterations")
+        if n_iterations is None:
+            n_iterations = IcosahedralGeodesicLattice.get_iterations_from_number_of_points(n_points)
         lattice = IcosahedralGeodesicLattice(iterations=n_iterations)
 
-        return ElevationGenerationMap(lattice=lattice, data_dict=data_dict)
+        return ElevationGenerationMap(lattice=lattice, data_arrays=data_arrays)
 
     @staticmethod
-    def load_single_data_file(key_str, project_name, project_version):
+    def load_single_data_file(key_str, project_name, project_version, mmap=True):
+        # reads just this key from the version's container, memory-mapped (read-only) if it was stored uncompressed
+        # falls back to the old one-text-file-per-key format for projects saved before the container existed
         assert type(key_str) is str, "invalid key_str: {}".format(key_str)
-        data_fp = "/home/wesley/programming/Mapping/Projects/{project_name}/Data/EGD_{project_name}_{key_str}_v{project_version}.txt".format(**locals())
-        with open(data_fp) as f:
-            contents = f.read()
-        vals = contents.split("\n")
-        if vals[-1] == "":
-            vals = vals[:-1]
-        vals = [float(x) for x in vals]
-        data_dict = {}  # point index to value
-        for p_i, val in enumerate(vals):
-            data_dict[p_i] = {key_str: val}
-        # print("got data_dict from data_fp {}: {}".format(data_fp, data_dict))
-        # input("check for correctness")
-        return data_dict
+        data_fp = pstore.get_project_data_fp(project_name, project_version)
+        if os.path.exists(data_fp):
+            return pstore.read_array(data_fp, key_str, mmap=mmap)
+        data_fp = pstore.get_legacy_data_fp(project_name, key_str, project_version)
+        return np.loadtxt(data_fp, dtype=float, ndmin=1)  # array of values in order of point index
 
         # older, for LatitudeLongitudeLattice
         # array = np.array(lines)
@@ -1136,7 +965,7 @@ class ElevationGenerationMap:
 
     def freeze_coastlines(self):
         coastal_points = set()
-        for p in range(len(self.lattice.points)):
+        for p in range(self.size()):
             if self.get_value_at_position(p, "elevation") < 0:
                 neighbors = self.get_neighbors(p)
                 for n in neighbors:
@@ -1178,20 +1007,23 @@ class ElevationGenerationMap:
                     max_grad_pair = (p, q)
         return max_grad, max_grad_pair
 
-    def save_data(self, key_str, project_name, project_version):
-        # format is just grid of comma-separated numbers
-        # if not confirm_overwrite_file:
-        #     return
-        # output_fp = add_datetime_to_fp(output_fp)
-        output_fp = "/home/wesley/programming/Mapping/Projects/{project_name}/Data/EGD_{project_name}_{key_str}_v{project_version}.txt".format(**locals())
-        while os.path.exists(output_fp):
-            print("file {} exists, renaming output fp".format(output_fp))
-            output_fp = output_fp.replace(".txt", "-1.txt")
-        print("saving {} data to {}".format(key_str, output_fp))
-        with open(output_fp, "w") as f:
-            s = ""
-            for p_i in range(len(self.lattice.points)):
-                val = self.get_value_at_position(p_i, key_str)
-                s += str(val) + "\n"
-            f.write(s)
-        print("finished saving {} data".format(key_str))
+    def save_data(self, project_name, project_version, key_strs=None, metadata=None):
+        # all keys go into one container per version, along with metadata such as the parameters used
+        # saving the same version again replaces it
+        if key_strs is None:
+            key_strs = sorted(self.data_arrays)
+        output_fp = pstore.get_project_data_fp(project_name, project_version)
+        print("saving {} data to {}".format(key_strs, output_fp))
+        full_metadata = {
+            "project_name": project_name,
+            "project_version": str(project_version),
+            "keys": key_strs,
+            "n_points": self.size(),
+            "lattice_type": type(self.lattice).__name__,
+        }
+        if type(self.lattice) is IcosahedralGeodesicLattice:
+            full_metadata["lattice_iterations"] = IcosahedralGeodesicLattice.get_iterations_from_number_of_points(self.size())
+        if metadata is not None:
+            full_metadata.update(metadata)
+        pstore.write_container(output_fp, {key_str: self.get_data_array(key_str) for key_str in key_strs}, full_metadata)
+        print("finished saving {} data".format(key_strs))
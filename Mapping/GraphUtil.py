@@ -0,0 +1,72 @@
+# graph algorithms on lattice adjacency stored in CSR (compressed sparse row) form:
+# the neighbors of point i are indices[indptr[i]:indptr[i+1]]
+# working on these arrays directly avoids building networkx graphs in the hot loops
+
+import numpy as np
+
+
+def get_csr_from_adjacency_dict(adjacencies_by_point_index, n_points):
+    degrees = np.array([len(adjacencies_by_point_index[p_i]) for p_i in range(n_points)], dtype=np.int64)
+    indptr = np.zeros(n_points + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    indices = np.fromiter(
+        (n for p_i in range(n_points) for n in adjacencies_by_point_index[p_i]),
+        dtype=np.int64, count=indptr[-1],
+    )
+    return indptr, indices
+
+
+def get_neighbor_pairs(indptr, indices, nodes):
+    # all (node, neighbor) pairs for the given nodes, as two aligned arrays
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    sources = np.repeat(nodes, counts)
+    # position of each pair within its node's neighbor list, added to that node's start offset
+    offsets_within_node = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    neighbors = indices[np.repeat(starts, counts) + offsets_within_node]
+    return sources, neighbors
+
+
+def get_barrier_crossing_counts(indptr, indices, center, region_mask, barrier_mask):
+    # 0-1 BFS from center over the nodes in region_mask
+    # each edge between a barrier node and a non-barrier node costs 1, all others cost 0
+    # returns the minimum number of crossings to reach each node, -1 for nodes not reachable within the region
+    # processed level by level: flood everything reachable at cost c, then step across the barrier edges to cost c+1
+    assert region_mask[center], "center must be in the region"
+    crossings = np.full(len(region_mask), -1, dtype=np.int64)
+    crossings[center] = 0
+    frontier = np.array([center])
+    c = 0
+    while len(frontier) > 0:
+        settled_this_level = [frontier]
+        while len(frontier) > 0:
+            sources, neighbors = get_neighbor_pairs(indptr, indices, frontier)
+            keep = region_mask[neighbors] & (crossings[neighbors] == -1) & (barrier_mask[neighbors] == barrier_mask[sources])
+            frontier = np.unique(neighbors[keep])
+            crossings[frontier] = c
+            settled_this_level.append(frontier)
+        settled = np.concatenate(settled_this_level)
+        sources, neighbors = get_neighbor_pairs(indptr, indices, settled)
+        keep = region_mask[neighbors] & (crossings[neighbors] == -1) & (barrier_mask[neighbors] != barrier_mask[sources])
+        frontier = np.unique(neighbors[keep])
+        c += 1
+        crossings[frontier] = c
+    return crossings
+
+
+def get_distances_from_boundary(indptr, indices, region_mask):
+    # graph distance transform: multi-source BFS from the region's boundary, staying inside the region
+    # boundary nodes are region nodes with at least one neighbor outside the region, and get distance 0
+    # returns hop distances as an int array, -1 for nodes outside the region (or not connected to its boundary)
+    distances = np.full(len(region_mask), -1, dtype=np.int64)
+    region_nodes = np.nonzero(region_mask)[0]
+    sources, neighbors = get_neighbor_pairs(indptr, indices, region_nodes)
+    frontier = np.unique(sources[~region_mask[neighbors]])
+    d = 0
+    while len(frontier) > 0:
+        distances[frontier] = d
+        sources, neighbors = get_neighbor_pairs(indptr, indices, frontier)
+        keep = region_mask[neighbors] & (distances[neighbors] == -1)
+        frontier = np.unique(neighbors[keep])
+        d += 1
+    return distances
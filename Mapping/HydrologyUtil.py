@@ -0,0 +1,102 @@
+# water flow on a lattice given as CSR adjacency (see GraphUtil), with all values as arrays indexed by point
+# works for any lattice: on the 4-neighbor LatitudeLongitudeLattice the receivers are D4, on the geodesic lattice they use all 5 or 6 neighbors
+
+import numpy as np
+
+import GraphUtil as gu
+
+
+def get_flow_receivers(elevation, xyz_coords, indptr, indices, source_mask):
+    # steepest-descent neighbor of each point in source_mask, -1 where there is none (pits, flats, or points not in source_mask)
+    # slope is elevation drop over straight-line distance, so irregular neighbor spacing is accounted for
+    n_points = len(elevation)
+    receivers = np.full(n_points, -1, dtype=np.int64)
+    sources, neighbors = gu.get_neighbor_pairs(indptr, indices, np.nonzero(source_mask)[0])
+    if len(sources) == 0:
+        return receivers
+    distances = np.linalg.norm(xyz_coords[sources] - xyz_coords[neighbors], axis=1)
+    slopes = (elevation[sources] - elevation[neighbors]) / distances
+    # sort by source, then steepest first; the first pair of each source's run is its best neighbor
+    order = np.lexsort((-slopes, sources))
+    sources = sources[order]
+    is_first = np.ones(len(sources), dtype=bool)
+    is_first[1:] = sources[1:] != sources[:-1]
+    best = order[is_first]
+    downhill = slopes[best] > 0
+    receivers[sources[is_first][downhill]] = neighbors[best[downhill]]
+    return receivers
+
+
+def get_flow_accumulation(receivers, local_flow):
+    # total flow through each point: its own input plus everything that drains into it
+    # receivers always lie strictly downhill, so the receiver graph is a forest and a topological sweep
+    # from the top works; it is done level by level, each level being the points whose donors are all finished
+    flow = np.array(local_flow, dtype=float)
+    has_receiver = receivers >= 0
+    n_unfinished_donors = np.bincount(receivers[has_receiver], minlength=len(receivers))
+    frontier = np.nonzero(n_unfinished_donors == 0)[0]
+    while len(frontier) > 0:
+        frontier = frontier[has_receiver[frontier]]
+        frontier_receivers = receivers[frontier]
+        np.add.at(flow, frontier_receivers, flow[frontier])
+        np.subtract.at(n_unfinished_donors, frontier_receivers, 1)
+        frontier = np.unique(frontier_receivers[n_unfinished_donors[frontier_receivers] == 0])
+    return flow
+
+
+def get_nearest_quantile_levels(values, n_quantiles=100):
+    # the quantile level (in [0, 1]) whose value is nearest to each value, with quantiles taken over the nonzero values
+    # (the per-point version this replaced compared the levels themselves with the value, abs(q0-x) > abs(q1-x), so for values
+    # above 1, which is most flows, it always picked the lower of the two bracketing levels; flow_quantile_array changed with this)
+    values = np.asarray(values)
+    nonzero_values = values[values != 0]
+    if len(nonzero_values) == 0:
+        return np.zeros(values.shape)
+    qs = np.linspace(0, 1, n_quantiles)
+    quantile_values = np.quantile(nonzero_values, qs)
+    upper_i = np.searchsorted(quantile_values, values).clip(1, n_quantiles - 1)
+    lower_is_nearer = values - quantile_values[upper_i - 1] <= quantile_values[upper_i] - values
+    return qs[np.where(lower_is_nearer, upper_i - 1, upper_i)]
+
+
+def get_water_depth_changes(total_height, water_depth, indptr, indices, donor_mask, sink_mask, max_transfer_fraction=0.25):
+    # one step of water redistribution, computed from the current state for all points at once
+    # each donor pours water into its neighbors whose total height is not above its own, filling the lowest first,
+    # until it is level with them or it has given max_transfer_fraction of its depth (which damps checkerboard oscillation)
+    # water given to points in sink_mask (sea) disappears, so sea level does not rise
+    depth_changes = np.zeros(len(total_height))
+    sources, neighbors = gu.get_neighbor_pairs(indptr, indices, np.nonzero(donor_mask)[0])
+    lower = total_height[neighbors] <= total_height[sources]
+    sources = sources[lower]
+    neighbors = neighbors[lower]
+    if len(sources) == 0:
+        return depth_changes
+    neighbor_heights = total_height[neighbors]
+    order = np.lexsort((neighbor_heights, sources))
+    sources = sources[order]
+    neighbors = neighbors[order]
+    neighbor_heights = neighbor_heights[order]
+
+    # rank k (from 1) of each neighbor within its donor's run, and the sum of the heights of the k lowest
+    run_starts = np.nonzero(np.r_[True, sources[1:] != sources[:-1]])[0]
+    run_lengths = np.diff(np.r_[run_starts, len(sources)])
+    k = np.arange(len(sources)) - np.repeat(run_starts, run_lengths) + 1
+    cumulative_heights = np.cumsum(neighbor_heights)
+    cumulative_heights -= np.repeat(cumulative_heights[run_starts] - neighbor_heights[run_starts], run_lengths)
+
+    # water level reached if exactly the k lowest neighbors receive water,
+    # limited either by the donor coming level with them or by the transfer cap
+    donor_heights = total_height[sources]
+    max_transfers = max_transfer_fraction * water_depth[sources]
+    level_when_equalized = (donor_heights + cumulative_heights) / (k + 1)
+    level_when_capped = (max_transfers + cumulative_heights) / k
+    levels = np.minimum(level_when_equalized, level_when_capped)
+    # the receivers are the largest k whose level is not below the k-th neighbor (these k form a prefix of each run)
+    n_receivers = np.maximum.reduceat(np.where(levels >= neighbor_heights, k, 0), run_starts)
+    final_levels = np.repeat(levels[run_starts + n_receivers - 1], run_lengths)
+
+    transfers = np.maximum(0, final_levels - neighbor_heights)
+    np.subtract.at(depth_changes, sources, transfers)
+    keeps_water = ~sink_mask[neighbors]
+    np.add.at(depth_changes, neighbors[keeps_water], transfers[keeps_water])
+    return depth_changes
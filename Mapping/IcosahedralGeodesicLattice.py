@@ -1,3 +1,5 @@
+import os
+import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
@@ -8,6 +10,7 @@ from sklearn.neighbors import KDTree
 from Lattice import Lattice
 from UnitSpherePoint import UnitSpherePoint
 import MapCoordinateMath as mcm
+import GraphUtil as gu
 
 
 class IcosahedralGeodesicLattice(Lattice):
@@ -15,6 +18,9 @@ class IcosahedralGeodesicLattice(Lattice):
     CADA_II_RADIUS_FACTOR = 2.116
     CADA_II_RADIUS_KM = CADA_II_RADIUS_FACTOR * EARTH_RADIUS_KM
 
+    MEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MemoIcosa")
+    CACHE_FORMAT_VERSION = 1  # bump this whenever the layout or point ordering of the binary cache changes
+
     def __init__(self, edge_length_km=None, iterations=None):
         assert int(edge_length_km is None) + int(iterations is None) == 1, "need either edge_length_km or iterations, not both, got {} and {}".format(edge_length_km, iterations)
         self.edge_length_km = edge_length_km
@@ -22,25 +28,79 @@ class IcosahedralGeodesicLattice(Lattice):
             assert iterations % 1 == 0, "need int value for iterations if supplied, got {}".format(iterations)
             iterations = int(iterations)
         self.iterations = iterations
-        ordered_points, adjacencies_by_point_index = self.get_adjacencies()
-        self.adjacencies_by_point_index = adjacencies_by_point_index
-        self.points = ordered_points
-        self.usp_to_index = self.get_usp_to_index()
-        self.adjacencies = self.convert_adjacencies_to_usp()
-        self.xyz_coords = []
-        self.xyz_to_point_number = {}
-        for point_number, p in enumerate(self.points):
-            xyz = tuple(p.get_coords("xyz"))
-            self.xyz_coords.append(xyz)
-            self.xyz_to_point_number[xyz] = point_number
-        self.xyz_coords = np.array(self.xyz_coords)
+        iterations_needed = self.get_iterations_needed()
+
+        try:
+            self.load_cache(iterations_needed)
+            return
+        except FileNotFoundError:
+            print("no binary icosahedron cache for {} iterations".format(iterations_needed))
+
+        try:
+            ordered_points, adjacencies_by_point_index = IcosahedralGeodesicLattice.get_adjacencies_from_memoization_file(iterations_needed)
+            self.points = ordered_points
+            self.adjacencies_by_point_index = adjacencies_by_point_index
+            self.xyz_coords = np.array([p.get_coords("xyz") for p in self.points], dtype=float)
+            self.latlondeg_coords = np.array([p.get_coords("latlondeg") for p in self.points], dtype=float)
+            self.adjacency_indptr, self.adjacency_indices = gu.get_csr_from_adjacency_dict(self.adjacencies_by_point_index, len(self.points))
+            self.adjacency_indices = self.adjacency_indices.astype(np.int32)
+        except FileNotFoundError:
+            print("retrieving memoized icosahedron files for {} iterations failed; constructing from scratch".format(iterations_needed))
+            self.xyz_coords, self.latlondeg_coords, self.adjacency_indptr, self.adjacency_indices = self.get_adjacencies(iterations_needed)
         self.kdtree = KDTree(self.xyz_coords)
-        self.graph = self.get_graph()
+        self.save_cache(iterations_needed)
+
+    @classmethod
+    def from_arrays(cls, iterations, xyz_coords, latlondeg_coords, adjacency_indptr, adjacency_indices, kdtree=None):
+        # wrap existing arrays (e.g. in shared memory) without copying them or going through the cache
+        lattice = cls.__new__(cls)
+        lattice.edge_length_km = None
+        lattice.iterations = iterations
+        lattice.xyz_coords = xyz_coords
+        lattice.latlondeg_coords = latlondeg_coords
+        lattice.adjacency_indptr = adjacency_indptr
+        lattice.adjacency_indices = adjacency_indices
+        lattice.kdtree = KDTree(xyz_coords) if kdtree is None else kdtree
+        return lattice
 
-    def get_adjacencies(self):
+    @staticmethod
+    def get_cache_dir(iterations):
+        return os.path.join(IcosahedralGeodesicLattice.MEMO_DIR, "IcosaCache_v{}_Iteration{}".format(IcosahedralGeodesicLattice.CACHE_FORMAT_VERSION, iterations))
+
+    def save_cache(self, iterations):
+        # arrays as .npy so they can be memory-mapped on load, plus the pickled KDTree so it does not have to be rebuilt
+        cache_dir = IcosahedralGeodesicLattice.get_cache_dir(iterations)
+        print("writing binary icosahedron cache to {}".format(cache_dir))
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(os.path.join(cache_dir, "xyz.npy"), self.xyz_coords)
+        np.save(os.path.join(cache_dir, "latlondeg.npy"), self.latlondeg_coords)
+        np.save(os.path.join(cache_dir, "adjacency_indptr.npy"), self.adjacency_indptr)
+        np.save(os.path.join(cache_dir, "adjacency_indices.npy"), self.adjacency_indices)
+        # write the KDTree last, its presence marks the cache as complete
+        kdtree_fp = os.path.join(cache_dir, "kdtree.pickle")
+        with open(kdtree_fp + ".tmp", "wb") as f:
+            pickle.dump(self.kdtree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(kdtree_fp + ".tmp", kdtree_fp)
+        print("- done writing binary icosahedron cache")
+
+    def load_cache(self, iterations):
+        # raises FileNotFoundError if there is no complete cache for this number of iterations
+        # USPs, the networkx graph, and the other dict-based structures are not loaded; Lattice builds them on first access
+        cache_dir = IcosahedralGeodesicLattice.get_cache_dir(iterations)
+        with open(os.path.join(cache_dir, "kdtree.pickle"), "rb") as f:
+            self.kdtree = pickle.load(f)
+        self.xyz_coords = np.load(os.path.join(cache_dir, "xyz.npy"), mmap_mode="r")
+        self.latlondeg_coords = np.load(os.path.join(cache_dir, "latlondeg.npy"), mmap_mode="r")
+        self.adjacency_indptr = np.load(os.path.join(cache_dir, "adjacency_indptr.npy"), mmap_mode="r")
+        self.adjacency_indices = np.load(os.path.join(cache_dir, "adjacency_indices.npy"), mmap_mode="r")
+        expected_n_points = 2 + 10 * 4 ** iterations
+        assert len(self.xyz_coords) == expected_n_points, "cache at {} has {} points, expected {}".format(cache_dir, len(self.xyz_coords), expected_n_points)
+        print("loaded binary icosahedron cache for {} iterations".format(iterations))
+
+    def get_iterations_needed(self):
         cada_ii_radius_km = IcosahedralGeodesicLattice.CADA_II_RADIUS_KM
         if self.iterations is not None:
-            iterations_needed = self.iterations
+            return self.iterations
         elif self.edge_length_km is not None:
             # edge_length_km determines how high the resolution is
             # derive from the inverse formula at https://en.wikipedia.org/wiki/Regular_icosahedron
@@ -49,19 +109,15 @@ class IcosahedralGeodesicLattice(Lattice):
             initial_edge_length_km = icosa_edge_length_from_radius_to_vertex(cada_ii_radius_km)
             factor = initial_edge_length_km / self.edge_length_km
             # each iteration halves the edge length
-            iterations_needed = int(np.ceil(np.log2(factor)))
+            return int(np.ceil(np.log2(factor)))
         else:
             raise
 
+    def get_adjacencies(self, iterations_needed):
+        # returns xyz_coords, latlondeg_coords, and CSR adjacency arrays
         if iterations_needed > 7:
-            print("You requested {} iterations of precision IcosahedralGeodesicLattice, but it is memory-intensive to go above 7.".format(iterations_needed))
-            input("press enter to continue if desired")
-
-        try:
-            return IcosahedralGeodesicLattice.get_adjacencies_from_memoization_file(iterations_needed)
-        except FileNotFoundError:
-            print("retrieving memoized icosahedron files for {} iterations failed; constructing from scratch".format(iterations_needed))
-        
+            n_points = 2 + 10 * 4 ** iterations_needed
+            print("building {} iterations of IcosahedralGeodesicLattice ({} points), this will take some time and memory".format(iterations_needed, n_points))
 
         icosahedron_original_points_latlon = {
             # north pole
@@ -122,109 +178,61 @@ class IcosahedralGeodesicLattice(Lattice):
             "NRm72", "SRm36",  # peel 4
         ]
 
-        # keep the point objects in a single array that can be indexed by point index
-        # the rest of the data, i.e., the adjacencies dictionary, should be all in terms of integer indices that refer to the points array
-
-        ordered_points = []
-        adjacencies_by_point_index = {}
-
-        # place original points in the list
-        for p_name in original_points_order_by_name:
-            point_index = len(ordered_points)
-            p_latlon = icosahedron_original_points_latlon[p_name]
-            p_xyz = mcm.unit_vector_lat_lon_to_cartesian(*p_latlon)
-            coords_dict = {"xyz": p_xyz, "latlondeg": p_latlon}
-            usp = UnitSpherePoint(coords_dict)
-            ordered_points.append(usp)
-        assert len(ordered_points) == 12, "initial icosa needs 12 vertices"
-
-        # add their neighbors by index
-        for point_index in range(len(ordered_points)):
-            point_name = original_points_order_by_name[point_index]
+        # everything is kept in arrays indexed by point index, sized for the final iteration up front:
+        # - xyz of each point, shape (n_points, 3)
+        # - adjacency of each point, shape (n_points, 6), in counterclockwise order; the 12 original vertices only have 5 neighbors and are padded with -1
+        n_points_final = 2 + 10 * 4 ** iterations_needed
+        xyz = np.empty((n_points_final, 3), dtype=float)
+        adjacency = np.full((n_points_final, 6), -1, dtype=np.int32)
+        degrees = np.full(n_points_final, 6, dtype=np.int32)
+        degrees[:12] = 5
+
+        # place original points in the arrays and add their neighbors by index
+        for point_index, point_name in enumerate(original_points_order_by_name):
+            p_latlon = icosahedron_original_points_latlon[point_name]
+            xyz[point_index] = mcm.unit_vector_lat_lon_to_cartesian(*p_latlon)
             neighbor_names = original_points_neighbors_by_name[point_name]
-            neighbor_indices = [original_points_order_by_name.index(name) for name in neighbor_names]
-            adjacencies_by_point_index[point_index] = neighbor_indices
-            print("adjacencies now:\n{}\n".format(adjacencies_by_point_index))
+            adjacency[point_index, :5] = [original_points_order_by_name.index(name) for name in neighbor_names]
+        n_points = 12
 
         # bisect edges until reach resolution
+        # call the directions (on rectangle representation) L, DL, D, R, UR, U (in counterclockwise order, as they appear on the rectangle representation for a generic peel-internal point)
+        opposite_direction = np.array([3, 4, 5, 0, 1, 2])  # map L vs R, DL vs UR, D vs U
         print("bisecting for {} iterations".format(iterations_needed))
         for iteration_i in range(1, iterations_needed+1):
-        # while True:
-            # # check some random edges to get average edge length
-            # edge_lengths = []
-            # for _ in range(100):
-            #     random_point_index = random.choice(list(adjacencies_by_point_index.keys()))
-            #     neighbor_index = random.choice(adjacencies_by_point_index[random_point_index])
-            #     p0 = ordered_points[random_point_index]
-            #     p1 = ordered_points[neighbor_index]
-            #     angle_radians = UnitSpherePoint.get_angle_radians_between(p0, p1)
-            #     edge_length = cada_ii_radius_km * angle_radians
-            #     edge_lengths.append(edge_length)
-            # edge_length = np.mean(edge_lengths)
-            # print("edge_length = {} km, iteration {}".format(edge_length, iteration_i))
-            # if edge_length <= self.edge_length_km:
-            #     break
-            # else:
-            #     iteration_i += 1
-            #     # we checked e.g. iteration 0 the first time (just the icosahedron's 12 vertices), now are going to enter new iteration
-
-            point_index_this_iteration_started_at = len(ordered_points)
             last_iteration_i = iteration_i - 1
             expected_index = 2 + 10 * 2 ** (2 * last_iteration_i)
-            assert point_index_this_iteration_started_at == expected_index, "math error in number of points by iteration at i={}, expected {}, got {}".format(iteration_i, expected_index, point_index_this_iteration_started_at)
+            assert n_points == expected_index, "math error in number of points by iteration at i={}, expected {}, got {}".format(iteration_i, expected_index, n_points)
 
             # bisection and neighbor updating
 
             # don't add any neighbors for the poles
             # for all other points (inside the 5 peels), bisect the first three edges (north(west)ward, westward, and south(west)ward, roughly)
             # thus each existing peel point will add three new points
-
-            # call the directions (on rectangle representation) L, DL, D, R, UR, U (in counterclockwise order, as they appear on the rectangle representation for a generic peel-internal point)
-            get_opposite_neighbor_direction = lambda i: {0: 3, 3: 0, 1: 4, 4: 1, 2: 5, 5: 2}[i]  # map L vs R, DL vs UR, D vs U
-
-            peel_point_indices = range(2, len(ordered_points))
-            for p_i in peel_point_indices:
-                first_three_neighbors = adjacencies_by_point_index[p_i][:3]
-
-                # bisect these edges
-                for neighbor_direction_i, n_i in enumerate(first_three_neighbors):
-                    p0 = ordered_points[p_i]
-                    p1 = ordered_points[n_i]
-                    midpoint = UnitSpherePoint.get_midpoint(p0, p1)
-
-                    # add it to the list so it will be in order of creation
-                    new_point_index = len(ordered_points)
-                    ordered_points.append(midpoint)
-
-                    adjacencies_by_point_index[new_point_index] = [None] * 6  # all new points will have 6 neighbors, only the 12 original vertices have 5
-                    neighbor_direction_back_to_parent = get_opposite_neighbor_direction(neighbor_direction_i)
-
-                    # pi_index_ni and ni_index_pi are the ACTUAL INDICES IN THE ADJACENCY LIST, which will DIFFER for the original 12 vertices because they only have 5 neighbors
-                    # for interior (later-added) points, these will coincide with neighbor_direction_i and neighbor_direction_back_to_parent
-                    # print("pi>ni = {} , ni>pi = {}".format(pi_index_ni, ni_index_pi))
-
-                    # update the adjacencies by replacing the original neighbor with the midpoint
-                    # print("pre-replacement adjacency of parent {} = {}".format(p_i, adjacencies_by_point_index[p_i]))
-                    pi_index_ni = adjacencies_by_point_index[p_i].index(n_i)
-                    adjacencies_by_point_index[p_i][pi_index_ni] = new_point_index
-                    adjacencies_by_point_index[new_point_index][neighbor_direction_i] = n_i  # here use direction, not index, in case parent has 5 neighbors
-                    # print("post-replacement adjacency of parent {} = {}".format(p_i, adjacencies_by_point_index[p_i]))
-
-                    # the same must be done for the original neighbor as well
-                    # print("pre-replacement adjacency of neighbor {} = {}".format(n_i, adjacencies_by_point_index[n_i]))
-                    ni_index_pi = adjacencies_by_point_index[n_i].index(p_i)
-                    adjacencies_by_point_index[n_i][ni_index_pi] = new_point_index
-                    adjacencies_by_point_index[new_point_index][neighbor_direction_back_to_parent] = p_i  # here use direction, not index, in case parent has 5 neighbors
-                    # print("post-replacement adjacency of neighbor {} = {}".format(n_i, adjacencies_by_point_index[n_i]))
-
-                    # print("post-replacement adjacency of new point {} = {}".format(new_point_index, adjacencies_by_point_index[new_point_index]))
-
-                # print("finished bisecting first three neighbors for point {}".format(p_i))
+            # every edge is among the first three of exactly one of its endpoints, so all edges are bisected at once
+            # the midpoint of edge (p, adjacency[p, d]) gets index n_points + 3*(p-2) + d, the same order the points used to be created in one by one
+            parents = np.repeat(np.arange(2, n_points, dtype=np.int32), 3)
+            directions = np.tile(np.arange(3), n_points - 2)
+            neighbors = adjacency[parents, directions]
+            new_points = np.arange(n_points, n_points + len(parents), dtype=np.int32)
+
+            midpoints = xyz[parents] + xyz[neighbors]
+            midpoints /= np.linalg.norm(midpoints, axis=1).reshape(-1, 1)
+            xyz[new_points] = midpoints
+            del midpoints
+
+            # update the adjacencies by replacing the original neighbor with the midpoint, on both ends of the edge
+            # for the original 12 vertices the position in the list can differ from the direction, because they only have 5 neighbors
+            position_of_parent_in_neighbor = np.argmax(adjacency[neighbors] == parents.reshape(-1, 1), axis=1)
+            adjacency[parents, directions] = new_points
+            adjacency[neighbors, position_of_parent_in_neighbor] = new_points
+            # the new point knows its two neighbors along the bisected edge; here use direction, not index, in case parent has 5 neighbors
+            adjacency[new_points, directions] = neighbors
+            adjacency[new_points, opposite_direction[directions]] = parents
+            del position_of_parent_in_neighbor
 
             print("finished bisecting edges for iteration {}".format(iteration_i))
 
-            print("\nfilling in missing neighbors for new points this iteration (i={})\n".format(iteration_i))
-
             # flanking approach to filling in missing neighbors:
             # each new point will have six adjacencies total, two of them currently known, and those two will be directly opposite one another
             # e.g. we know that 0 borders 36, 12, and 18 (in that counterclockwise order), and we know where 0 is in the adjacency list of 12
@@ -233,85 +241,33 @@ class IcosahedralGeodesicLattice(Lattice):
             #  /- 18 -\
             # 0 ------ 12
             #  \- 36 -/
-
-            indices_to_fill_out = list(range(point_index_this_iteration_started_at, len(ordered_points)))
-            indices_filled_to_completion = list()
-
-            for p_i in indices_to_fill_out:
-                adjacencies_p = adjacencies_by_point_index[p_i]
-                # print("filling out adjacencies for point {}: originally {}".format(p_i, adjacencies_p))
-                assert len(adjacencies_p) == 6, "all new points should have 6 neighbors but got {}".format(adjacencies_p)
-                assert sum(x is None for x in adjacencies_p) == 4, "expected 4 Nones and two known neighbors but got {}".format(adjacencies_p)
-                # get the 2 known neighbors
-                neighbor_0 = None
-                n_i_0 = None
-                neighbor_1 = None
-                n_i_1 = None
-                for n_i, neighbor in enumerate(adjacencies_p):
-                    if neighbor is not None:
-                        if n_i_0 is None:
-                            assert neighbor_0 is None
-                            n_i_0 = n_i
-                            neighbor_0 = neighbor
-                        else:
-                            assert neighbor_0 is not None
-                            assert n_i_1 is None
-                            assert neighbor_1 is None
-                            n_i_1 = n_i
-                            neighbor_1 = neighbor
-
-                for n_i, n in zip([n_i_0, n_i_1], [neighbor_0, neighbor_1]):
-                    adjacencies_n = adjacencies_by_point_index[n]
-                    index_p_in_n = adjacencies_n.index(p_i)
-                    position_plus_from_n = (index_p_in_n + 1) % len(adjacencies_n)
-                    position_minus_from_n = (index_p_in_n - 1) % len(adjacencies_n)
-                    flank_plus_from_n = adjacencies_n[position_plus_from_n]
-                    flank_minus_from_n = adjacencies_n[position_minus_from_n]
-                    # place the flanks in adjacencies_p so that they flank n but in the opposite order
-                    position_plus_from_p = (n_i + 1) % len(adjacencies_p)
-                    position_minus_from_p = (n_i - 1) % len(adjacencies_p)
-                    adjacencies_p[position_plus_from_p] = flank_minus_from_n  # OPPOSITE PLUS/MINUS
-                    adjacencies_p[position_minus_from_p] = flank_plus_from_n  # OPPOSITE PLUS/MINUS
-            
-                # print("- got filled neighbors for {}: {}".format(p_i, adjacencies_p))
-                assert adjacencies_by_point_index[p_i] == adjacencies_p  # checking that modifying object by reference is working
-                indices_filled_to_completion.append(p_i)
-            
-            for p_i in indices_filled_to_completion:
-                # don't do this in the loop or it'll skip stuff
-                indices_to_fill_out.remove(p_i)
-
-            print("- finished filling out adjacencies for new points")
-            assert len(indices_to_fill_out) == 0, "leftover points did not get filled out: {}".format(indices_to_fill_out)
-            for p_i in range(len(ordered_points)):
-                assert all(x is not None for x in adjacencies_by_point_index[p_i]), "Nones left in adjacencies for {}: {}".format(p_i, adjacencies_by_point_index[p_i])
-
-            position_memo_fp = "/home/wesley/programming/Mapping/MemoIcosa/MemoIcosaPosition_Iteration{}.txt".format(iteration_i)
-            adjacency_memo_fp = "/home/wesley/programming/Mapping/MemoIcosa/MemoIcosaAdjacency_Iteration{}.txt".format(iteration_i)
-            print("writing icosahedron memoization files")
-            with open(position_memo_fp, "w") as f:
-                for p_i in range(len(ordered_points)):
-                    usp = ordered_points[p_i]
-                    x, y, z = usp.get_coords("xyz")
-                    lat, lon = usp.get_coords("latlondeg")
-                    s = "{}:{},{},{};{},{}\n".format(p_i, x, y, z, lat, lon)
-                    f.write(s)
-            with open(adjacency_memo_fp, "w") as f:
-                for p_i in range(len(ordered_points)):
-                    neighbor_indices_str = ",".join(str(x) for x in adjacencies_by_point_index[p_i])
-                    s = "{}:{}\n".format(p_i, neighbor_indices_str)
-                    f.write(s)
-            print("- done writing memoization files")
-
-            print("now have {} points, iteration {}".format(len(ordered_points), iteration_i))
-
-        return ordered_points, adjacencies_by_point_index
+            for known_directions, known_neighbors in [(directions, neighbors), (opposite_direction[directions], parents)]:
+                neighbor_degrees = degrees[known_neighbors]
+                index_p_in_n = np.argmax(adjacency[known_neighbors] == new_points.reshape(-1, 1), axis=1)
+                flank_plus_from_n = adjacency[known_neighbors, (index_p_in_n + 1) % neighbor_degrees]
+                flank_minus_from_n = adjacency[known_neighbors, (index_p_in_n - 1) % neighbor_degrees]
+                # place the flanks in adjacency of p so that they flank n but in the opposite order
+                adjacency[new_points, (known_directions + 1) % 6] = flank_minus_from_n  # OPPOSITE PLUS/MINUS
+                adjacency[new_points, (known_directions - 1) % 6] = flank_plus_from_n  # OPPOSITE PLUS/MINUS
+
+            n_points += len(new_points)
+            assert (adjacency[:n_points] >= 0).sum() == degrees[:n_points].sum(), "missing neighbors left in adjacencies after iteration {}".format(iteration_i)
+            print("now have {} points, iteration {}".format(n_points, iteration_i))
+
+        latlondeg = mcm.unit_vector_cartesian_to_lat_lon(xyz[:, 0], xyz[:, 1], xyz[:, 2], deg=True).T
+        for point_index, point_name in enumerate(original_points_order_by_name):
+            latlondeg[point_index] = icosahedron_original_points_latlon[point_name]  # exact values rather than round-tripped ones
+
+        adjacency_indptr = np.zeros(n_points_final + 1, dtype=np.int64)
+        np.cumsum(degrees, out=adjacency_indptr[1:])
+        adjacency_indices = adjacency[adjacency >= 0]  # row-major, and padding is only at the end of the 5-neighbor rows
+        return xyz, latlondeg, adjacency_indptr, adjacency_indices
 
     @staticmethod
     def get_adjacencies_from_memoization_file(iteration):
-        # still not using this, can do so if creation of icosa is slow but for now it's fine
-        adjacencies_fp = "MemoIcosa/MemoIcosaAdjacency_Iteration{}.txt".format(iteration)
-        positions_fp = "MemoIcosa/MemoIcosaPosition_Iteration{}.txt".format(iteration)
+        # legacy text memoization format, superseded by the binary cache; kept so old memo files can still be converted
+        adjacencies_fp = os.path.join(IcosahedralGeodesicLattice.MEMO_DIR, "MemoIcosaAdjacency_Iteration{}.txt".format(iteration))
+        positions_fp = os.path.join(IcosahedralGeodesicLattice.MEMO_DIR, "MemoIcosaPosition_Iteration{}.txt".format(iteration))
         adjacencies_by_point_index = {}
         ordered_points = []
 
@@ -346,20 +302,6 @@ class IcosahedralGeodesicLattice(Lattice):
         print("successfully retrieved icosahedron memoization for {} iterations".format(iteration))
         return ordered_points, adjacencies_by_point_index
 
-    def convert_adjacencies_to_usp(self):
-        adjacencies_usp = {}
-        for k, lst in self.adjacencies_by_point_index.items():
-            usp = self.points[k]
-            adj_usps = [self.points[n] for n in lst]
-            adjacencies_usp[usp] = adj_usps
-        return adjacencies_usp
-
-    def get_usp_to_index(self):
-        d = {}
-        for i in range(len(self.points)):
-            d[self.points[i]] = i
-        return d
-
     @staticmethod
     def get_iterations_from_number_of_points(n):
         try:
@@ -380,28 +322,30 @@ class IcosahedralGeodesicLattice(Lattice):
         # this is what I want (b from core to current_point or vice versa, a from current_point to objective, rejection tells what direction to go in from a, rejection will be tangent to the sphere at a)
         a_i, b_i = current_point, objective
         assert a_i != b_i, "cannot get path step from point {} to itself".format(a_i)
-        xyz_a = np.array(self.points[a_i].get_coords("xyz"))
-        xyz_b = np.array(self.points[b_i].get_coords("xyz"))
+        xyz_a = self.xyz_coords[a_i]
+        xyz_b = self.xyz_coords[b_i]
         vector_to_objective = xyz_b - xyz_a
         vector_from_core_to_current = xyz_a  # minus (0, 0, 0)
-        rejection_vector = mcm.vector_rejection_3d(vector_to_objective, vector_from_core_to_current)
+        rejection_vector = vector_to_objective - (vector_to_objective @ vector_from_core_to_current) / (vector_from_core_to_current @ vector_from_core_to_current) * vector_from_core_to_current
            
         # now get neighbor in that direction, but allow some randomness somehow
-        neighbor_indices = self.adjacencies_by_point_index[current_point]
-        neighbor_xyzs = [np.array(self.points[p_i].get_coords("xyz")) for p_i in neighbor_indices]
-        displacements = [xyz - xyz_a for xyz in neighbor_xyzs]
+        # the unit directions to the neighbors are precomputed for the whole lattice, so only the angles are computed here
+        indptr, indices = self.get_adjacency_csr()
+        neighbor_indices = indices[indptr[a_i]:indptr[a_i+1]]
+        rejection_mag = np.linalg.norm(rejection_vector)
 
-        if mcm.mag_3d(rejection_vector) == 0:
+        if rejection_mag == 0:
             # either going to same point or going to point directly opposite the sphere; either way, will cause problems calculating angle
             chosen_neighbor_point_index = np.random.choice(neighbor_indices)  # can't get angles with zero rejection, choose at complete random
         else:
-            angles = [mcm.angle_between_vectors(dis, rejection_vector) for dis in displacements]
+            neighbor_directions = self.get_neighbor_directions()[indptr[a_i]:indptr[a_i+1]]
+            angles = np.arccos(np.clip(neighbor_directions @ rejection_vector / rejection_mag, -1, 1))
             # bigger weight for smaller angle (closer to target direction), biggest angle will be pi
-            weights = [np.pi - angle for angle in angles]
-            total_weight = sum(weights)
-            if total_weight in [0, np.nan]:
+            weights = np.pi - angles
+            total_weight = weights.sum()
+            if total_weight == 0 or np.isnan(total_weight):
                 raise ValueError("invalid total weight {} from angles {}".format(total_weight, angles))
-            weights = np.array(weights) / total_weight
+            weights = weights / total_weight
             chosen_neighbor_point_index = np.random.choice(neighbor_indices, p=weights)
         return chosen_neighbor_point_index
 
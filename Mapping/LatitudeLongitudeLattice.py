@@ -14,6 +14,9 @@ class LatitudeLongitudeLattice(Lattice):
     # these points are called p00, p01, p10, p11 (row-column nomenclature)
     # e.g. p00 = Seattle, p01 = NYC, p10 = San Diego, p11 = Miami
 
+    # points and their adjacency are kept as arrays; point objects are only made if something asks for them (see Lattice)
+    LAZY_ATTRIBUTE_BUILDERS = dict(Lattice.LAZY_ATTRIBUTE_BUILDERS, lattice_position_to_point_number="get_lattice_position_to_point_number")
+
     def __init__(self, x_size, y_size, latlon00, latlon01, latlon10, latlon11):
         self.x_size = x_size
         self.y_size = y_size
@@ -24,20 +27,19 @@ class LatitudeLongitudeLattice(Lattice):
         self.lat10, self.lon10 = latlon10
         self.lat11, self.lon11 = latlon11
 
-        self.create_point_dicts()
-        self.adjacencies = self.get_adjacencies()
-        self.graph = self.get_graph()
-        self.xyz_coords = [p.get_coords("xyz") for p in self.points]
+        self.xyz_coords, self.latlondeg_coords = self.get_coordinate_arrays()
+        self.adjacency_indptr, self.adjacency_indices = self.get_adjacency_csr_from_grid()
         self.kdtree = KDTree(self.xyz_coords)  # for distance calculation
-    
-    def create_point_dicts(self):
-        print("creating point dict for LatitudeLongitudeLattice")
-        # creates dict to look up coordinates of point, e.g. {(x, y): UnitSpherePoint(...)}
-        self.lattice_position_to_point_number = {}
-        self.xyz_to_point_number = {}
-        self.points = []
-
-        # try to numpify, apply to whole array at once
+
+    def get_point_number(self, x, y):
+        # points are numbered row by row, point number = x * y_size + y; works on arrays too
+        return x * self.y_size + y
+
+    def get_lattice_position(self, point_number):
+        return divmod(point_number, self.y_size)
+
+    def get_coordinate_arrays(self):
+        print("creating coordinate arrays for LatitudeLongitudeLattice")
         rows, cols = np.meshgrid(range(self.x_size), range(self.y_size))
         latlons_array = mcm.get_lat_lon_of_point_on_map(
             rows, cols,
@@ -55,67 +57,47 @@ class LatitudeLongitudeLattice(Lattice):
         assert latlons_array.ndim == 3
         point_array_shape = latlons_array.shape[1:]
         assert point_array_shape == (self.y_size, self.x_size), "expected point array shape ({}, {}), got {}".format(self.x_size, self.y_size, point_array_shape)
-        lats = latlons_array[0]
-        lons = latlons_array[1]
-        xyzs_array = mcm.unit_vector_lat_lon_to_cartesian(lats, lons)
-        # now iterate over indices to create the individual point objects
-        print("creating UnitSpherePoints")
-        point_number = 0
-        for x_i in range(self.x_size):
-            if x_i % 100 == 0:
-                print("progress: row {}/{}".format(x_i, self.x_size))
-            for y_i in range(self.y_size):
-                # x and y are indices in the point array
-                lat = latlons_array[0, y_i, x_i]
-                lon = latlons_array[1, y_i, x_i]
-                latlon = (lat, lon)
-                # also get xyz (cartesian in 3d, not to be confused with x and y on the rectangular lattice)
-                x_coord = xyzs_array[0, y_i, x_i]
-                y_coord = xyzs_array[1, y_i, x_i]
-                z_coord = xyzs_array[2, y_i, x_i]
-                xyz = (x_coord, y_coord, z_coord)
-                coords_dict = {"xyz": xyz, "latlondeg": latlon}
-                p = UnitSpherePoint(coords_dict)
-                self.lattice_position_to_point_number[(x_i, y_i)] = point_number
-                self.xyz_to_point_number[xyz] = point_number
-                assert len(self.points) == point_number
-                self.points.append(p)
-                point_number += 1
-
-        print("- done creating point dict")
+        # the arrays are indexed [y, x]; transposing to [x, y] and flattening gives point number order
+        lats = latlons_array[0].T.reshape(-1)
+        lons = latlons_array[1].T.reshape(-1)
+        # also get xyz (cartesian in 3d, not to be confused with x and y on the rectangular lattice)
+        xyz_coords = np.stack(mcm.unit_vector_lat_lon_to_cartesian(lats, lons), axis=-1)
+        latlondeg_coords = np.stack([lats, lons], axis=-1)
+        print("- done creating coordinate arrays")
+        return xyz_coords, latlondeg_coords
+
+    def get_adjacency_csr_from_grid(self):
+        # 4 neighbors, not 8 (8 causes problems because rivers can flow through each other, for example)
+        xs, ys = self.get_lattice_position(np.arange(self.n_points()))
+        neighbor_columns = []
+        valid_columns = []
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            nx = xs + dx
+            ny = ys + dy
+            neighbor_columns.append(self.get_point_number(nx, ny))
+            valid_columns.append((0 <= nx) & (nx < self.x_size) & (0 <= ny) & (ny < self.y_size))
+        neighbors = np.stack(neighbor_columns, axis=1)
+        valid = np.stack(valid_columns, axis=1)
+        indptr = np.zeros(self.n_points() + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=indptr[1:])
+        indices = neighbors[valid]  # row-major, so each point's valid neighbors stay together and in order
+        return indptr, indices
+
+    def get_lattice_position_to_point_number(self):
+        return {(x, y): self.get_point_number(x, y) for x in range(self.x_size) for y in range(self.y_size)}
 
     def get_usp_from_lattice_position(self, xy):
-        point_number = self.lattice_position_to_point_number[xy]
-        usp = self.points[point_number]
+        point_number = self.get_point_number(*xy)
+        usp = self.points_view[point_number]
         return usp
 
     def get_adjacencies(self):
-        print("getting adjacencies for LatitudeLongitudeLattice")
-        # build it from x, y first and then convert to UnitSpherePoint using the point_dict
-        d = {}
-        for x in range(self.x_size):
-            for y in range(self.y_size):
-                # 4 neighbors, not 8 (8 causes problems because rivers can flow through each other, for example)
-                neighbors = [
-                    (x+1, y), (x-1, y),
-                    (x, y+1), (x, y-1),
-                ]
-                neighbors = self.filter_invalid_points(neighbors)
-                d[(x, y)] = neighbors
-
-        # convert to UnitSpherePoint
-        d_usp = {}
-        for k, neighbors_list in d.items():
-            k_usp = self.get_usp_from_lattice_position(k)
-            ns_usp = [self.get_usp_from_lattice_position(n) for n in neighbors_list]
-            d_usp[k_usp] = ns_usp
-
-        print("- done getting adjacencies")
-        return d_usp
+        # point objects keyed by point objects, for legacy callers; prefer get_adjacency_csr
+        return self.adjacencies
 
     def average_latlon(self):
-        half_x = self.x_size/2
-        half_y = self.y_size/2
+        half_x = np.array(self.x_size/2)
+        half_y = np.array(self.y_size/2)
         return mcm.get_lat_lon_of_point_on_map(half_x, half_y, self.x_size, self.y_size,
             self.lat00, self.lon00,
             self.lat01, self.lon01,
@@ -5,7 +5,6 @@
 
 import random
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.tri as tri  # interpolation of irregularly spaced data
 import numpy as np
@@ -15,12 +14,90 @@ from sklearn.neighbors import KDTree
 
 from UnitSpherePoint import UnitSpherePoint
 import PlottingUtil as pu
+import GraphUtil as gu
+import LatticeRenderer as lr
+
+
+class PointsView:
+    # read-only sequence of a lattice's points, each UnitSpherePoint made from the coordinate arrays only when indexed
+    # for callers that touch a few points; each access gives a new object, so use lattice.points for identity or dict keys
+    def __init__(self, lattice):
+        self.lattice = lattice
+
+    def __len__(self):
+        return self.lattice.n_points()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        coords_dict = {"xyz": tuple(self.lattice.xyz_coords[i].tolist()), "latlondeg": tuple(self.lattice.latlondeg_coords[i].tolist())}
+        return UnitSpherePoint(coords_dict)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 
 class Lattice:
+    # subclasses must set the arrays xyz_coords (n_points, 3) and latlondeg_coords (n_points, 2), a kdtree on xyz_coords,
+    # and either adjacencies_by_point_index or adjacency_indptr/adjacency_indices
+    # the heavier object-based structures below are then built from those only when first accessed
+    LAZY_ATTRIBUTE_BUILDERS = {
+        "points": "create_points",
+        "usp_to_index": "get_usp_to_index",
+        "adjacencies": "convert_adjacencies_to_usp",
+        "adjacencies_by_point_index": "get_adjacencies_by_point_index_from_csr",
+        "xyz_to_point_number": "get_xyz_to_point_number",
+        "graph": "get_graph",
+        "render_geometry": "get_render_geometry",
+    }
+
     def __init__(self):
         raise NotImplementedError("do not initialize Lattice itself; use a subclass such as LatitudeLongitudeLattice")
 
+    def __getattr__(self, name):
+        # only called when normal attribute lookup fails, i.e. the lazy attribute has not been built yet
+        builder_name = type(self).LAZY_ATTRIBUTE_BUILDERS.get(name)
+        if builder_name is None:
+            raise AttributeError("{} object has no attribute {}".format(type(self).__name__, name))
+        print("building {} for {}".format(name, type(self).__name__))
+        value = getattr(self, builder_name)()
+        setattr(self, name, value)
+        return value
+
+    @property
+    def points_view(self):
+        return PointsView(self)
+
+    def create_points(self):
+        points = []
+        for xyz, latlon in zip(self.xyz_coords.tolist(), self.latlondeg_coords.tolist()):
+            coords_dict = {"xyz": tuple(xyz), "latlondeg": tuple(latlon)}
+            points.append(UnitSpherePoint(coords_dict))
+        return points
+
+    def get_usp_to_index(self):
+        d = {}
+        for i in range(len(self.points)):
+            d[self.points[i]] = i
+        return d
+
+    def convert_adjacencies_to_usp(self):
+        adjacencies_usp = {}
+        for k, lst in self.adjacencies_by_point_index.items():
+            usp = self.points[k]
+            adj_usps = [self.points[n] for n in lst]
+            adjacencies_usp[usp] = adj_usps
+        return adjacencies_usp
+
+    def get_adjacencies_by_point_index_from_csr(self):
+        indptr = self.adjacency_indptr.tolist()
+        indices = self.adjacency_indices.tolist()
+        return {p_i: indices[indptr[p_i]:indptr[p_i+1]] for p_i in range(self.n_points())}
+
+    def get_xyz_to_point_number(self):
+        return {tuple(xyz): point_number for point_number, xyz in enumerate(self.xyz_coords.tolist())}
+
     def get_adjacencies(self):
         # specific to the subclasses, depending on type of lattice
         raise NotImplementedError
@@ -34,11 +111,29 @@ class Lattice:
                 g.add_edge(p, p1)
         return g
 
+    def get_render_geometry(self):
+        return lr.get_render_geometry(self)
+
+    def get_adjacency_csr(self):
+        # adjacency as (indptr, indices) arrays, for the vectorized graph functions in GraphUtil
+        if not hasattr(self, "adjacency_indptr") or self.adjacency_indptr is None:
+            self.adjacency_indptr, self.adjacency_indices = gu.get_csr_from_adjacency_dict(self.adjacencies_by_point_index, self.n_points())
+        return self.adjacency_indptr, self.adjacency_indices
+
+    def get_neighbor_directions(self):
+        # unit vectors from each point toward each of its neighbors, aligned with adjacency_indices
+        if not hasattr(self, "neighbor_directions") or self.neighbor_directions is None:
+            indptr, indices = self.get_adjacency_csr()
+            sources = np.repeat(np.arange(self.n_points()), np.diff(indptr))
+            displacements = self.xyz_coords[indices] - self.xyz_coords[sources]
+            self.neighbor_directions = displacements / np.linalg.norm(displacements, axis=1, keepdims=True)
+        return self.neighbor_directions
+
     def n_points(self):
-        return len(self.adjacencies)
+        return len(self.xyz_coords)
 
     def get_random_point_index(self):
-        return random.randrange(len(self.points))
+        return random.randrange(self.n_points())
 
     def get_neighbors(self, p_i):
         return self.adjacencies_by_point_index[p_i]
@@ -46,29 +141,28 @@ class Lattice:
     def closest_point_to(self, usp):
         assert type(usp) is UnitSpherePoint
         xyz_as_one_sample = np.array([usp.get_coords("xyz"),])
-        indices = self.kdtree.query(xyz_as_one_sample, k=1, return_distance=False)
-        # print("got closest point indices:", indices)
-        assert type(indices) in [list, np.ndarray]
-        assert len(indices) == 1  # scikit-learn return type from these queries
-        index_array = indices[0]
-        assert index_array.shape == (1,)
-        index = index_array[0]
-        point_xyz = tuple(self.kdtree.data[index])
-        point_number = self.xyz_to_point_number[point_xyz]
+        point_number = self.closest_point_indices_to_xyz(xyz_as_one_sample)[0]
         usp = self.points[point_number]
         return usp
 
+    def closest_point_indices_to_xyz(self, xyz_array):
+        # xyz_array has shape (n_samples, 3); the kdtree is built on xyz_coords in point order, so its indices are point indices
+        indices = self.kdtree.query(xyz_array, k=1, return_distance=False)
+        assert indices.shape == (len(xyz_array), 1)  # scikit-learn return type from these queries
+        return indices[:, 0]
+
     def get_random_path(self, a, b, points_to_avoid):
         # start and end should inch toward each other
         i = 0
         points_in_path = {a, b}
+        # grown one point at a time rather than rebuilt from points_to_avoid | points_in_path each step
+        points_to_avoid_this_step = points_to_avoid | points_in_path
         current_a = a
         current_b = b
         while True:
             which_one = i % 2
             current_point = [current_a, current_b][which_one]
             objective = [current_b, current_a][which_one]
-            points_to_avoid_this_step = points_to_avoid | points_in_path
             
             next_step = self.get_next_step_in_path(current_point, objective, points_to_avoid_this_step)
             if which_one == 0:
@@ -79,8 +173,10 @@ class Lattice:
                 raise
 
             points_in_path.add(next_step)
+            points_to_avoid_this_step.add(next_step)
 
-            if current_a in self.get_neighbors(current_b):
+            # the two ends can also meet by stepping onto each other
+            if current_a == current_b or current_a in self.get_neighbors(current_b):
                 break
 
             i += 1
@@ -122,64 +218,9 @@ class Lattice:
 
         return data
 
-    def plot_data(self, data_dict, key_str, size_inches=None, cmap=None):
-        data_point_indices = list(data_dict.keys())
-        data_points = [self.points[p_i] for p_i in data_point_indices]
-        latlons_deg = [p.get_coords("latlondeg") for p in data_points]
-        lats_deg = np.array([ll[0] for ll in latlons_deg])
-        lons_deg = np.array([ll[1] for ll in latlons_deg])
-        vals = np.array([data_dict[p_i].get(key_str, 0) for p_i in data_point_indices])
-        # print("lat range {} to {}\nlon range {} to {}".format(min(lats_deg), max(lats_deg), min(lons_deg), max(lons_deg)))
-        # plt.scatter(lats_deg, lons_deg)
-        # plt.show()
-        min_val = min(vals)
-        max_val = max(vals)
-        
-        lat_0s = [[   0,    0,    0,   90], [   0,    0,    0,  -90]]
-        lon_0s = [[-120,  -60,    0,    0], [  60,  120,  180,    0]]
-        n_rows = len(lon_0s)
-        n_cols = len(lon_0s[0])
-        fig = plt.figure(figsize=size_inches)
-        if cmap is None:
-            # default to showing elevation
-            cmap = pu.get_land_and_sea_colormap()
-            contour_levels = pu.get_contour_levels(min_val, max_val, prefer_positive=True)
-        else:
-            contour_levels = pu.get_contour_levels(min_val, max_val, prefer_positive=False)
-
-        # debugging: print contour levels and colors
-        # for level_i in range(len(contour_levels)):
-        #     if level_i > 0:
-        #         # show the first halfway value as well, just skip it for min (level_i=0)
-        #         previous_level_value = contour_levels[level_i - 1]
-        #         current_level_value = contour_levels[level_i]
-        #         halfway_value_linear = (previous_level_value + current_level_value) / 2
-        #         halfway_level_01 = (halfway_value_linear - contour_levels[0]) / (contour_levels[-1] - contour_levels[0])
-        #         print("cmap at contour FILL level {} = value {} = RGBA {}".format(level_i - 0.5, halfway_value_linear, cmap(halfway_level_01)))
-        # 
-        #     level_value = contour_levels[level_i]
-        #     level_01 = (level_value - contour_levels[0]) / (contour_levels[-1] - contour_levels[0])
-        #     print("cmap at contour LINE level {} = value {} = RGBA {}".format(level_i, level_value, cmap(level_01)))
-
-        for i, row in enumerate(lon_0s):
-            for j, lon_0 in enumerate(row):
-                lat_0 = lat_0s[i][j]
-                nth_plot = i*len(row) + j + 1
-                ax = fig.add_subplot(n_rows, n_cols, nth_plot)
-                # m = Basemap(projection="cyl")
-                m = Basemap(projection="ortho", lat_0=lat_0, lon_0=lon_0, resolution='l')
-                m.drawmeridians(np.arange(0,360,30))
-                m.drawparallels(np.arange(-90,90,30))
-                MC = m.contourf(lons_deg, lats_deg, vals, levels=contour_levels, cmap=cmap, ax=ax, tri=True, latlon=True)  # latlon=True interprets first two args as LON and LAT RESPECTIVELY
-                # m.contour(lons_deg, lats_deg, vals, levels=[min(vals), 0, max(vals)], colors="k", ax=ax, tri=True, latlon=True)
-    
-                # parallel_labels_bools = [1, 1, 0, 0]  # are labels placed at [left right top bottom]
-                # meridian_labels_bools = [0, 0, 1, 1]  # are labels placed at [left right top bottom]
-                # m.drawparallels(np.arange(-90,91,30), labels=parallel_labels_bools)
-                # m.drawmeridians(np.arange(-180,181,30), labels=meridian_labels_bools)
-    
-                clb = plt.colorbar(MC, ax=ax)  # without these args, it will say it can't find a mappable object for colorbar
-                clb.ax.set_title(key_str)
-                plt.title("latlon {},{}".format(lat_0, lon_0))
-
-
+    def plot_data(self, vals, key_str, size_inches=None, cmap=None):
+        # vals is an array of values in order of point index
+        # draws on a new pyplot figure; the triangulation and projections are cached on the lattice, so repeated calls are cheap
+        renderer = lr.LatticeRenderer(self, size_inches=size_inches)
+        renderer.render(vals, key_str, cmap=cmap)
+        return renderer
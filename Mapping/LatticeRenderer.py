@@ -0,0 +1,136 @@
+# draws data on a lattice as eight orthographic views of the globe, like Basemap's ortho projection but without re-triangulating per call
+# the triangulation (convex hull of the points) and each view's projected visible triangles depend only on the lattice,
+# so they are computed once (Lattice.render_geometry) and every frame just recolors the cached triangles from the value array
+# headless=True draws on an Agg canvas with no pyplot figure, for writing PNG frames (e.g. a time-lapse of fill_elevations)
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy.spatial import ConvexHull
+
+import MapCoordinateMath as mcm
+import PlottingUtil as pu
+
+
+VIEW_LAT_0S = [[   0,    0,    0,   90], [   0,    0,    0,  -90]]
+VIEW_LON_0S = [[-120,  -60,    0,    0], [  60,  120,  180,    0]]
+GRATICULE_SPACING_DEG = 30
+
+
+def get_render_geometry(lattice):
+    xyz = np.asarray(lattice.xyz_coords)
+    print("triangulating {} points for rendering".format(len(xyz)))
+    hull = ConvexHull(xyz)
+    # hull.equations are (normal, offset) with outward normals; faces on the sphere's surface have the center on their inner side,
+    # while faces closing off the flat side of a lattice covering only part of the sphere (e.g. lat/lon) have it outside
+    triangles = hull.simplices[hull.equations[:, 3] < 0]
+    graticule_lines_xyz = get_graticule_lines_xyz()
+    views = []
+    for lat_0_row, lon_0_row in zip(VIEW_LAT_0S, VIEW_LON_0S):
+        for lat_0, lon_0 in zip(lat_0_row, lon_0_row):
+            center, east, north = get_view_basis(lat_0, lon_0)
+            xy = np.stack([xyz @ east, xyz @ north], axis=-1)
+            # keep the triangles entirely on the near hemisphere
+            visible = ((xyz @ center)[triangles] > 0).all(axis=1)
+            view_triangles = triangles[visible]
+            graticule_lines_xy = []
+            for line_xyz in graticule_lines_xyz:
+                line_xy = np.stack([line_xyz @ east, line_xyz @ north], axis=-1)
+                line_xy[line_xyz @ center < 0] = np.nan  # hidden side, leaves a gap in the line
+                graticule_lines_xy.append(line_xy)
+            views.append({
+                "lat_0": lat_0,
+                "lon_0": lon_0,
+                "triangles": view_triangles,
+                "vertices": xy[view_triangles],
+                "graticule_lines": graticule_lines_xy,
+            })
+    print("- done triangulating, {} triangles".format(len(triangles)))
+    return {"triangles": triangles, "views": views}
+
+
+def get_view_basis(lat_0, lon_0):
+    # unit vectors toward the viewer (the view center), and to the right and up on the projected image
+    center = mcm.unit_vector_lat_lon_to_cartesian(lat_0, lon_0)
+    lon_0_rad = np.radians(lon_0)
+    east = np.array([-np.sin(lon_0_rad), np.cos(lon_0_rad), 0])
+    north = np.cross(center, east)
+    return center, east, north
+
+
+def get_graticule_lines_xyz(n_samples_per_line=181):
+    lines = []
+    lats = np.linspace(-90, 90, n_samples_per_line)
+    for lon in range(0, 360, GRATICULE_SPACING_DEG):
+        lines.append(mcm.unit_vector_lat_lon_to_cartesian(lats, np.full(n_samples_per_line, lon)).T)
+    lons = np.linspace(-180, 180, 2 * n_samples_per_line)
+    for lat in range(-90 + GRATICULE_SPACING_DEG, 90, GRATICULE_SPACING_DEG):
+        lines.append(mcm.unit_vector_lat_lon_to_cartesian(np.full(len(lons), lat), lons).T)
+    return lines
+
+
+class LatticeRenderer:
+    def __init__(self, lattice, figure=None, size_inches=None, headless=False):
+        self.lattice = lattice
+        self.geometry = lattice.render_geometry
+        self.headless = headless
+        if figure is None:
+            if headless:
+                figure = Figure(figsize=size_inches)
+                FigureCanvasAgg(figure)
+            else:
+                figure = plt.figure(figsize=size_inches)
+        self.figure = figure
+        self.collections = None  # one per view, made on the first render
+
+    def create_axes(self):
+        n_rows = len(VIEW_LON_0S)
+        n_cols = len(VIEW_LON_0S[0])
+        self.collections = []
+        self.axes = []
+        for view_i, view in enumerate(self.geometry["views"]):
+            ax = self.figure.add_subplot(n_rows, n_cols, view_i + 1)
+            collection = PolyCollection(view["vertices"], linewidths=0, antialiaseds=False)
+            ax.add_collection(collection)
+            for line_xy in view["graticule_lines"]:
+                ax.plot(line_xy[:, 0], line_xy[:, 1], color="k", linewidth=0.3)
+            theta = np.linspace(0, 2*np.pi, 361)
+            ax.plot(np.cos(theta), np.sin(theta), color="k", linewidth=0.8)
+            ax.set_xlim(-1.02, 1.02)
+            ax.set_ylim(-1.02, 1.02)
+            ax.set_aspect("equal")
+            ax.axis("off")
+            ax.set_title("latlon {},{}".format(view["lat_0"], view["lon_0"]))
+            self.axes.append(ax)
+            self.collections.append(collection)
+        self.colorbar = self.figure.colorbar(self.collections[0], ax=self.axes)
+
+    def render(self, vals, key_str, cmap=None):
+        # vals is an array of values in order of point index
+        vals = np.asarray(vals)
+        assert vals.shape == (self.lattice.n_points(),), "expected one value per point, got shape {}".format(vals.shape)
+        min_val = vals.min()
+        max_val = vals.max()
+        if cmap is None:
+            # default to showing elevation
+            cmap = pu.get_land_and_sea_colormap()
+            contour_levels = pu.get_contour_levels(min_val, max_val, prefer_positive=True)
+        else:
+            contour_levels = pu.get_contour_levels(min_val, max_val, prefer_positive=False)
+        # banded colors like the filled contours this replaces; values beyond the levels get the end colors
+        norm = mcolors.BoundaryNorm(contour_levels, cmap.N, extend="both")
+
+        if self.collections is None:
+            self.create_axes()
+        for view, collection in zip(self.geometry["views"], self.collections):
+            collection.set_array(vals[view["triangles"]].mean(axis=1))
+            collection.set_cmap(cmap)
+            collection.set_norm(norm)
+        self.colorbar.update_normal(self.collections[0])
+        self.colorbar.ax.set_title(key_str)
+
+    def save_frame(self, output_fp):
+        self.figure.savefig(output_fp)
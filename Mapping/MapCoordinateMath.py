@@ -57,8 +57,8 @@ def angle_between_vectors(v1, v2):
     # dot = mag(v1) * mag(v2) * cos(theta)
     len1 = mag_3d(v1)
     len2 = mag_3d(v2)
-    assert len1 > 0, "v1 has zero mag: {}".format(v1)
-    assert len2 > 0, "v2 has zero mag: {}".format(v2)
+    assert (len1 > 0).all(), "v1 has zero mag: {}".format(v1)
+    assert (len2 > 0).all(), "v2 has zero mag: {}".format(v2)
     cos_theta = dot / (len1 * len2)
     theta = np.arccos(cos_theta)
     # print("got theta: {}".format(theta))
@@ -146,7 +146,23 @@ def get_lat_lon_of_point_on_map(r, c, map_r_size, map_c_size,
                                 map_r_max_c_min_lat, map_r_max_c_min_lon,
                                 map_r_max_c_max_lat, map_r_max_c_max_lon,
                                 deg=True):
-    # print("get_lat_lon_of_point r={}, c={}".format(r, c))
+    prc = get_xyz_of_point_on_map(r, c, map_r_size, map_c_size,
+        map_r_min_c_min_lat, map_r_min_c_min_lon,
+        map_r_min_c_max_lat, map_r_min_c_max_lon,
+        map_r_max_c_min_lat, map_r_max_c_min_lon,
+        map_r_max_c_max_lat, map_r_max_c_max_lon,
+        deg=deg)
+    prc_lat_lon = unit_vector_cartesian_to_lat_lon(prc[0], prc[1], prc[2], deg=deg)
+    return prc_lat_lon
+
+
+def get_xyz_of_point_on_map(r, c, map_r_size, map_c_size,
+                            map_r_min_c_min_lat, map_r_min_c_min_lon,
+                            map_r_min_c_max_lat, map_r_min_c_max_lon,
+                            map_r_max_c_min_lat, map_r_max_c_min_lon,
+                            map_r_max_c_max_lat, map_r_max_c_max_lon,
+                            deg=True):
+    # print("get_xyz_of_point r={}, c={}".format(r, c))
     # like 3d printer
     # go down the rows alpha_r of the way first on left and right edge
     # then go alpha_c of the way across between those points
@@ -160,8 +176,7 @@ def get_lat_lon_of_point_on_map(r, c, map_r_size, map_c_size,
     pr0 = rotate_partially_toward_other_unit_vector(p00, p10, alpha_r)
     pr1 = rotate_partially_toward_other_unit_vector(p01, p11, alpha_r)
     prc = rotate_partially_toward_other_unit_vector(pr0, pr1, alpha_c)
-    prc_lat_lon = unit_vector_cartesian_to_lat_lon(prc[0], prc[1], prc[2], deg=deg)
-    return prc_lat_lon
+    return prc
 
 
 
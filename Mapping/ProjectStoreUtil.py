@@ -0,0 +1,115 @@
+# binary storage for ElevationGeneration projects
+# each project version is one .npz container (a zip with one .npy member per data key) plus a json metadata member
+# members are stored uncompressed or deflated one by one, so a single key can be read without touching the others,
+# and uncompressed members can be memory-mapped straight out of the container
+
+import os
+import json
+import random
+import zipfile
+import numpy as np
+from datetime import datetime
+
+
+STORE_FORMAT_VERSION = 1
+METADATA_MEMBER = "__metadata__"
+DEFAULT_MAPPING_PROJECT_DIR = "/home/wesley/programming/Mapping/Projects/"
+
+
+def get_mapping_project_dir():
+    # set the MAPPING_PROJECT_DIR environment variable to keep projects somewhere else
+    return os.environ.get("MAPPING_PROJECT_DIR", DEFAULT_MAPPING_PROJECT_DIR)
+
+
+def get_data_dir(project_name):
+    return os.path.join(get_mapping_project_dir(), project_name, "Data")
+
+
+def get_plots_dir(project_name):
+    return os.path.join(get_mapping_project_dir(), project_name, "Plots")
+
+
+def get_project_data_fp(project_name, project_version):
+    return os.path.join(get_data_dir(project_name), "EGD_{}_v{}.npz".format(project_name, project_version))
+
+
+def get_checkpoint_fp(project_name, project_version):
+    return os.path.join(get_data_dir(project_name), "EGD_{}_v{}_checkpoint.npz".format(project_name, project_version))
+
+
+def get_legacy_data_fp(project_name, key_str, project_version):
+    # one text file per key with one value per line, as written by older versions
+    return os.path.join(get_data_dir(project_name), "EGD_{}_{}_v{}.txt".format(project_name, key_str, project_version))
+
+
+def write_container(fp, arrays, metadata, compress=True):
+    # arrays is {member_name: array}; written to a temporary file and then moved into place,
+    # so an interrupted save never leaves a half-written container where a good one was
+    metadata = dict(metadata)
+    metadata["store_format_version"] = STORE_FORMAT_VERSION
+    metadata["saved_at"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    assert METADATA_MEMBER not in arrays, "{} is reserved for the metadata".format(METADATA_MEMBER)
+    members = dict(arrays)
+    members[METADATA_MEMBER] = np.array(json.dumps(metadata))
+    tmp_fp = fp + ".tmp.npz"  # np.savez appends .npz to names without it
+    if compress:
+        np.savez_compressed(tmp_fp, **members)
+    else:
+        np.savez(tmp_fp, **members)
+    os.replace(tmp_fp, fp)
+
+
+def read_metadata(fp):
+    with np.load(fp) as container:
+        metadata = json.loads(str(container[METADATA_MEMBER]))
+    assert metadata["store_format_version"] == STORE_FORMAT_VERSION, "unsupported store format version {} in {}".format(metadata["store_format_version"], fp)
+    return metadata
+
+
+def get_member_names(fp):
+    with np.load(fp) as container:
+        return [name for name in container.files if name != METADATA_MEMBER]
+
+
+def read_all_arrays(fp):
+    with np.load(fp) as container:
+        return {name: container[name] for name in container.files if name != METADATA_MEMBER}
+
+
+def read_array(fp, name, mmap=True):
+    # reads only this member; if it was stored uncompressed and mmap is True, it is memory-mapped (read-only) instead of read
+    with zipfile.ZipFile(fp) as zf:
+        info = zf.getinfo(name + ".npy")
+        if not mmap or info.compress_type != zipfile.ZIP_STORED:
+            with zf.open(info) as f:
+                return np.lib.format.read_array(f)
+    with open(fp, "rb") as f:
+        # the member's data starts after its local file header, whose name and extra field lengths are at bytes 26-30
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(fp, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+def get_random_states():
+    # the states of both random number generators, split into json-friendly metadata and an array
+    version, mt_state, gauss_next = random.getstate()
+    np_name, np_keys, np_pos, np_has_gauss, np_cached_gaussian = np.random.get_state()
+    metadata = {
+        "python_random_state": [version, list(mt_state), gauss_next],
+        "numpy_random_state": [np_name, int(np_pos), int(np_has_gauss), float(np_cached_gaussian)],
+    }
+    return metadata, np_keys
+
+
+def set_random_states(metadata, np_keys):
+    version, mt_state, gauss_next = metadata["python_random_state"]
+    random.setstate((version, tuple(mt_state), gauss_next))
+    np_name, np_pos, np_has_gauss, np_cached_gaussian = metadata["numpy_random_state"]
+    np.random.set_state((np_name, np.asarray(np_keys, dtype=np.uint32), np_pos, np_has_gauss, np_cached_gaussian))
@@ -205,4 +205,4 @@ else:
 
 
 with open("Composition.mid", "wb") as f:
-	f.write(midi.score2midi(my_score))
+	midi.score2midi(my_score, file=f)
@@ -9,14 +9,57 @@ from FunctionalFormGui import get_function, get_distribution_function
 import Music.WavUtil as wav
 
 
+CHUNK_ELEMENTS = 2**21  # partials * frames computed at once; bounds the size of each working array (16 MB of float64)
+
+
 def elementwise_mean(array):
     return np.mean(array, axis=0)
 
-def function_sum(fs):
-    return lambda x: sum(f(x) for f in fs)
 
-def function_mean(fs):
-    return lambda x: function_sum(fs)(x) / len(fs)
+def get_chunk_size(n_partials, chunk_elements=CHUNK_ELEMENTS):
+    return max(1, chunk_elements // n_partials)
+
+
+def get_envelopes(frames, peaks, dilations, out=None):
+    # amplitude of each partial (rows) at each frame (columns), 1 / (1 + x**4) with x the time from the peak in dilated seconds,
+    # so greater than 1/2 for the dilation's length either side of the peak
+    fps = wav.RATE
+    out = np.subtract(frames[np.newaxis, :], peaks[:, np.newaxis], out=out)
+    out /= (dilations * fps)[:, np.newaxis]
+    out *= out
+    out *= out
+    out += 1
+    return np.reciprocal(out, out=out)
+
+
+def synthesize_chunks(freqs, phases, n_frames, peaks=None, dilations=None, chunk_size=None):
+    # additive synthesis, yielding the signal chunk_size frames at a time:
+    # the mean over the partials of sin(2 pi freq t + phase), each times its envelope if peaks and dilations are given
+    # the oscillators over one chunk are tabulated once with zero phase; each chunk's starting phases are applied
+    # by the angle-sum identity, sin(a + b) = sin(a) cos(b) + cos(a) sin(b), so no sines are taken per chunk
+    fps = wav.RATE
+    freqs = np.asarray(freqs, dtype=float)
+    phases = np.asarray(phases, dtype=float)
+    n_partials = len(freqs)
+    if chunk_size is None:
+        chunk_size = get_chunk_size(n_partials)
+    radians_per_frame = 2*np.pi * freqs / fps
+    chunk_frames = np.arange(chunk_size)
+    angles = np.multiply.outer(radians_per_frame, chunk_frames)
+    sin_table = np.sin(angles)
+    cos_table = np.cos(angles, out=angles)
+    envelopes = np.empty((n_partials, chunk_size)) if peaks is not None else None
+    for start in range(0, n_frames, chunk_size):
+        n = min(chunk_size, n_frames - start)
+        start_phases = np.mod(radians_per_frame * start + phases, 2*np.pi)
+        cos_start = np.cos(start_phases)
+        sin_start = np.sin(start_phases)
+        if peaks is None:
+            chunk = cos_start @ sin_table[:, :n] + sin_start @ cos_table[:, :n]
+        else:
+            env = get_envelopes(start + chunk_frames[:n], peaks, dilations, out=envelopes[:, :n])
+            chunk = np.einsum("pk,pk,p->k", env, sin_table[:, :n], cos_start) + np.einsum("pk,pk,p->k", env, cos_table[:, :n], sin_start)
+        yield chunk / n_partials
 
 def get_test_signal():
     # http://stackoverflow.com/questions/18625085/how-to-plot-a-wav-file
@@ -33,14 +76,9 @@ def get_test_signal():
 def write_wav_from_freqs(freqs, n_seconds):
     fps = wav.RATE
     n_frames = fps * n_seconds
+    phases = np.random.uniform(0, 2*np.pi, len(freqs))
 
-    signal_function_from_freq = lambda freq: lambda i: np.sin(i / fps * freq * (2*np.pi) + np.random.uniform(0, 2*np.pi))
-
-    signal_functions = [signal_function_from_freq(freq) for freq in freqs]
-    new_signal_function = function_mean(signal_functions)
-    new_signal = new_signal_function(np.array([i for i in range(n_frames)]))
-
-    wav.write_signal_to_wav(new_signal, "InverseFourierOutput.wav")
+    wav.write_chunked_signal_to_wav(synthesize_chunks(freqs, phases, n_frames), "InverseFourierOutput.wav")
 
 
 def test_can_open_file():
@@ -159,69 +197,39 @@ def get_varying_spectrum(freqs, freq_names, full_length_seconds, length_dilation
     fps = wav.RATE
     n_frames = fps * full_length_seconds
 
-    peaks = [random.uniform(0, full_length_seconds * fps) for _ in freqs]
-
-    get_length_dilation = length_dilation_dist
-    def amplitude_function(peak):
-        dilation = get_length_dilation()
-        return lambda t: 1 / (1 + ((t - peak) / dilation / fps) ** 4)  # greater than 1/2 from -1 to 1, so dilate this interval
-
-    phase_function = lambda freq: lambda t: np.sin(t / fps * freq * (2*np.pi) + np.random.uniform(0, 2*np.pi))
-    amplitudes = []
-    phases = []
-
-    def get_signal_function(freq, peak):
-        amplitude = amplitude_function(peak)
-        amplitudes.append(amplitude)
-        phase = phase_function(freq)
-        phases.append(phase)
-        return lambda t: amplitude(t) * phase(t)
+    # everything random about each partial is drawn up front, so the signal can be computed in chunks and the spectrogram below drawn from the same partials
+    peaks = np.array([random.uniform(0, full_length_seconds * fps) for _ in freqs])
+    dilations = np.array([length_dilation_dist() for _ in freqs])
+    phases = np.random.uniform(0, 2*np.pi, len(freqs))
 
-    signal_functions = []
-    signal_i = 0
-    for peak, freq in zip(peaks, freqs):
-        if signal_i % 10 == 0:
-            print("getting signal #{}/{}".format(signal_i, len(freqs)))
-        func = get_signal_function(freq, peak)
-        signal_functions.append(func)
-
-    new_signal_function = function_mean(signal_functions)
-    xs = np.array([i for i in range(n_frames)])
-    new_signal = new_signal_function(xs)
-
-    wav.write_signal_to_wav(new_signal, "InverseFourierOutput.wav")
+    chunk_size = get_chunk_size(len(freqs))
+    print("synthesizing {} partials in chunks of {} frames".format(len(freqs), chunk_size))
+    chunks = synthesize_chunks(freqs, phases, n_frames, peaks=peaks, dilations=dilations, chunk_size=chunk_size)
+    wav.write_chunked_signal_to_wav(chunks, "InverseFourierOutput.wav")
 
     # trying to create spectrogram; matplotlib's specgram doesn't work well at all for this
     bin_width = 1 / 12
     log_freqs = [math.log(freq, 2) for freq in freqs]
     freq_bins = np.arange(min(log_freqs) - 1, max(log_freqs) + 1, bin_width)
-    freq_and_amplitude = [(f, a) for f, p, a in sorted(zip(log_freqs, peaks, amplitudes))]
+    freq_bin_indices = np.searchsorted(freq_bins, log_freqs, side="right") - 1
 
     graph_x_points_per_second = 50
     x_step = int(fps/graph_x_points_per_second)  # e.g. fps=44100, graph_x_points_per_second=50 --> x_step = 882
     print("plotting every {} frames = {} times per second".format(x_step, graph_x_points_per_second))
-    graph_x_points = np.array([xs[i * x_step] for i in range(math.ceil(len(xs) / x_step))])  # only have some x points to avoid massive image
+    graph_x_points = np.arange(0, n_frames, x_step)  # only have some x points to avoid massive image
     # want xticks each second
     x_tick_labels = [i for i in range(full_length_seconds + 1)]  # actual time-unit labels on axis
     x_ticks = [i * graph_x_points_per_second for i in x_tick_labels]
     xlabel = "seconds"
 
-    
-
-    amplitude_array = []
-    for lower_bound, upper_bound in zip(freq_bins[:-1], freq_bins[1:]):
-        if len(freq_and_amplitude) == 0:
-            amplitude_array.append(graph_x_points * 0.0)
-            continue
-        current_amplitude = graph_x_points * 0.0  # need float because will get complaint at "current_amplitude += new_amplitude"
-        in_bin = lambda freq_and_amplitude, lower_bound, upper_bound: lower_bound <= freq_and_amplitude[0][0] < upper_bound
-        while len(freq_and_amplitude) > 0 and in_bin(freq_and_amplitude, lower_bound, upper_bound):
-            amplitude = freq_and_amplitude[0][1]
-            new_amplitude = amplitude(graph_x_points) * 1e6  # plot fails to pick up on tiny values
-            current_amplitude += new_amplitude
-            freq_and_amplitude = freq_and_amplitude[1:]
-        amplitude_array.append(current_amplitude)
-    amplitude_array = np.array(amplitude_array)
+    # sum of the envelopes of the partials in each frequency bin, a few partials at a time
+    amplitude_array = np.zeros((len(freq_bins) - 1, len(graph_x_points)))
+    partials_per_step = get_chunk_size(len(graph_x_points))
+    for first in range(0, len(freqs), partials_per_step):
+        partials = slice(first, first + partials_per_step)
+        envelopes = get_envelopes(graph_x_points, peaks[partials], dilations[partials])
+        np.add.at(amplitude_array, freq_bin_indices[partials], envelopes * 1e6)  # plot fails to pick up on tiny values
+
     aspect_ratio = 1
     aspect_arg = aspect_ratio*(amplitude_array.shape[1] / amplitude_array.shape[0])  # http://stackoverflow.com/questions/11776663/
     plt.imshow(amplitude_array, aspect=aspect_arg, interpolation="none", origin="lower")
@@ -119,7 +119,7 @@ event, with a duration:
 
 '''
 
-import sys, struct, os, copy
+import sys, struct, os, copy, itertools
 # sys.stdout = os.fdopen(sys.stdout.fileno(), 'wb')
 Version = '6.6'
 VersionDate = '20160702'
@@ -178,7 +178,7 @@ _previous_warning = ''  # 5.4
 _previous_times = 0     # 5.4
 #------------------------------- Encoding stuff --------------------------
 
-def opus2midi(opus=[]):
+def opus2midi(opus=[], file=None):
     r'''The argument is a list: the first item in the list is the "ticks"
 parameter, the others are the tracks. Each track is a list
 of midi-events, and each event is itself a list; see above.
@@ -198,23 +198,77 @@ my_opus = [
 ]
 my_midi = opus2midi(my_opus)
 sys.stdout.buffer.write(my_midi)
+
+For very long scores, the MIDI can instead be written straight to
+a file object opened in binary mode, as it is encoded; opus2midi()
+then returns the number of bytes written.  If the file is seekable,
+only a little of each track is held in memory at a time.
+with open('my.mid', 'wb') as f:
+    opus2midi(my_opus, file=f)
+
+The opus is only read, never copied or changed.
 '''
     if len(opus) < 2:
         opus=[1000, [],]
-    tracks = copy.deepcopy(opus)
-    ticks = int(tracks.pop(0))
-    ntracks = len(tracks)
+    ticks = int(opus[0])
+    ntracks = len(opus) - 1
     if ntracks == 1:
         format = 0
     else:
         format = 1
+    header = b"MThd\x00\x00\x00\x06"+_struct_HHH.pack(format,ntracks,ticks)
 
-    my_midi = b"MThd\x00\x00\x00\x06"+struct.pack('>HHH',format,ntracks,ticks)
-    for track in tracks:
-        events = _encode(track)
-        my_midi += b'MTrk' + struct.pack('>I',len(events)) + events
+    if file is not None:
+        n_bytes = _write_opus_tracks(opus, header, file)
+        _clean_up_warnings()
+        return n_bytes
+
+    # one buffer for the whole file; each track's length is filled in after it
+    my_midi = bytearray(len(header) + sum(
+     [8 + _encoded_size_guess(track) for track in opus[1:]]))
+    my_midi[0:len(header)] = header
+    pos = len(header)
+    for track in opus[1:]:
+        if pos + 8 > len(my_midi):
+            pos, size = _make_room(my_midi, pos, 8)
+        my_midi[pos:pos+4] = b'MTrk'
+        track_start = pos + 8
+        pos = _encode_into(my_midi, track_start, track)
+        _struct_I.pack_into(my_midi, track_start-4, pos-track_start)
+    del my_midi[pos:]
     _clean_up_warnings()
-    return my_midi
+    return bytes(my_midi)
+
+def _write_opus_tracks(opus, header, file):
+    # for opus2midi(opus, file=file); returns the number of bytes written
+    file.write(header)
+    n_bytes = len(header)
+    out = bytearray(_STREAM_BUFFER_SIZE)
+    if file.seekable():
+        def flush(pos):
+            with memoryview(out) as view:
+                file.write(view[:pos])
+            return 0
+        for track in opus[1:]:
+            # write the track as it is encoded, then go back for its length
+            length_offset = file.tell() + 4
+            file.write(b'MTrk\x00\x00\x00\x00')
+            pos = _encode_into(out, 0, track, flush=flush)
+            flush(pos)
+            end_offset = file.tell()
+            file.seek(length_offset)
+            file.write(_struct_I.pack(end_offset - length_offset - 4))
+            file.seek(end_offset)
+            n_bytes += end_offset - length_offset + 4
+    else:
+        # the length comes first, so each track is encoded before it's written
+        for track in opus[1:]:
+            pos = _encode_into(out, 0, track)
+            file.write(b'MTrk' + _struct_I.pack(pos))
+            with memoryview(out) as view:
+                file.write(view[:pos])
+            n_bytes += 8 + pos
+    return n_bytes
 
 
 def score2opus(score=None):
@@ -242,10 +296,9 @@ my_opus = score2opus(my_score)
 '''
     if len(score) < 2:
         score=[1000, [],]
-    tracks = copy.deepcopy(score)
-    ticks = int(tracks.pop(0))
+    ticks = int(score[0])
     opus_tracks = []
-    for scoretrack in tracks:
+    for scoretrack in score[1:]:
         time2events = dict([])
         for scoreevent in scoretrack:
             if scoreevent[0] == 'note':
@@ -262,6 +315,9 @@ my_opus = score2opus(my_score)
                 else:
                    time2events[note_off_event[1]] = [note_off_event,]
                 continue
+            # copied, because its time is about to become a delta time;
+            # the events are flat lists, so this is all deepcopy did
+            scoreevent = list(scoreevent)
             if time2events.get(scoreevent[1]):
                time2events[scoreevent[1]].append(scoreevent)
             else:
@@ -286,19 +342,30 @@ my_opus = score2opus(my_score)
     _clean_up_warnings()
     return opus_tracks
 
-def score2midi(score=None):
+def score2midi(score=None, file=None):
     r'''
 Translates a "score" into MIDI, using score2opus() then opus2midi()
+(which see for writing straight to a file object)
 '''
-    return opus2midi(score2opus(score))
+    return opus2midi(score2opus(score), file=file)
 
 #--------------------------- Decoding stuff ------------------------
 
-def midi2opus(midi=b''):
+def midi2opus(midi=b'', lazy=False):
     r'''Translates MIDI into a "opus".  For a description of the
 "opus" format, see opus2midi()
+
+The MIDI is read in place through a memoryview, without copying it.
+If lazy is True, each track in the returned opus is an iterator which
+decodes that track's events only as they are asked for, e.g.
+    my_opus = midi2opus(my_midi, lazy=True)
+    for event in my_opus[1]:
+        pass  # the first track's events, one at a time
 '''
-    my_midi=bytearray(midi)
+    if isinstance(midi, (bytes, bytearray, memoryview)):
+        my_midi = memoryview(midi).cast('B')
+    else:
+        my_midi = memoryview(bytearray(midi))
     if len(my_midi) < 4:
         _clean_up_warnings()
         return [1000,[],]
@@ -314,22 +381,25 @@ def midi2opus(midi=b''):
         _clean_up_warnings()
         return [1000,[],]
     my_opus = [ticks,]
-    my_midi = my_midi[14:]
+    pos = 14   # the cursor; the tracks are sliced out of my_midi, never copied
     track_num = 1   # 5.1
-    while len(my_midi) >= 8:
-        track_type   = bytes(my_midi[0:4])
+    while len(my_midi) - pos >= 8:
+        track_type   = bytes(my_midi[pos:pos+4])
         if track_type != b'MTrk':
             _warn('midi2opus: Warning: track #'+str(track_num)+' type is '+str(track_type)+" instead of b'MTrk'")
-        [track_length] = struct.unpack('>I', my_midi[4:8])
-        my_midi = my_midi[8:]
-        if track_length > len(my_midi):
+        [track_length] = struct.unpack('>I', my_midi[pos+4:pos+8])
+        pos += 8
+        if track_length > len(my_midi) - pos:
             _warn('midi2opus: track #'+str(track_num)+' length '+str(track_length)+' is too large')
             _clean_up_warnings()
             return my_opus   # 5.0
-        my_midi_track = my_midi[0:track_length]
-        my_track = _decode(my_midi_track)
+        my_midi_track = my_midi[pos:pos+track_length]
+        if lazy:
+            my_track = _iter_decode(my_midi_track)
+        else:
+            my_track = _decode(my_midi_track)
         my_opus.append(my_track)
-        my_midi = my_midi[track_length:]
+        pos += track_length
         track_num += 1   # 5.1
     _clean_up_warnings()
     return my_opus
@@ -1146,20 +1216,22 @@ Bit eight (the high bit) is set on each byte except the last.
         integer >>= 7
     return ber
 
-def _unshift_ber_int(ba):
-    r'''Given a bytearray, returns a tuple of (the ber-integer at the
-start, and the remainder of the bytearray).
+def _read_ber_int(data, pos):
+    r'''Given a bytes-like object and a position in it, returns a tuple
+of (the ber-integer starting there, and the position just after it).
 '''
-    byte = ba.pop(0)
+    byte = data[pos]
+    pos += 1
     integer = 0
     while True:
         integer += (byte & 0x7F)
         if not (byte & 0x80):
-            return ((integer, ba))
-        if not len(ba):
-            _warn('_unshift_ber_int: no end-of-integer found')
-            return ((0, ba))
-        byte = ba.pop(0)
+            return ((integer, pos))
+        if pos >= len(data):
+            _warn('_read_ber_int: no end-of-integer found')
+            return ((0, pos))
+        byte = data[pos]
+        pos += 1
         integer <<= 7
 
 def _clean_up_warnings():  # 5.4
@@ -1227,7 +1299,30 @@ The options:
   'event_callback' is a coderef
   'exclusive_event_callback' is a coderef
 '''
-    trackdata = bytearray(trackdata)
+    events = []
+    decoder = _iter_decode(trackdata, exclude, include,
+     no_eot_magic=no_eot_magic)
+    while True:
+        try:
+            events.append(next(decoder))
+        except StopIteration as stop:
+            if stop.value:   # the track was aborted; none of it is kept
+                return []
+            return events
+
+def _iter_decode(trackdata=b'', exclude=None, include=None,
+ no_eot_magic=False):
+    r'''Decodes MIDI track data, yielding opus-style events one at a time.
+The options are as for _decode().  The track data is read in place, by
+moving a position along a memoryview of it, so nothing is copied except
+the bytes of text, sysex and raw events.  The generator returns True
+if the track had to be aborted (running status used before it was set),
+in which case _decode() discards the events already yielded.
+'''
+    if isinstance(trackdata, (bytes, bytearray, memoryview)):
+        data = memoryview(trackdata).cast('B')
+    else:
+        data = memoryview(bytearray(trackdata))
     if exclude == None:
         exclude = []
     if include == None:
@@ -1237,44 +1332,47 @@ The options:
     include = set(include)
     exclude = set(exclude)
 
-    # Pointer = 0;  not used here; we eat through the bytearray instead.
+    pos = 0   # the cursor; we move it along the data instead of eating it
+    end = len(data)
     event_code = -1; # used for running status
-    event_count = 0;
-    events = []
 
-    while(len(trackdata)):
+    while pos < end:
         # loop while there's anything to analyze ...
         eot = False   # When True, the event registrar aborts this loop
-        event_count += 1
 
         E = []
         # E for events - we'll feed it to the event registrar at the end.
 
-        # Slice off the delta time code, and analyze it
-        [time, remainder] = _unshift_ber_int(trackdata)
+        # Read the delta time code; one byte unless its high bit is set
+        time = data[pos]
+        if time & 0x80:
+            [time, pos] = _read_ber_int(data, pos)
+        else:
+            pos += 1
 
         # Now let's see what we can make of the command
-        first_byte = trackdata.pop(0) & 0xFF
+        first_byte = data[pos]
+        pos += 1
 
         if (first_byte < 0xF0):  # It's a MIDI event
             if (first_byte & 0x80):
                 event_code = first_byte
             else:
                 # It wants running status; use last event_code value
-                trackdata.insert(0, first_byte)
+                pos -= 1
                 if (event_code == -1):
                     _warn("Running status not set; Aborting track.")
-                    return []
+                    return True
 
             command = event_code & 0xF0
             channel = event_code & 0x0F
 
-            if (command == 0xF6):  #  0-byte argument
-                pass
-            elif (command == 0xC0 or command == 0xD0):  #  1-byte argument
-                parameter = trackdata.pop(0)  # could be B
+            if (command == 0xC0 or command == 0xD0):  #  1-byte argument
+                parameter = data[pos]  # could be B
+                pos += 1
             else: # 2-byte argument could be BB or 14-bit
-                parameter = (trackdata.pop(0), trackdata.pop(0))
+                parameter = (data[pos], data[pos+1])
+                pos += 2
 
             #################################################################
             # MIDI events
@@ -1312,57 +1410,20 @@ The options:
                 _warn("Shouldn't get here; command="+hex(command))
 
         elif (first_byte == 0xFF):  # It's a Meta-Event! ##################
-            #[command, length, remainder] =
-            #    unpack("xCwa*", substr(trackdata, $Pointer, 6));
-            #Pointer += 6 - len(remainder);
-            #    # Move past JUST the length-encoded.
-            command = trackdata.pop(0) & 0xFF
-            [length, trackdata] = _unshift_ber_int(trackdata)
+            command = data[pos]
+            [length, pos] = _read_ber_int(data, pos+1)
             if (command      == 0x00):
                  if (length == 2):
-                     E = ['set_sequence_number',time,_twobytes2int(trackdata)]
+                     E = ['set_sequence_number', time,
+                      _twobytes2int(data[pos:pos+2])]
                  else:
                      _warn('set_sequence_number: length must be 2, not '+str(length))
                      E = ['set_sequence_number', time, 0]
 
             elif command >= 0x01 and command <= 0x0f:   # Text events
-                # 6.2 take it in bytes; let the user get the right encoding.
-                # text_str = trackdata[0:length].decode('ascii','ignore')
-                # text_str = trackdata[0:length].decode('ISO-8859-1')
                 # 6.4 take it in bytes; let the user get the right encoding.
-                text_data = bytes(trackdata[0:length])   # 6.4
-                # Defined text events
-                if (command == 0x01):
-                     E = ['text_event', time, text_data]
-                elif (command == 0x02):
-                     E = ['copyright_text_event', time, text_data]
-                elif (command == 0x03):
-                     E = ['track_name', time, text_data]
-                elif (command == 0x04):
-                     E = ['instrument_name', time, text_data]
-                elif (command == 0x05):
-                     E = ['lyric', time, text_data]
-                elif (command == 0x06):
-                     E = ['marker', time, text_data]
-                elif (command == 0x07):
-                     E = ['cue_point', time, text_data]
-                # Reserved but apparently unassigned text events
-                elif (command == 0x08):
-                     E = ['text_event_08', time, text_data]
-                elif (command == 0x09):
-                     E = ['text_event_09', time, text_data]
-                elif (command == 0x0a):
-                     E = ['text_event_0a', time, text_data]
-                elif (command == 0x0b):
-                     E = ['text_event_0b', time, text_data]
-                elif (command == 0x0c):
-                     E = ['text_event_0c', time, text_data]
-                elif (command == 0x0d):
-                     E = ['text_event_0d', time, text_data]
-                elif (command == 0x0e):
-                     E = ['text_event_0e', time, text_data]
-                elif (command == 0x0f):
-                     E = ['text_event_0f', time, text_data]
+                # The names are in Text_events, in order of command byte.
+                E = [Text_events[command-1], time, bytes(data[pos:pos+length])]
 
             # Now the sticky events -------------------------------------
             elif (command == 0x2F):
@@ -1373,30 +1434,27 @@ The options:
                  if length != 3:
                      _warn('set_tempo event, but length='+str(length))
                  E = ['set_tempo', time,
-                      struct.unpack(">I", b'\x00'+trackdata[0:3])[0]]
+                      struct.unpack(">I", b'\x00'+data[pos:pos+3])[0]]
             elif (command == 0x54):
                  if length != 5:   # DTime, HR, MN, SE, FR, FF
                      _warn('smpte_offset event, but length='+str(length))
-                 E = ['smpte_offset',time] + list(struct.unpack(">BBBBB",trackdata[0:5]))
+                 E = ['smpte_offset',time] + list(struct.unpack(">BBBBB",data[pos:pos+5]))
             elif (command == 0x58):
                  if length != 4:   # DTime, NN, DD, CC, BB
                      _warn('time_signature event, but length='+str(length))
-                 E = ['time_signature', time]+list(trackdata[0:4])
+                 E = ['time_signature', time]+list(data[pos:pos+4])
             elif (command == 0x59):
                  if length != 2:   # DTime, SF(signed), MI
                      _warn('key_signature event, but length='+str(length))
-                 E = ['key_signature',time] + list(struct.unpack(">bB",trackdata[0:2]))
+                 E = ['key_signature',time] + list(struct.unpack(">bB",data[pos:pos+2]))
             elif (command == 0x7F):   # 6.4
-                 E = ['sequencer_specific',time, bytes(trackdata[0:length])]
+                 E = ['sequencer_specific',time, bytes(data[pos:pos+length])]
             else:
                  E = ['raw_meta_event', time, command,
-                   bytes(trackdata[0:length])]   # 6.0
-                 #"[uninterpretable meta-event command of length length]"
-                 # DTime, Command, Binary Data
+                   bytes(data[pos:pos+length])]   # 6.0
                  # It's uninterpretable; record it as raw_data.
 
-            # Pointer += length; #  Now move Pointer
-            trackdata = trackdata[length:]
+            pos += length   # the length is obeyed, whatever we read above
 
         ######################################################################
         elif (first_byte == 0xF0 or first_byte == 0xF7):
@@ -1410,15 +1468,13 @@ The options:
             # is omitted if this is a non-final block in a multiblock sysex;
             # but the F7 (if there) is counted in the message's declared
             # length, so we don't have to think about it anyway.)
-            #command = trackdata.pop(0)
-            [length, trackdata] = _unshift_ber_int(trackdata)
+            [length, pos] = _read_ber_int(data, pos)
             if first_byte == 0xF0:
-                # 20091008 added ISO-8859-1 to get an 8-bit str
                 # 6.4 return bytes instead
-                E = ['sysex_f0', time, bytes(trackdata[0:length])]
+                E = ['sysex_f0', time, bytes(data[pos:pos+length])]
             else:
-                E = ['sysex_f7', time, bytes(trackdata[0:length])]
-            trackdata = trackdata[length:]
+                E = ['sysex_f7', time, bytes(data[pos:pos+length])]
+            pos += length
 
         ######################################################################
         # Now, the MIDI file spec says:
@@ -1434,16 +1490,15 @@ The options:
         # from the MIDI file spec.  So, I'm going to assume that
         # they CAN, in practice, occur.  I don't know whether it's
         # proper for you to actually emit these into a MIDI file.
-        
+
         elif (first_byte == 0xF2):   # DTime, Beats
             #  <song position msg> ::=     F2 <data pair>
-            E = ['song_position', time, _read_14_bit(trackdata[:2])]
-            trackdata = trackdata[2:]
+            E = ['song_position', time, _read_14_bit(data[pos:pos+2])]
+            pos += 2
 
         elif (first_byte == 0xF3):   # <song select msg> ::= F3 <data singlet>
-            # E = ['song_select', time, struct.unpack('>B',trackdata.pop(0))[0]]
-            E = ['song_select', time, trackdata[0]]
-            trackdata = trackdata[1:]
+            E = ['song_select', time, data[pos]]
+            pos += 1
             # DTime, Thing (what?! song number?  whatever ...)
 
         elif (first_byte == 0xF6):   # DTime
@@ -1461,20 +1516,10 @@ The options:
         # fe -- Active sense.  no data.
         # f4 f5 f9 fd -- unallocated
 
-            r'''
-        elif (first_byte > 0xF0) { # Some unknown kinda F-series event ####
-            # Here we only produce a one-byte piece of raw data.
-            # But the encoder for 'raw_data' accepts any length of it.
-            E = [ 'raw_data',
-                         time, substr(trackdata,Pointer,1) ]
-            # DTime and the Data (in this case, the one Event-byte)
-            ++Pointer;  # itself
-
-'''
         elif first_byte > 0xF0:  # Some unknown F-series event
             # Here we only produce a one-byte piece of raw data.
-            E = ['raw_data', time, bytest(trackdata[0])]   # 6.4
-            trackdata = trackdata[1:]
+            E = ['raw_data', time, bytes((data[pos],))]   # 6.4
+            pos += 1
         else:  # Fallthru.
             _warn("Aborting track.  Command-byte first_byte="+hex(first_byte))
             break
@@ -1491,232 +1536,248 @@ The options:
                     E = ['text_event', E[1], '']
                 else:
                     E = []   # EOT with a delta-time of 0; ignore it.
-        
+
         if E and not (E[0] in exclude):
-            #if ( $exclusive_event_callback ):
-            #    &{ $exclusive_event_callback }( @E );
-            #else:
-            #    &{ $event_callback }( @E ) if $event_callback;
-                events.append(E)
+            yield E
         if eot:
             break
 
     # End of the big "Event" while-block
 
-    return events
+    return False
 
 
 ###########################################################################
 def _encode(events_lol, unknown_callback=None, never_add_eot=False,
   no_eot_magic=False, no_running_status=False):
     # encode an event structure, presumably for writing to a file
-    # Calling format:
-    #   $data_r = MIDI::Event::encode( \@event_lol, { options } );
-    # Takes a REFERENCE to an event structure (a LoL)
-    # Returns an (unblessed) REFERENCE to track data.
+    # Takes an event structure (a LoL); returns the track data as bytes.
+    # See _encode_into() for the options; this just gives it a buffer.
 
     # If you want to use this to encode a /single/ event,
-    # you still have to do it as a reference to an event structure (a LoL)
+    # you still have to do it as an event structure (a LoL)
     # that just happens to have just one event.  I.e.,
-    #   encode( [ $event ] ) or encode( [ [ 'note_on', 100, 5, 42, 64] ] )
-    # If you're doing this, consider the never_add_eot track option, as in
-    #   print MIDI ${ encode( [ $event], { 'never_add_eot' => 1} ) };
-
-    data = [] # what I'll store the chunks of byte-data in
-
-    # This is so my end_track magic won't corrupt the original
-    events = copy.deepcopy(events_lol)
-
+    #   _encode( [ event ] ) or _encode( [ [ 'note_on', 100, 5, 42, 64] ] )
+    # If you're doing this, consider the never_add_eot option.
+    out = bytearray(_encoded_size_guess(events_lol))
+    pos = _encode_into(out, 0, events_lol, unknown_callback=unknown_callback,
+     never_add_eot=never_add_eot, no_eot_magic=no_eot_magic,
+     no_running_status=no_running_status)
+    del out[pos:]
+    return bytes(out)
+
+def _encoded_size_guess(events_lol):
+    # enough for a track of note events with small delta-times;
+    # _encode_into() makes more room if it needs it
+    return 4*len(events_lol) + 64
+
+def _make_room(out, pos, n_bytes, flush=None):
+    r'''Makes room for n_bytes more bytes in the bytearray out, after
+pos.  If flush is given, it is first called with pos, to write out[:pos]
+somewhere, and returns the position to carry on writing at (usually 0).
+Otherwise out is lengthened in place.  Returns (position, len(out)).
+'''
+    if flush is not None and pos > 0:
+        pos = flush(pos)
+    if pos + n_bytes > len(out):
+        out.extend(bytes(max(len(out), pos + n_bytes - len(out))))
+    return (pos, len(out))
+
+def _write_ber_int(out, pos, integer):
+    r'''Writes the ber-integer into the bytearray out at pos, and
+returns the position after it.  Like _ber_compressed_int(), negative
+integers get one byte, their low 7 bits.
+'''
+    if integer < 0x80:
+        out[pos] = integer & 0x7F
+        return pos + 1
+    if integer < 0x4000:
+        out[pos] = 0x80 | (integer >> 7)
+        out[pos+1] = integer & 0x7F
+        return pos + 2
+    ber = _ber_compressed_int(integer)
+    out[pos:pos+len(ber)] = ber   # lengthens out if it has to
+    return pos + len(ber)
+
+def _write_bytes_event(out, pos, prefix, data):
+    # prefix (e.g. FF 01 for a text_event), the ber-length, then the data
+    out[pos:pos+len(prefix)] = prefix
+    pos = _write_ber_int(out, pos+len(prefix), len(data))
+    out[pos:pos+len(data)] = data
+    return pos + len(data)
+
+_MAX_FIXED_SIZE = 32   # room for a 9-byte delta-time and any fixed-size event
+_STREAM_BUFFER_SIZE = 1 << 16   # how much is encoded between writes to a file
+_struct_I = struct.Struct('>I')
+_struct_HHH = struct.Struct('>HHH')
+_struct_smpte_offset = struct.Struct('>BBBbBBBB')
+_struct_time_signature = struct.Struct('>BBBbBBB')
+_struct_key_signature = struct.Struct('>BBBbB')
+_struct_song_select = struct.Struct('>BB')
+
+# status nibbles and data-byte masks of the events eligible for running status
+_Channel_event2status = {
+    'note_off': 0x80, 'note_on': 0x90, 'key_after_touch': 0xA0,
+    'control_change': 0xB0, 'patch_change': 0xC0,
+    'channel_after_touch': 0xD0, 'pitch_wheel_change': 0xE0,
+}
+_Channel_event2mask = {
+    'note_off': 0x7F, 'note_on': 0x7F, 'key_after_touch': 0x7F,
+    'control_change': 0xFF, 'patch_change': 0xFF,
+    'channel_after_touch': 0xFF,
+}
+# meta-events whose data is bytes (or str): the bytes that precede its length
+_Bytes_event2prefix = dict(
+    [(name, bytes((0xFF, i+1))) for (i, name) in enumerate(Text_events)] +
+    [('sequencer_specific', b'\xFF\x7F'),
+     ('sysex_f0', b'\xF0'), ('sysex_f7', b'\xF7')])
+
+def _encode_into(out, pos, events_lol, unknown_callback=None,
+  never_add_eot=False, no_eot_magic=False, no_running_status=False,
+  flush=None):
+    r'''Encodes the events of one track into the bytearray out, starting
+at pos, and returns the position after them.  The events are read, never
+changed or copied.  out is lengthened in place when it fills up, unless
+flush is given; see _make_room().
+'''
+    # One way or another, tack on an 'end_track'
+    add_eot = False        # encode ['end_track', 0] after the events
+    last_is_eot = False    # encode the last event as an end_track
+    events = events_lol
     if not never_add_eot:
-        # One way or another, tack on an 'end_track'
-        if events:
-            last = events[-1]
+        if events_lol:
+            last = events_lol[-1]
             if not (last[0] == 'end_track'):  # no end_track already
                 if (last[0] == 'text_event' and len(last[2]) == 0):
                     # 0-length text event at track-end.
                     if no_eot_magic:
                         # Exceptional case: don't mess with track-final
                         # 0-length text_events; just peg on an end_track
-                        events.append(['end_track', 0])
+                        add_eot = True
                     else:
                         # NORMAL CASE: replace with an end_track, leaving DTime
-                        last[0] = 'end_track'
+                        last_is_eot = True
+                        events = itertools.islice(events_lol, len(events_lol)-1)
                 else:
                     # last event was neither 0-length text_event nor end_track
-                    events.append(['end_track', 0])
+                    add_eot = True
         else:  # an eventless track!
-            events = [['end_track', 0],]
+            add_eot = True
 
-    # maybe_running_status = not no_running_status # unused? 4.7
+    size = len(out)
     last_status = -1
 
-    for event_r in (events):
-        E = copy.deepcopy(event_r)
-        # otherwise the shifting'd corrupt the original
+    for E in events:
         if not E:
             continue
-
-        event = E.pop(0)
+        event = E[0]
         if not len(event):
             continue
+        dtime = int(E[1])
+        if pos + _MAX_FIXED_SIZE > size:
+            pos, size = _make_room(out, pos, _MAX_FIXED_SIZE, flush)
+
+        # The delta-time; inlined for the common one-byte case
+        event_pos = pos
+        if dtime < 0x80:
+            out[pos] = dtime & 0x7F
+            pos += 1
+        else:
+            pos = _write_ber_int(out, pos, dtime)
 
-        dtime = int(E.pop(0))
-        # print('event='+str(event)+' dtime='+str(dtime))
-
-        event_data = ''
-
-        if (   # MIDI events -- eligible for running status
-             event    == 'note_on'
-             or event == 'note_off'
-             or event == 'control_change'
-             or event == 'key_after_touch'
-             or event == 'patch_change'
-             or event == 'channel_after_touch'
-             or event == 'pitch_wheel_change'  ):
-
+        status = _Channel_event2status.get(event)
+        if status is not None:  # MIDI events -- eligible for running status
             # This block is where we spend most of the time.  Gotta be tight.
-            if (event == 'note_off'):
-                status = 0x80 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>BB', int(E[1])&0x7F, int(E[2])&0x7F)
-            elif (event == 'note_on'):
-                status = 0x90 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>BB', int(E[1])&0x7F, int(E[2])&0x7F)
-            elif (event == 'key_after_touch'):
-                status = 0xA0 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>BB', int(E[1])&0x7F, int(E[2])&0x7F)
-            elif (event == 'control_change'):
-                status = 0xB0 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>BB', int(E[1])&0xFF, int(E[2])&0xFF)
-            elif (event == 'patch_change'):
-                status = 0xC0 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>B', int(E[1]) & 0xFF)
-            elif (event == 'channel_after_touch'):
-                status = 0xD0 | (int(E[0]) & 0x0F)
-                parameters = struct.pack('>B', int(E[1]) & 0xFF)
-            elif (event == 'pitch_wheel_change'):
-                status = 0xE0 | (int(E[0]) & 0x0F)
-                parameters =  _write_14_bit(int(E[1]) + 0x2000)
-            else:
-                _warn("BADASS FREAKOUT ERROR 31415!")
-
-            # And now the encoding
-            # w = BER compressed integer (not ASN.1 BER, see perlpacktut for
-            # details).  Its bytes represent an unsigned integer in base 128,
-            # most significant digit first, with as few digits as possible.
-            # Bit eight (the high bit) is set on each byte except the last.
-
-            data.append(_ber_compressed_int(dtime))
+            status |= int(E[2]) & 0x0F
             if (status != last_status) or no_running_status:
-                data.append(struct.pack('>B', status))
-            data.append(parameters)
- 
+                out[pos] = status
+                pos += 1
             last_status = status
+            if status < 0xC0:
+                mask = _Channel_event2mask[event]
+                out[pos] = int(E[3]) & mask
+                out[pos+1] = int(E[4]) & mask
+                pos += 2
+            elif status < 0xE0:
+                out[pos] = int(E[3]) & 0xFF
+                pos += 1
+            else:
+                pitch_wheel = int(E[3]) + 0x2000   # as _write_14_bit()
+                out[pos] = pitch_wheel & 0x7F
+                out[pos+1] = (pitch_wheel >> 7) & 0x7F
+                pos += 2
             continue
+
+        # Not a MIDI event.
+        last_status = -1
+        prefix = _Bytes_event2prefix.get(event)
+        if prefix is not None:   # text events, sequencer_specific, sysex
+            if prefix[0] == 0xFF and isinstance(E[2], str):  # 6.4 back-compatibility
+                data = bytes(E[2], encoding='ISO-8859-1')
+            else:
+                data = bytes(E[2])
+            if pos + len(data) + _MAX_FIXED_SIZE > size:
+                pos, size = _make_room(out, pos, len(data) + _MAX_FIXED_SIZE, flush)
+            pos = _write_bytes_event(out, pos, prefix, data)
+        elif event == 'end_track':
+            out[pos:pos+3] = b"\xFF\x2F\x00"
+            pos += 3
+        elif event == 'set_tempo':
+            # the high byte of the four is overwritten by the length, 3
+            out[pos] = 0xFF
+            out[pos+1] = 0x51
+            _struct_I.pack_into(out, pos+2, E[2])
+            out[pos+2] = 0x03
+            pos += 6
+        elif event == 'time_signature':
+            _struct_time_signature.pack_into(out, pos, 0xFF, 0x58, 0x04, E[2],E[3],E[4],E[5])
+            pos += 7
+        elif event == 'key_signature':
+            _struct_key_signature.pack_into(out, pos, 0xFF, 0x59, 0x02, E[2],E[3])
+            pos += 5
+        elif event == 'smpte_offset':
+            _struct_smpte_offset.pack_into(out, pos, 0xFF,0x54,0x05,E[2],E[3],E[4],E[5],E[6])
+            pos += 8
+        elif event == 'set_sequence_number':  # 3.9
+            out[pos:pos+3] = b'\xFF\x00\x02'
+            out[pos+3:pos+5] = _int2twobytes(E[2])
+            pos += 5
+        elif event == 'raw_meta_event':
+            if isinstance(E[3], str):
+                data = bytes(E[3], encoding='ISO-8859-1')
+            else:
+                data = bytes(E[3])
+            if pos + len(data) + _MAX_FIXED_SIZE > size:
+                pos, size = _make_room(out, pos, len(data) + _MAX_FIXED_SIZE, flush)
+            pos = _write_bytes_event(out, pos, bytes((0xFF, int(E[2]))), data)
+        elif event == 'song_position':
+            out[pos] = 0xF2
+            out[pos+1:pos+3] = _write_14_bit(E[2])
+            pos += 3
+        elif event == 'song_select':
+            _struct_song_select.pack_into(out, pos, 0xF3, E[2])
+            pos += 2
+        elif event == 'tune_request':
+            out[pos] = 0xF6
+            pos += 1
         else:
-            # Not a MIDI event.
-            # All the code in this block could be more efficient,
-            # but this is not where the code needs to be tight.
-            # print "zaz $event\n";
-            last_status = -1
-
-            if event == 'raw_meta_event':
-                event_data = _some_text_event(int(E[0]), E[1])
-            elif (event == 'set_sequence_number'):  # 3.9
-                event_data = b'\xFF\x00\x02'+_int2twobytes(E[0])
-
-            # Text meta-events...
-            # a case for a dict, I think (pjb) ...
-            elif (event == 'text_event'):
-                event_data = _some_text_event(0x01, E[0])
-            elif (event == 'copyright_text_event'):
-                event_data = _some_text_event(0x02, E[0])
-            elif (event == 'track_name'):
-                event_data = _some_text_event(0x03, E[0])
-            elif (event == 'instrument_name'):
-                event_data = _some_text_event(0x04, E[0])
-            elif (event == 'lyric'):
-                event_data = _some_text_event(0x05, E[0])
-            elif (event == 'marker'):
-                event_data = _some_text_event(0x06, E[0])
-            elif (event == 'cue_point'):
-                event_data = _some_text_event(0x07, E[0])
-            elif (event == 'text_event_08'):
-                event_data = _some_text_event(0x08, E[0])
-            elif (event == 'text_event_09'):
-                event_data = _some_text_event(0x09, E[0])
-            elif (event == 'text_event_0a'):
-                event_data = _some_text_event(0x0A, E[0])
-            elif (event == 'text_event_0b'):
-                event_data = _some_text_event(0x0B, E[0])
-            elif (event == 'text_event_0c'):
-                event_data = _some_text_event(0x0C, E[0])
-            elif (event == 'text_event_0d'):
-                event_data = _some_text_event(0x0D, E[0])
-            elif (event == 'text_event_0e'):
-                event_data = _some_text_event(0x0E, E[0])
-            elif (event == 'text_event_0f'):
-                event_data = _some_text_event(0x0F, E[0])
-            # End of text meta-events
-
-            elif (event == 'end_track'):
-                event_data = b"\xFF\x2F\x00"
-
-            elif (event == 'set_tempo'):
-                #event_data = struct.pack(">BBwa*", 0xFF, 0x51, 3,
-                #              substr( struct.pack('>I', E[0]), 1, 3))
-                event_data = b'\xFF\x51\x03'+struct.pack('>I',E[0])[1:]
-            elif (event == 'smpte_offset'):
-                # event_data = struct.pack(">BBwBBBBB", 0xFF, 0x54, 5, E[0:5] )
-                event_data = struct.pack(">BBBbBBBB", 0xFF,0x54,0x05,E[0],E[1],E[2],E[3],E[4])
-            elif (event == 'time_signature'):
-                # event_data = struct.pack(">BBwBBBB",  0xFF, 0x58, 4, E[0:4] )
-                event_data = struct.pack(">BBBbBBB", 0xFF, 0x58, 0x04, E[0],E[1],E[2],E[3])
-            elif (event == 'key_signature'):
-                event_data = struct.pack(">BBBbB", 0xFF, 0x59, 0x02, E[0],E[1])
-            elif (event == 'sequencer_specific'):
-                # event_data = struct.pack(">BBwa*", 0xFF,0x7F, len(E[0]), E[0])
-                event_data = _some_text_event(0x7F, E[0])
-            # End of Meta-events
-
-            # Other Things...
-            elif (event == 'sysex_f0'):
-                 #event_data = struct.pack(">Bwa*", 0xF0, len(E[0]), E[0])
-                 #B=bitstring w=BER-compressed-integer a=null-padded-ascii-str
-                 event_data = bytearray(b'\xF0')+_ber_compressed_int(len(E[0]))+bytearray(E[0])
-            elif (event == 'sysex_f7'):
-                 #event_data = struct.pack(">Bwa*", 0xF7, len(E[0]), E[0])
-                 event_data = bytearray(b'\xF7')+_ber_compressed_int(len(E[0]))+bytearray(E[0])
-
-            elif (event == 'song_position'):
-                 event_data = b"\xF2" + _write_14_bit( E[0] )
-            elif (event == 'song_select'):
-                 event_data = struct.pack('>BB', 0xF3, E[0] )
-            elif (event == 'tune_request'):
-                 event_data = b"\xF6"
-            elif (event == 'raw_data'):
+            # raw_data, and the Big Fallthru; take back the delta-time
+            pos = event_pos
+            if event == 'raw_data':
                 _warn("_encode: raw_data event not supported")
-                # event_data = E[0]
-                continue
-            # End of Other Stuff
-
+            elif unknown_callback:
+                pass
             else:
-                # The Big Fallthru
-                if unknown_callback:
-                    # push(@data, &{ $unknown_callback }( @$event_r ))
-                    pass
-                else:
-                    _warn("Unknown event: "+str(event))
-                    # To surpress complaint here, just set
-                    #  'unknown_callback' => sub { return () }
-                continue
-
-            #print "Event $event encoded part 2\n"
-            if str(type(event_data)).find("'str'") >= 0:
-                event_data = bytearray(event_data.encode('Latin1', 'ignore'))
-            if len(event_data): # how could $event_data be empty
-                # data.append(struct.pack('>wa*', dtime, event_data))
-                # print(' event_data='+str(event_data))
-                data.append(_ber_compressed_int(dtime)+event_data)
-
-    return b''.join(data)
-
+                _warn("Unknown event: "+str(event))
+                # To surpress complaint here, just set
+                #  'unknown_callback' => sub { return () }
+        size = len(out)   # in case an event lengthened it
+
+    if last_is_eot or add_eot:
+        dtime = int(events_lol[-1][1]) if last_is_eot else 0
+        if pos + _MAX_FIXED_SIZE > size:
+            pos, size = _make_room(out, pos, _MAX_FIXED_SIZE, flush)
+        pos = _write_ber_int(out, pos, dtime)
+        out[pos:pos+3] = b"\xFF\x2F\x00"
+        pos += 3
+    return pos
@@ -0,0 +1,303 @@
+# columnar note store for a corpus of MIDI files, so queries and stats don't re-parse any MIDI
+# ingestion parses the files in a process pool; each worker streams the tracks through MIDI.midi2opus(lazy=True)
+# and pairs note_on with note_off the way MIDI.opus2score does, without building (or deep-copying) a score
+# the store is a directory of .npy files, one per column, memory-mapped when loaded:
+# - note columns (track, channel, start, duration, pitch, velocity), one entry per note,
+#   grouped by file and sorted by start tick within each file; file i's notes are [file_offsets[i], file_offsets[i+1])
+# - per-file columns (ticks_per_quarter, n_tracks, n_ticks)
+# - a pitch index: pitch_order lists the note indices by pitch (then file and start), pitch p's are [pitch_offsets[p], pitch_offsets[p+1])
+# plus files.json with the file paths and any files that could not be parsed
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import MIDI as midi
+
+
+NOTE_COLUMNS = {
+    "track": np.int32,
+    "channel": np.uint8,
+    "start": np.int64,  # ticks
+    "duration": np.int64,  # ticks
+    "pitch": np.uint8,
+    "velocity": np.uint8,
+}
+FILE_COLUMNS = {
+    "ticks_per_quarter": np.int32,
+    "n_tracks": np.int32,
+    "n_ticks": np.int64,  # end of the longest track
+}
+N_PITCHES = 256  # malformed files can have data bytes above 127
+PERCUSSION_CHANNEL = 9
+MIDI_FILE_EXTENSIONS = (".mid", ".midi")
+
+
+def read_notes(filepath):
+    # the notes of one MIDI file as columns, in order of start tick
+    with open(filepath, "rb") as f:
+        opus = midi.midi2opus(f.read(), lazy=True)
+    notes = {name: [] for name in NOTE_COLUMNS}
+    n_ticks = 0
+    for track_i, events in enumerate(opus[1:]):
+        ticks_so_far = 0
+        # channel*128 + pitch: [(start, channel, pitch, velocity), ...] of notes not yet ended, oldest first
+        # keyed as opus2score keys them, so notes pair up the same way even when a pitch above 127 makes two keys collide;
+        # each note keeps its own channel and pitch, since the key can't be split back into them
+        started_notes = {}
+        for event in events:
+            ticks_so_far += event[1]
+            if event[0] == "note_off" or (event[0] == "note_on" and event[4] == 0):
+                started = started_notes.get(event[2]*128 + event[3])
+                if started:  # a note_off with no note_on is ignored, as in opus2score
+                    start, channel, pitch, velocity = started.pop(0)
+                    add_note(notes, track_i, channel, start, ticks_so_far - start, pitch, velocity)
+            elif event[0] == "note_on":
+                started_notes.setdefault(event[2]*128 + event[3], []).append((ticks_so_far, event[2], event[3], event[4]))
+        # notes with no note_off end with the track, as in opus2score
+        for started in started_notes.values():
+            for start, channel, pitch, velocity in started:
+                add_note(notes, track_i, channel, start, ticks_so_far - start, pitch, velocity)
+        n_ticks = max(n_ticks, ticks_so_far)
+    midi._clean_up_warnings()
+
+    columns = {name: np.array(notes[name], dtype=dtype) for name, dtype in NOTE_COLUMNS.items()}
+    order = np.lexsort((columns["pitch"], columns["channel"], columns["track"], columns["start"]))
+    columns = {name: column[order] for name, column in columns.items()}
+    return {
+        "ticks_per_quarter": opus[0],
+        "n_tracks": len(opus) - 1,
+        "n_ticks": n_ticks,
+        "columns": columns,
+    }
+
+
+def add_note(notes, track, channel, start, duration, pitch, velocity):
+    notes["track"].append(track)
+    notes["channel"].append(channel)
+    notes["start"].append(start)
+    notes["duration"].append(duration)
+    notes["pitch"].append(pitch)
+    notes["velocity"].append(velocity)
+
+
+def read_notes_or_error(filepath):
+    # for the worker processes; a corpus always has some broken files, which shouldn't stop the ingestion
+    try:
+        return read_notes(filepath)
+    except Exception as e:
+        return {"error": "{}: {}".format(type(e).__name__, e)}
+
+
+def find_midi_files(paths):
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(MIDI_FILE_EXTENSIONS):
+                        filepaths.append(os.path.join(dirpath, filename))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+
+def ingest(filepaths, store_dir, n_workers=None, chunksize=16):
+    # parses the files in parallel and writes the store; returns it, loaded from the written files
+    n_workers = n_workers or os.cpu_count()
+    print("ingesting {} MIDI files on {} workers into {}".format(len(filepaths), n_workers, store_dir))
+    t0 = time.time()
+    note_chunks = {name: [] for name in NOTE_COLUMNS}
+    file_columns = {name: np.zeros(len(filepaths), dtype=dtype) for name, dtype in FILE_COLUMNS.items()}
+    file_offsets = np.zeros(len(filepaths) + 1, dtype=np.int64)
+    errors = {}
+    with multiprocessing.Pool(n_workers) as pool:
+        # imap keeps the results in file order, so the store doesn't depend on which worker finishes first
+        for file_i, result in enumerate(pool.imap(read_notes_or_error, filepaths, chunksize=chunksize)):
+            n_notes = 0
+            if "error" in result:
+                errors[filepaths[file_i]] = result["error"]
+            else:
+                for name in NOTE_COLUMNS:
+                    note_chunks[name].append(result["columns"][name])
+                for name in FILE_COLUMNS:
+                    file_columns[name][file_i] = result[name]
+                n_notes = len(result["columns"]["start"])
+            file_offsets[file_i + 1] = file_offsets[file_i] + n_notes
+            if (file_i + 1) % 1000 == 0:
+                print("- {}/{} files, {} notes".format(file_i + 1, len(filepaths), file_offsets[file_i + 1]))
+    for filepath, error in errors.items():
+        print("could not read {}: {}".format(filepath, error))
+
+    note_columns = {name: np.concatenate(note_chunks[name]) if note_chunks[name] else np.zeros(0, dtype=dtype) for name, dtype in NOTE_COLUMNS.items()}
+    write_store(store_dir, filepaths, errors, file_offsets, file_columns, note_columns)
+    print("- done ingesting {} notes from {} files ({} unreadable) in {:.1f} s".format(file_offsets[-1], len(filepaths), len(errors), time.time() - t0))
+    return NoteStore(store_dir)
+
+
+def write_store(store_dir, filepaths, errors, file_offsets, file_columns, note_columns):
+    os.makedirs(store_dir, exist_ok=True)
+    # stable, so within each pitch the notes stay in order of file and start tick
+    pitch_order = np.argsort(note_columns["pitch"], kind="stable")
+    pitch_offsets = np.zeros(N_PITCHES + 1, dtype=np.int64)
+    np.cumsum(np.bincount(note_columns["pitch"], minlength=N_PITCHES), out=pitch_offsets[1:])
+    arrays = dict(note_columns)
+    arrays.update(file_columns)
+    arrays.update({"file_offsets": file_offsets, "pitch_order": pitch_order, "pitch_offsets": pitch_offsets})
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, name + ".npy"), array)
+    with open(os.path.join(store_dir, "files.json"), "w") as f:
+        json.dump({"filepaths": filepaths, "errors": errors}, f, indent=1)
+
+
+class NoteStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "files.json")) as f:
+            files = json.load(f)
+        self.filepaths = files["filepaths"]
+        self.errors = files["errors"]
+        self.file_index = {filepath: file_i for file_i, filepath in enumerate(self.filepaths)}
+        self.notes = {name: self.load(name) for name in NOTE_COLUMNS}
+        self.files = {name: self.load(name) for name in FILE_COLUMNS}
+        self.file_offsets = self.load("file_offsets")
+        self.pitch_order = self.load("pitch_order")
+        self.pitch_offsets = self.load("pitch_offsets")
+
+    def load(self, name):
+        return np.load(os.path.join(self.store_dir, name + ".npy"), mmap_mode="r")
+
+    def n_files(self):
+        return len(self.filepaths)
+
+    def n_notes(self):
+        return int(self.file_offsets[-1])
+
+    def get_file_slice(self, file_i):
+        if not isinstance(file_i, (int, np.integer)):
+            file_i = self.file_index[file_i]
+        return slice(int(self.file_offsets[file_i]), int(self.file_offsets[file_i + 1]))
+
+    def get_file_notes(self, file_i):
+        # file by index or path; columns are views into the store
+        file_slice = self.get_file_slice(file_i)
+        return {name: column[file_slice] for name, column in self.notes.items()}
+
+    def get_note_files(self, note_indices):
+        return np.searchsorted(self.file_offsets, note_indices, side="right") - 1
+
+    def query(self, channel=None, pitch=None, start_tick=None, end_tick=None, files=None):
+        # indices of the notes matching all the given conditions, in order of file then start tick
+        # pitch and channel can be one value or several; notes start in [start_tick, end_tick); files are indices or paths
+        if files is not None:
+            file_is = np.unique(np.array([f if isinstance(f, (int, np.integer)) else self.file_index[f] for f in files], dtype=np.int64))
+        if pitch is not None:
+            # candidates from the pitch index; they are note indices in increasing order within each pitch
+            # (each pitch once, or its notes would be listed once per repeat)
+            pitches = np.unique(np.atleast_1d(pitch))
+            indices = np.sort(np.concatenate([np.zeros(0, dtype=np.int64)] + [self.pitch_order[self.pitch_offsets[p]:self.pitch_offsets[p + 1]] for p in pitches]))
+            if files is not None:
+                indices = indices[np.isin(self.get_note_files(indices), file_is)]
+            keep = np.ones(len(indices), dtype=bool)
+            if start_tick is not None:
+                keep &= self.notes["start"][indices] >= start_tick
+            if end_tick is not None:
+                keep &= self.notes["start"][indices] < end_tick
+            indices = indices[keep]
+        else:
+            # starts are sorted within each file, so the time range is a binary search per file
+            if files is None:
+                file_is = np.arange(self.n_files())
+            ranges = []
+            for file_i in file_is:
+                first, last = self.file_offsets[file_i], self.file_offsets[file_i + 1]
+                starts = self.notes["start"][first:last]
+                lo = first if start_tick is None else first + np.searchsorted(starts, start_tick, side="left")
+                hi = last if end_tick is None else first + np.searchsorted(starts, end_tick, side="left")
+                if hi > lo:
+                    ranges.append(np.arange(lo, hi))
+            indices = np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+        if channel is not None:
+            indices = indices[np.isin(self.notes["channel"][indices], np.atleast_1d(channel))]
+        return indices
+
+    def get_notes(self, note_indices):
+        columns = {name: column[note_indices] for name, column in self.notes.items()}
+        columns["file"] = self.get_note_files(note_indices)
+        return columns
+
+    def get_file_stats(self, file_i):
+        # the note-related entries of MIDI.score2stats for one file
+        notes = self.get_file_notes(file_i)
+        if not isinstance(file_i, (int, np.integer)):
+            file_i = self.file_index[file_i]
+        n_tracks = int(self.files["n_tracks"][file_i])
+        percussion = notes["channel"] == PERCUSSION_CHANNEL
+        pitch_range_by_track = []
+        channels_by_track = []
+        for track_i in range(n_tracks):
+            in_track = notes["track"] == track_i
+            track_pitches = notes["pitch"][in_track & ~percussion]
+            pitch_range_by_track.append((int(track_pitches.min()), int(track_pitches.max())) if len(track_pitches) else (0, 0))
+            channels_by_track.append(set(np.unique(notes["channel"][in_track]).tolist()))
+        return {
+            "channels_by_track": channels_by_track,
+            "channels_total": set(np.unique(notes["channel"]).tolist()),
+            "ntracks": n_tracks,
+            "nticks": int(self.files["n_ticks"][file_i]),
+            "num_notes_by_channel": get_histogram(notes["channel"]),
+            "percussion": get_histogram(notes["pitch"][percussion]),
+            "pitches": get_histogram(notes["pitch"][~percussion]),
+            "pitch_range_by_track": pitch_range_by_track,
+            "pitch_range_sum": sum(high - low for low, high in pitch_range_by_track),
+            "ticks_per_quarter": int(self.files["ticks_per_quarter"][file_i]),
+        }
+
+    def get_corpus_stats(self):
+        # one row per file: note counts by channel, and the pitch range of the non-percussion notes
+        file_of_note = np.repeat(np.arange(self.n_files()), np.diff(self.file_offsets))
+        channel = np.asarray(self.notes["channel"], dtype=np.int64)
+        pitch = np.asarray(self.notes["pitch"], dtype=np.int64)
+        notes_by_channel = np.bincount(file_of_note * 16 + (channel & 0x0F), minlength=16 * self.n_files()).reshape(-1, 16)
+        melodic = channel != PERCUSSION_CHANNEL
+        lowest_pitch = np.full(self.n_files(), N_PITCHES, dtype=np.int64)
+        highest_pitch = np.full(self.n_files(), -1, dtype=np.int64)
+        np.minimum.at(lowest_pitch, file_of_note[melodic], pitch[melodic])
+        np.maximum.at(highest_pitch, file_of_note[melodic], pitch[melodic])
+        no_melody = highest_pitch < 0
+        lowest_pitch[no_melody] = 0
+        highest_pitch[no_melody] = 0
+        return {
+            "n_notes": np.diff(self.file_offsets),
+            "num_notes_by_channel": notes_by_channel,
+            "lowest_pitch": lowest_pitch,
+            "highest_pitch": highest_pitch,
+            "n_ticks": np.asarray(self.files["n_ticks"]),
+            "ticks_per_quarter": np.asarray(self.files["ticks_per_quarter"]),
+        }
+
+
+def get_histogram(values):
+    counts = np.bincount(np.asarray(values, dtype=np.int64))
+    return {int(value): int(counts[value]) for value in np.flatnonzero(counts)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store_dir", help="Directory to write the note store to")
+    parser.add_argument("paths", nargs="+", help="MIDI files, or directories to search for them")
+    parser.add_argument("-n", "--n-workers", type=int, default=None, help="Worker processes (default one per CPU)")
+    args = parser.parse_args()
+
+    filepaths = find_midi_files(args.paths)
+    if not filepaths:
+        sys.exit("no MIDI files found")
+    store = ingest(filepaths, args.store_dir, args.n_workers)
+    stats = store.get_corpus_stats()
+    print("{} files, {} notes, {} on the percussion channel".format(store.n_files(), store.n_notes(), stats["num_notes_by_channel"][:, PERCUSSION_CHANNEL].sum()))
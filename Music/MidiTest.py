@@ -9,8 +9,7 @@ if __name__ == "__main__":
 
         if inp is not None:
             # notes = mu.read_notes_from_midi_in(inp, timeout_seconds)
-            data = mu.read_data_from_midi_in(inp, max_silence_seconds)
-            mu.dump_data(data)
+            data = mu.read_data_from_midi_in(inp, max_silence_seconds, log_filepath=mu.get_log_filepath())
 
         # data = mu.load_random_data()
         # data = mu.invert_data(data, 66)
@@ -2,8 +2,11 @@ from datetime import datetime
 import os
 import pickle
 import random
+import struct
+import threading
 import time
 
+import numpy as np
 import pygame
 import pygame.midi as midi
 midi.init()
@@ -11,6 +14,15 @@ midi.init()
 import Music.MusicalStructureUtil as structure
 
 
+PYPM_MAX_EVENTS = 1024  # most events pypm will read or write at once
+MIDI_DATA_FIELDS = ["status", "data1", "data2", "data3"]
+# one fixed-width record per event in the binary log: the four data bytes, pypm's timestamp (ms),
+# and when the capture thread read it (ns since the capture started, monotonic clock)
+MIDI_LOG_DTYPE = np.dtype([(field, "u1") for field in MIDI_DATA_FIELDS] + [("timestamp", "<i4"), ("received_ns", "<i8")])
+MIDI_LOG_MAGIC = b"MIDILOG1"
+MIDI_LOG_HEADER_SIZE = len(MIDI_LOG_MAGIC) + 8  # then the session's start time, float64 seconds since the epoch
+
+
 class MidiEvent:
     def __init__(self, status, pitch, event, data3, timestamp):
         self.status = status
@@ -47,7 +59,7 @@ class MidiEvent:
 
     def invert_pitch(self, pivot):
         if self.is_note():
-            new_pitch = pivot + (pivot - self.pitch)
+            self.pitch = pivot + (pivot - self.pitch)
         return self
 
     def add_time(self, time):
@@ -110,12 +122,26 @@ def send_data_to_midi_out(data, midi_output):
     # kill time so program doesn't end before midi is done playing
 
     i = 0
-    MAX_OUTPUT_LENGTH = 1024  # due to pypm
     while i < len(data):
-        sub_data = data[i: i + MAX_OUTPUT_LENGTH]
+        sub_data = data[i: i + PYPM_MAX_EVENTS]
         midi_output.write(sub_data)
-        i += MAX_OUTPUT_LENGTH
+        i += PYPM_MAX_EVENTS
+
+    while midi.time() < final_timestamp:
+        time.sleep(0.1)
+
+
+def send_records_to_midi_out(records, midi_output):
+    # like send_data_to_midi_out, but converts a batch at a time, so a memory-mapped log is only read as it is sent
+    if len(records) == 0:
+        return
+    pygame_time_ms = midi.time()
+    for i in range(0, len(records), PYPM_MAX_EVENTS):
+        batch = np.array(records[i: i + PYPM_MAX_EVENTS])
+        batch["timestamp"] += pygame_time_ms + 1000
+        midi_output.write(records_to_data(batch))
 
+    final_timestamp = int(records["timestamp"][-1]) + pygame_time_ms + 1000
     while midi.time() < final_timestamp:
         time.sleep(0.1)
 
@@ -157,28 +183,82 @@ def send_events_to_standard_out(events):
     #     time.sleep(0.1)
 
 
-def read_data_from_midi_in(midi_input, max_silence_seconds):
-    data = []
-    t0 = time.time()
-    last_time = None
-    note_imbalance = 0
-    while True:
-        if midi_input.poll():
-            new_data = midi_input.read(1)
-            assert len(new_data) == 1
-            new_data = new_data[0]
-            data.append(new_data)
-            print(new_data)
-            event = MidiEvent.from_raw_data(new_data)
-            last_time = event.timestamp
-            
-            note_imbalance += 1 if event.event_name == "note_on" else -1 if event.event_name == "note_off" else 0
-            # ? = data3
-            print("notes on:", note_imbalance)
-        elif note_imbalance == 0 and last_time is not None and midi.time() - last_time > max_silence_seconds * 1000:
+def read_data_from_midi_in(midi_input, max_silence_seconds, log_filepath=None):
+    # records until no notes are held and nothing has come in for max_silence_seconds
+    capture = MidiCapture(midi_input, log_filepath)
+    capture.start()
+    try:
+        while capture.is_running() and not capture.is_silent(max_silence_seconds):
+            time.sleep(0.01)
+        if capture.is_running():
             print("data collection timed out")
-            break
-    return data
+    finally:
+        capture.stop()  # raises the capture thread's error, if it stopped on one
+    print("captured {} events".format(capture.n_events))
+    return records_to_data(capture.get_records())
+
+
+class MidiCapture:
+    # reads the input on its own thread, as many events at a time as pypm will give, and appends each batch to the log
+    # each event is also stamped with when it was read, in ns on the monotonic clock since the capture started
+    def __init__(self, midi_input, log_filepath=None, poll_interval=0.001):
+        self.midi_input = midi_input
+        self.log_filepath = log_filepath
+        self.poll_interval = poll_interval
+        self.batches = []
+        self.n_events = 0
+        self.note_imbalance = 0
+        self.last_received = None
+        self.error = None  # set by the capture thread if reading or logging fails
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="MidiCapture", daemon=True)
+
+    def start(self):
+        self.t0 = time.monotonic_ns()
+        self.log = MidiLogWriter(self.log_filepath) if self.log_filepath is not None else None
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                if not self.midi_input.poll():
+                    time.sleep(self.poll_interval)
+                    continue
+                received = time.monotonic_ns()
+                records = data_to_records(self.midi_input.read(PYPM_MAX_EVENTS), received - self.t0)
+                self.batches.append(records)
+                if self.log is not None:
+                    self.log.append(records)
+                self.n_events += len(records)
+                self.note_imbalance += count_note_imbalance(records)
+                self.last_received = received
+        except Exception as e:
+            self.error = e  # raised on the caller's thread by stop()
+
+    def is_running(self):
+        return self.thread.is_alive()
+
+    def is_silent(self, max_silence_seconds):
+        # same test as the old polling loop: something was played, all notes are off, and then nothing for a while
+        return (self.note_imbalance == 0 and self.last_received is not None
+            and time.monotonic_ns() - self.last_received > max_silence_seconds * 1e9)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        if self.log is not None:
+            self.log.close()
+        if self.error is not None:
+            raise self.error
+
+    def get_records(self):
+        return np.concatenate(self.batches) if self.batches else np.zeros(0, dtype=MIDI_LOG_DTYPE)
+
+
+def count_note_imbalance(records):
+    # notes turned on minus notes turned off, as MidiEvent names them
+    is_note = records["status"] == 144
+    return int(np.sum(is_note & (records["data2"] == 75)) - np.sum(is_note & (records["data2"] == 0)))
 
 
 def read_notes_from_midi_in(midi_input, timeout_seconds):
@@ -194,18 +274,91 @@ def dump_data(data):
         pickle.dump(data, f)
 
 
+def get_log_filepath():
+    now_str = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return "Music/midi_input_{}.midilog".format(now_str)
+
+
+class MidiLogWriter:
+    # a header, then the events as MIDI_LOG_DTYPE records, appended a batch at a time and flushed so a crash loses little
+    def __init__(self, filepath):
+        self.f = open(filepath, "wb")
+        self.f.write(MIDI_LOG_MAGIC + struct.pack("<d", time.time()))
+        self.f.flush()
+
+    def append(self, records):
+        self.f.write(records.astype(MIDI_LOG_DTYPE, copy=False).tobytes())
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def write_log(records, filepath):
+    log = MidiLogWriter(filepath)
+    log.append(records)
+    log.close()
+
+
+def load_log(filepath):
+    # memory-mapped, so replaying or transforming a long session doesn't read it all in first
+    with open(filepath, "rb") as f:
+        header = f.read(MIDI_LOG_HEADER_SIZE)
+    assert header[:len(MIDI_LOG_MAGIC)] == MIDI_LOG_MAGIC, "{} is not a MIDI log".format(filepath)
+    if os.path.getsize(filepath) == MIDI_LOG_HEADER_SIZE:
+        return np.zeros(0, dtype=MIDI_LOG_DTYPE)  # can't map an empty region
+    return np.memmap(filepath, dtype=MIDI_LOG_DTYPE, mode="r", offset=MIDI_LOG_HEADER_SIZE)
+
+
+def get_log_start_time(filepath):
+    with open(filepath, "rb") as f:
+        header = f.read(MIDI_LOG_HEADER_SIZE)
+    return struct.unpack("<d", header[len(MIDI_LOG_MAGIC):])[0]
+
+
+def data_to_records(data, received_ns=0):
+    # data as pygame.midi reads it, [[status, data1, data2, data3], timestamp] per event
+    records = np.zeros(len(data), dtype=MIDI_LOG_DTYPE)
+    if len(data) > 0:
+        records["timestamp"] = [timestamp for lst, timestamp in data]
+        values = np.array([lst for lst, timestamp in data]).reshape(len(data), len(MIDI_DATA_FIELDS))
+        for i, field in enumerate(MIDI_DATA_FIELDS):
+            records[field] = values[:, i]
+    records["received_ns"] = received_ns
+    return records
+
+
+def records_to_data(records):
+    columns = [records[field].tolist() for field in MIDI_DATA_FIELDS]
+    return [[list(lst), timestamp] for lst, timestamp in zip(zip(*columns), records["timestamp"].tolist())]
+
+
+def convert_pickle_to_log(pickle_filepath, log_filepath=None):
+    if log_filepath is None:
+        log_filepath = os.path.splitext(pickle_filepath)[0] + ".midilog"
+    with open(pickle_filepath, "rb") as f:
+        data = pickle.load(f)
+    write_log(data_to_records(data), log_filepath)
+    return log_filepath
+
+
 def load_random_data():
     data_dir = "Music/"
     ls = os.listdir(data_dir)
     choices = [x for x in filter(lambda x: x.startswith("midi_input_"), ls)]
     # print(choices)
     choice = random.choice(choices)
+    if choice.endswith(".midilog"):
+        return records_to_data(load_log(data_dir + choice))
     with open(data_dir + choice, "rb") as f:
         data = pickle.load(f)
     return data
 
 
 def load_data_from_datetime_string(s):
+    log_filepath = "Music/midi_input_{}.midilog".format(s)
+    if os.path.exists(log_filepath):
+        return records_to_data(load_log(log_filepath))
     filepath = "Music/midi_input_{}.pickle".format(s)
     with open(filepath, "rb") as f:
         data = pickle.load(f)
@@ -217,3 +370,45 @@ def invert_data(data, pivot):
     lst = [x.invert_pitch(pivot) for x in lst]
     return [x.to_raw_data() for x in lst]
 
+
+def invert_records(records, pivot):
+    # invert_data for log records, all at once; returns a new array, since a loaded log is mapped read-only
+    # (pitches are clipped to the MIDI range, where invert_data would let them go out of it)
+    res = np.array(records)
+    is_note = res["status"] == 144
+    res["data1"][is_note] = np.clip(2 * pivot - res["data1"][is_note].astype(int), 0, 127)
+    return res
+
+
+class FakeMidiInput:
+    # stands in for pygame.midi.Input without a device: plays back recorded data, each event becoming readable
+    # when its time (relative to the first event, divided by speed) has passed since the fake was made
+    def __init__(self, data, speed=1.0):
+        self.records = data if isinstance(data, np.ndarray) else data_to_records(data)
+        self.speed = speed
+        self.t0 = time.monotonic()
+        self.first_timestamp = int(self.records["timestamp"][0]) if len(self.records) > 0 else 0
+        self.pos = 0
+        self.closed = False
+
+    def get_time(self):
+        # like midi.time(), ms since the fake started
+        return int((time.monotonic() - self.t0) * 1000 * self.speed)
+
+    def n_ready(self):
+        ready_until = self.first_timestamp + self.get_time()
+        return int(np.searchsorted(self.records["timestamp"], ready_until, side="right")) - self.pos
+
+    def poll(self):
+        assert not self.closed, "input is closed"
+        return self.n_ready() > 0
+
+    def read(self, num_events):
+        assert num_events <= PYPM_MAX_EVENTS, "maximum buffer length is {}".format(PYPM_MAX_EVENTS)
+        n = min(num_events, self.n_ready())
+        batch = self.records[self.pos:self.pos + n]
+        self.pos += n
+        return records_to_data(batch)
+
+    def close(self):
+        self.closed = True
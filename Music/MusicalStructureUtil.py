@@ -26,7 +26,17 @@ class Note:
         self.midi_loudness = int(MIDI_MAX_LOUDNESS / 3)
 
     def get_wav_signal(self, truncate=True):
-        return wav.get_signal_from_freq(self.frequency, self.duration.duration_seconds, initial_click=False, truncate=truncate)
+        return np.array(self.get_waveform(truncate=truncate))
+
+    def get_waveform(self, truncate=True):
+        # cached and read-only; repeated notes are only rendered once
+        return wav.get_waveform(self.frequency, self.duration.duration_seconds, truncate=truncate)
+
+    def get_waveforms(self):
+        return [self.get_waveform()]
+
+    def get_n_frames(self):
+        return len(self.get_waveform())
 
     def output_to_midi(self, midi_output, stop=True):
         midi_output.note_on(self.midi_pitch_number, self.midi_loudness)
@@ -67,7 +77,14 @@ class Chord:
         self.notes = [Note(name, duration) for name in self.names]
 
     def get_wav_signal(self):
-        return sum(note.get_wav_signal(truncate=False) for note in self.notes)
+        return wav.render_schedule([(0, waveform) for waveform in self.get_waveforms()], self.get_n_frames())
+
+    def get_waveforms(self):
+        # not truncated, so all the notes have the same length and are mixed over the whole duration
+        return [note.get_waveform(truncate=False) for note in self.notes]
+
+    def get_n_frames(self):
+        return wav.get_n_frames(self.duration.duration_seconds)
 
     def output_to_midi(self, midi_output):
         for note in self.notes:
@@ -105,6 +122,12 @@ class Rest:
     def get_wav_signal(self):
         return wav.get_silence_for_duration(self.duration.duration_seconds)
 
+    def get_waveforms(self):
+        return []
+
+    def get_n_frames(self):
+        return wav.get_n_frames(self.duration.duration_seconds)
+
     def output_to_midi(self, midi_output, stop=True):
         time.sleep(self.duration.duration_seconds)
         # stop is irrelevant
@@ -49,13 +49,8 @@ def play_old():
 
 
 def play():
-	audio_out = pyaudio.PyAudio()
-	stream = audio_out.open(
-	    format=pyaudio.paInt8,
-	    channels=1,
-	    rate=wav.RATE,
-	    output=True,
-	)
+	# a short buffer, since each tone is queued when its key is pressed; play() only blocks once a few tones are waiting
+	audio_out = wav.AudioOutput(wav.PyAudioSink(), buffer_seconds=0.05, max_queued=2)
 
 	shift = int(input("Default home pitch: A4. Number of semitones to shift: "))
 
@@ -79,11 +74,9 @@ def play():
 				current_freq = None
 				time_pressed = None
 			else:
-				wav.send_freq_to_stream(current_freq, min_duration, stream, initial_click=True)
+				audio_out.play(wav.get_signal_from_freq(current_freq, min_duration, initial_click=True))
 
-	stream.stop_stream()
-	stream.close()
-	audio_out.terminate()
+	audio_out.close()
 
 
 
@@ -1,3 +1,11 @@
+import functools
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+
 import pyaudio
 import wave
 import numpy as np
@@ -6,6 +14,9 @@ from scipy.io.wavfile import read as read_wav
 
 RATE = 44100
 MAX_AMPLITUDE = 32767
+WAVEFORM_CACHE_SIZE = 512  # distinct (frequency, duration, truncate) waveforms kept rendered
+SAMPLE_DTYPE = "i1"  # streams are opened as pyaudio.paInt8, one byte per frame
+FRAMES_PER_BUFFER = 1024
 
 
 def get_signal_from_freq(freq, seconds, initial_click=False, truncate=True):
@@ -25,11 +36,42 @@ def get_signal_from_freq(freq, seconds, initial_click=False, truncate=True):
     return ys
 
 
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def get_waveform(freq, seconds, truncate=True):
+    # the same as get_signal_from_freq, but float32 and shared between callers, so it is read-only
+    ys = get_signal_from_freq(freq, seconds, initial_click=False, truncate=truncate).astype(np.float32)
+    ys.setflags(write=False)
+    return ys
+
+
+def get_n_frames(seconds):
+    # length of the signal for a duration, as np.arange(RATE * seconds) would make it
+    return max(0, math.ceil(RATE * seconds))
+
+
 def get_signal_from_notes(notes):
-    res = []
+    # notes (or chords or rests) are played one after the other: each starts where the last one's signal ended
+    schedule = []
+    start = 0
     for note in notes:
-        res.extend(list(note.get_wav_signal()))
-    return np.array(res)
+        for waveform in note.get_waveforms():
+            schedule.append((start, waveform))
+        start += note.get_n_frames()
+    return render_schedule(schedule, start)
+
+
+def render_schedule(schedule, n_frames):
+    # schedule is a list of (start frame, waveform); waveforms that overlap are mixed by adding them
+    signal = np.zeros(n_frames, dtype=np.float32)
+    for start, waveform in schedule:
+        add_waveform(signal, start, waveform)
+    return signal
+
+
+def add_waveform(signal, start, waveform):
+    # in place; the part of the waveform past the end of the signal is dropped
+    end = min(len(signal), start + len(waveform))
+    signal[start:end] += waveform[:end - start]
 
 
 def get_silence_for_duration(seconds):
@@ -44,32 +86,233 @@ def send_freq_to_stream(freq, seconds, stream, initial_click=False):
     send_signal_to_stream(ys, stream)
 
 
+def get_signal_bytes(ys):
+    return np.asarray(ys).astype(SAMPLE_DTYPE).tobytes()
+
+
 def send_signal_to_stream(ys, stream):
-    ys_bytes = ys.astype("Int8").tobytes()
+    # blocking; see AudioOutput for playing without waiting
+    ys_bytes = memoryview(get_signal_bytes(ys))
 
     # split into segments so it's not all sent at once, blocking the program from exiting with Ctrl-C
+    # (slices of the memoryview, so the rest of the signal isn't copied after each one)
     seg_length = 1024  # even a few-second wav signal is ~50k
-    while True:
-        stream.write(ys_bytes[:seg_length])
-        ys_bytes = ys_bytes[seg_length:]
-        if len(ys_bytes) == 0:
-            return
+    for i in range(0, len(ys_bytes), seg_length):
+        stream.write(ys_bytes[i:i + seg_length])
 
 
 def send_signal_to_audio_out(signal):
-    audio_out = pyaudio.PyAudio()
-    stream = audio_out.open(
-        format=pyaudio.paInt8,
-        channels=1,
-        rate=RATE,
-        output=True,
-    )
+    with AudioOutput(PyAudioSink()) as audio_out:
+        audio_out.play(signal)
+
+
+class RingBuffer:
+    # fixed-size byte queue between one writer thread and one reader (the audio callback)
+    # the writer blocks while it is full; the reader never blocks, it takes what is there
+    def __init__(self, size):
+        self.size = size
+        self.view = memoryview(bytearray(size))
+        self.read_pos = 0
+        self.n_filled = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        while len(data) > 0:
+            with self.condition:
+                while self.n_filled == self.size:
+                    self.condition.wait()
+                write_pos = (self.read_pos + self.n_filled) % self.size
+                n = min(len(data), self.size - self.n_filled, self.size - write_pos)
+                self.view[write_pos:write_pos + n] = data[:n]
+                self.n_filled += n
+            data = data[n:]
+
+    def read_into(self, out):
+        # copies up to len(out) bytes into out and returns how many
+        out = memoryview(out).cast("B")
+        with self.condition:
+            n = min(len(out), self.n_filled)
+            n_before_wrap = min(n, self.size - self.read_pos)
+            out[:n_before_wrap] = self.view[self.read_pos:self.read_pos + n_before_wrap]
+            out[n_before_wrap:n] = self.view[:n - n_before_wrap]
+            self.read_pos = (self.read_pos + n) % self.size
+            self.n_filled -= n
+            self.condition.notify_all()
+        return n
+
+    def is_drained(self):
+        # closed by the writer and everything read
+        with self.condition:
+            return self.closed and self.n_filled == 0
+
+    def wait_until_empty(self):
+        with self.condition:
+            while self.n_filled > 0:
+                self.condition.wait()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class AudioOutput:
+    # plays signals without blocking the caller: play() queues a signal (or an iterable of chunks of one, which can still be
+    # being synthesized), a producer thread converts them to bytes and writes them into a ring buffer, and the sink's callback
+    # takes buffers out of the ring as the device needs them, playing silence if the producer falls behind
+    def __init__(self, sink, buffer_seconds=0.25, max_queued=8):
+        self.sink = sink
+        self.ring = RingBuffer(max(FRAMES_PER_BUFFER, int(buffer_seconds * RATE)) * np.dtype(SAMPLE_DTYPE).itemsize)
+        self.signals = queue.Queue(maxsize=max_queued)  # play() blocks when this far ahead
+        self.n_underrun_frames = 0
+        self.error = None
+        self.producer = threading.Thread(target=self.produce, name="AudioOutputProducer", daemon=True)
+        self.producer.start()
+        self.sink.start(self.pull)
+
+    def play(self, signal):
+        self.play_chunks([signal])
+
+    def play_chunks(self, chunks):
+        self.raise_error()
+        self.signals.put(chunks)
 
-    send_signal_to_stream(signal, stream)
+    def produce(self):
+        while True:
+            chunks = self.signals.get()
+            try:
+                if chunks is None:
+                    self.ring.close()
+                    return
+                for chunk in chunks:
+                    self.ring.write(get_signal_bytes(chunk))
+            except Exception as e:
+                self.error = e  # raised on the caller's thread by the next play(), wait() or close()
+            finally:
+                self.signals.task_done()
 
-    stream.stop_stream()
-    stream.close()
-    audio_out.terminate()
+    def pull(self, frame_count, pad=True):
+        # called by the sink; returns (bytes for up to frame_count frames, whether the output is finished)
+        # a device needs all frame_count frames, so if pad the ones the producer hasn't supplied yet are silence
+        out = bytearray(frame_count * np.dtype(SAMPLE_DTYPE).itemsize)  # zeros are silence
+        n = self.ring.read_into(out)
+        if n < len(out):
+            if self.ring.is_drained():
+                return bytes(out[:n]), True
+            if not pad:
+                return bytes(out[:n]), False
+            self.n_underrun_frames += (len(out) - n) // np.dtype(SAMPLE_DTYPE).itemsize
+        return bytes(out), False
+
+    def wait(self):
+        # until everything played so far has been handed to the sink
+        self.signals.join()
+        self.ring.wait_until_empty()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.signals.put(None)
+        self.producer.join()
+        self.sink.stop()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PyAudioSink:
+    # the sound card, through a PyAudio stream in callback mode, so PortAudio's thread asks for the data
+    def __init__(self, rate=RATE, frames_per_buffer=FRAMES_PER_BUFFER):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+
+    def start(self, pull):
+        def callback(in_data, frame_count, time_info, status):
+            data, finished = pull(frame_count)
+            return data, (pyaudio.paComplete if finished else pyaudio.paContinue)
+
+        self.audio_out = pyaudio.PyAudio()
+        self.stream = self.audio_out.open(
+            format=pyaudio.paInt8,
+            channels=1,
+            rate=self.rate,
+            output=True,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=callback,
+        )
+        self.stream.start_stream()
+
+    def stop(self):
+        # returns once the callback has reported the output finished
+        while self.stream.is_active():
+            time.sleep(0.01)
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio_out.terminate()
+
+
+class NullSink:
+    # no sound card: a thread pulls the data and discards it, either at the playback rate like a device (realtime),
+    # or as fast as the producer supplies it, with no silences from underruns
+    def __init__(self, rate=RATE, frames_per_buffer=FRAMES_PER_BUFFER, realtime=False):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.realtime = realtime
+        self.n_frames = 0
+
+    def start(self, pull):
+        self.thread = threading.Thread(target=self.run, args=(pull,), name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def run(self, pull):
+        t0 = time.time()
+        finished = False
+        while not finished:
+            data, finished = pull(self.frames_per_buffer, pad=self.realtime)
+            self.consume(data)
+            self.n_frames += len(data) // np.dtype(SAMPLE_DTYPE).itemsize
+            if self.realtime:
+                time.sleep(max(0, t0 + self.n_frames / self.rate - time.time()))
+            elif len(data) == 0 and not finished:
+                time.sleep(0.001)  # producer behind; don't spin
+
+    def consume(self, data):
+        pass
+
+    def stop(self):
+        self.thread.join()
+
+
+class FileSink(NullSink):
+    # writes what would have been played to a wav file (in realtime, silences from underruns included)
+    def __init__(self, filepath, rate=RATE, frames_per_buffer=FRAMES_PER_BUFFER, realtime=False):
+        super().__init__(rate, frames_per_buffer, realtime)
+        self.filepath = filepath
+
+    def start(self, pull):
+        self.spf = wave.open(self.filepath, "w")
+        self.spf.setnchannels(1)
+        self.spf.setsampwidth(1)
+        self.spf.setframerate(self.rate)
+        super().start(pull)
+
+    def consume(self, data):
+        # 8-bit wav samples are unsigned, centered on 128
+        self.spf.writeframes((np.frombuffer(data, dtype=SAMPLE_DTYPE).view("u1") ^ 0x80).tobytes())
+
+    def stop(self):
+        super().stop()
+        self.spf.close()
 
 
 def write_signal_to_wav(signal, filepath, rate=RATE):
@@ -83,6 +326,30 @@ def write_signal_to_wav(signal, filepath, rate=RATE):
         spf.writeframes(signal.astype("Int16").tobytes())
 
 
+def write_chunked_signal_to_wav(chunks, filepath, rate=RATE, block_frames=1 << 20):
+    # like write_signal_to_wav, for a signal too long to hold in memory, given as an iterable of chunks
+    # the chunks are only made once: they are spooled as float32 to a temporary file next to the output while the peak is found,
+    # then read back a block at a time and written normalized the same way
+    peak = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filepath))) as spool:
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.float32)
+            if len(chunk) > 0:
+                peak = max(peak, float(np.abs(chunk).max()))
+            spool.write(chunk.tobytes())
+        scale = (0.8 * MAX_AMPLITUDE) / peak if peak > 0 else 0
+        spool.seek(0)
+        with wave.open(filepath, "w") as spf:
+            spf.setnchannels(1)
+            spf.setsampwidth(2)
+            spf.setframerate(rate)
+            while True:
+                block = np.fromfile(spool, dtype=np.float32, count=block_frames)
+                if len(block) == 0:
+                    break
+                spf.writeframes((block * scale).astype("<i2").tobytes())
+
+
 def read_wav_to_array(filepath):
     f = read_wav(filepath)
     return np.array(f[1], dtype=float)
@@ -1,13 +1,22 @@
+import functools
+import hashlib
+import multiprocessing
+import os
 import random
+import time
 
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.stats import anderson_ksamp
 from scipy.signal import spectrogram
 
 import Music.WavUtil as wav
 
 
+FEATURE_CACHE_DIR = "SpectralFeatures"
+# same segments as plt.specgram, which this used to call (and which drew every spectrogram); it doesn't detrend them
+SPECTROGRAM_PARAMS = {"window": "hann", "nperseg": 256, "noverlap": 128, "detrend": False}
+
+
 # Anderson-Darling test integrates square of difference between two distribution functions (empirical or parametric)
 # the variable of integration is F(x), the cumulative distribution value, of one of the distributions
 # visualize a QQ plot, with one EDF just being the y=x line (this is the variable of integration)
@@ -18,54 +27,159 @@ def get_distance_between_samples(s1, s2):
     return anderson_ksamp([s1, s2]).statistic  # who needs significance level
 
 
-def get_sample_from_spectrum(spec, freqs, n_observations):
+def get_sample_from_spectrum(spec, freqs, n_observations, rng=np.random):
     # treat spectrum as pdf over the frequencies
     norm_spec = spec / np.sum(spec)
-    return np.random.choice(freqs, p=norm_spec, size=(n_observations,))
+    return rng.choice(freqs, p=norm_spec, size=(n_observations,))
 
 
-def convert_wav_to_spectrogram(filepath):
-    array = wav.read_wav_to_array(filepath)
-    spec = plt.specgram(array, Fs=wav.RATE)
-    plt.gca().set_ylim((0, 6000))
-    return spec
-    # return spectrogram(array, fs=wav.RATE)
+def get_file_hash(filepath):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
 
+def get_feature_cache_path(filepath, cache_dir=FEATURE_CACHE_DIR):
+    # keyed by the file's contents and the spectrogram parameters, so renamed files still hit and edited ones don't
+    params = ",".join("{}={}".format(k, v) for k, v in sorted(SPECTROGRAM_PARAMS.items()))
+    key = hashlib.sha1((get_file_hash(filepath) + ";" + params + ";rate={}".format(wav.RATE)).encode()).hexdigest()
+    return os.path.join(cache_dir, key + ".npz")
 
-def compare_spectrograms(spectrogram1, spectrogram2, freqs1, freqs2):
-    shorter, longer = sorted([spectrogram1, spectrogram2], key=len)
-    r = len(longer) *1.0/ len(shorter)
+
+def convert_wav_to_spectrogram(filepath):
+    array = wav.read_wav_to_array(filepath)
+    freqs, bins, Pxx = spectrogram(array, fs=wav.RATE, **SPECTROGRAM_PARAMS)
+    return Pxx, freqs, bins
+
+
+def get_features(filepath, cache_dir=FEATURE_CACHE_DIR):
+    # the spectrogram of the file, computed once and then loaded from the cache
+    cache_path = get_feature_cache_path(filepath, cache_dir)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cached["Pxx"], cached["freqs"], cached["bins"]
+    Pxx, freqs, bins = convert_wav_to_spectrogram(filepath)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".{}.tmp.npz".format(os.getpid())  # another worker may be writing the same file
+    np.savez(tmp_path, Pxx=Pxx, freqs=freqs, bins=bins)
+    os.replace(tmp_path, cache_path)
+    return Pxx, freqs, bins
+
+
+def compare_spectrograms(spectrogram1, spectrogram2, freqs1, freqs2, rng=np.random):
+    # time is the second axis of the spectrograms
+    (shorter, freqs_shorter), (longer, freqs_longer) = sorted([(spectrogram1, freqs1), (spectrogram2, freqs2)], key=lambda x: x[0].shape[1])
+    r = longer.shape[1] *1.0/ shorter.shape[1]
     distances = []
     n_observations = 100  # make this too high and it will overflow; 100 is good enough since a wav will have <1 distance to itself
-    for i in range(len(shorter)):
-        # line up the time axes by just dilating (no translating or dilating by a changing factor yet)
+    for i in range(shorter.shape[1]):
+        # line up the time axes by just dilating (no translating or dilating by a changing factor; see compare_spectrograms_aligned for that)
         # bootstrap some frequencies from each signal with probability=intensity
         # compare these two samples' EDFs
         j = int(r * i)
         pdf1 = shorter[:, i]
         pdf2 = longer[:, j]
-        samp1 = get_sample_from_spectrum(pdf1, freqs1, n_observations)
-        samp2 = get_sample_from_spectrum(pdf2, freqs2, n_observations)
+        samp1 = get_sample_from_spectrum(pdf1, freqs_shorter, n_observations, rng)
+        samp2 = get_sample_from_spectrum(pdf2, freqs_longer, n_observations, rng)
         distance = get_distance_between_samples(samp1, samp2)
         distances.append(distance)
     return np.mean(distances)
 
 
-def compare_wavs(fp1, fp2):
-    Pxx1, freqs1, bins1, im1 = convert_wav_to_spectrogram(fp1)
-    Pxx2, freqs2, bins2, im2 = convert_wav_to_spectrogram(fp2)
-    res = compare_spectrograms(Pxx1, Pxx2, freqs1, freqs2)
-    # assert res == compare_spectrograms(Pxx2, Pxx1)
+def get_frame_cdfs(spec):
+    # each time frame's spectrum as a distribution function over the frequencies, one row per frame
+    cdfs = np.cumsum(spec, axis=0).T
+    totals = cdfs[:, -1:]
+    silent = totals[:, 0] <= 0
+    cdfs = cdfs / np.where(totals > 0, totals, 1)
+    cdfs[silent] = np.linspace(1.0 / cdfs.shape[1], 1, cdfs.shape[1])  # no energy at all, call it flat
+    return cdfs
+
+
+def get_frame_distances(spectrogram1, spectrogram2):
+    # mean squared difference between the distribution functions of every pair of frames (Cramer-von Mises, where the AD test is a weighted one)
+    # computed for all pairs at once from |a-b|^2 = |a|^2 + |b|^2 - 2ab
+    cdfs1 = get_frame_cdfs(spectrogram1)
+    cdfs2 = get_frame_cdfs(spectrogram2)
+    sq1 = np.einsum("ij,ij->i", cdfs1, cdfs1)
+    sq2 = np.einsum("ij,ij->i", cdfs2, cdfs2)
+    distances = sq1[:, np.newaxis] + sq2[np.newaxis, :] - 2 * (cdfs1 @ cdfs2.T)
+    return np.maximum(distances, 0) / cdfs1.shape[1]
+
+
+def get_dtw_distance(cost):
+    # dynamic time warping: cheapest monotonic path through the cost matrix from corner to corner
+    # cell (i, j) depends only on cells on the previous two anti-diagonals, so each anti-diagonal is done as one vector operation
+    n1, n2 = cost.shape
+    total = np.full((n1 + 1, n2 + 1), np.inf)
+    total[0, 0] = 0
+    for k in range(2, n1 + n2 + 1):
+        i = np.arange(max(1, k - n2), min(n1, k - 1) + 1)
+        j = k - i
+        total[i, j] = cost[i - 1, j - 1] + np.minimum(np.minimum(total[i - 1, j], total[i, j - 1]), total[i - 1, j - 1])
+    return total[n1, n2] / (n1 + n2)  # per step, so long recordings aren't farther apart just for being long
+
+
+def compare_spectrograms_aligned(spectrogram1, spectrogram2, freqs1, freqs2):
+    # squishes the durations of similar spectra to match them up, so "aabbbcdd" and "abbbbccd" come out similar
+    assert np.array_equal(freqs1, freqs2), "spectrograms have different frequencies: {} and {} bins".format(len(freqs1), len(freqs2))
+    return get_dtw_distance(get_frame_distances(spectrogram1, spectrogram2))
+
+
+def compare_features(features1, features2, align=False, rng=np.random):
+    Pxx1, freqs1, bins1 = features1
+    Pxx2, freqs2, bins2 = features2
+    if align:
+        return compare_spectrograms_aligned(Pxx1, Pxx2, freqs1, freqs2)
+    return compare_spectrograms(Pxx1, Pxx2, freqs1, freqs2, rng)
+
+
+def compare_wavs(fp1, fp2, align=False, cache_dir=FEATURE_CACHE_DIR):
+    res = compare_features(get_features(fp1, cache_dir), get_features(fp2, cache_dir), align)
     return res
 
 
-def get_distance_matrix(fps):
+# features of all the files, set in each worker by init_pair_worker so they are sent once per worker, not once per pair
+_worker_features = None
+
+
+def init_pair_worker(features):
+    global _worker_features
+    _worker_features = features
+
+
+def compare_pair(args):
+    i, j, align, seed = args
+    rng = np.random.default_rng((seed, i, j))  # same draws for a pair whichever worker gets it
+    return i, j, compare_features(_worker_features[i], _worker_features[j], align, rng)
+
+
+def get_pairs(features):
+    # upper triangle including the diagonal (a wav has some small distance to itself), longest comparisons first
+    # so that the last ones handed out are short and the workers finish together
+    n_frames = [Pxx.shape[1] for Pxx, freqs, bins in features]
+    pairs = [(i, j) for i in range(len(features)) for j in range(i + 1)]
+    return sorted(pairs, key=lambda pair: -n_frames[pair[0]] * n_frames[pair[1]])
+
+
+def get_distance_matrix(fps, align=False, n_workers=None, cache_dir=FEATURE_CACHE_DIR, seed=None):
     n = len(fps)
+    n_workers = n_workers or os.cpu_count()
+    seed = random.randrange(2**32) if seed is None else seed
+    t0 = time.time()
+    with multiprocessing.Pool(n_workers) as pool:
+        features = pool.map(functools.partial(get_features, cache_dir=cache_dir), fps)
+    print("got spectrograms of {} files in {:.1f} s".format(n, time.time() - t0))
+
     res = np.zeros((n, n))
-    for i in range(n):
-        for j in range(i + 1):
-            distance = compare_wavs(fps[i], fps[j])
+    pairs = get_pairs(features)
+    with multiprocessing.Pool(n_workers, initializer=init_pair_worker, initargs=(features,)) as pool:
+        tasks = [(i, j, align, seed) for i, j in pairs]
+        for i, j, distance in pool.imap_unordered(compare_pair, tasks, chunksize=max(1, len(tasks) // (8 * n_workers))):
             res[i][j] = res[j][i] = distance
+    print("compared {} pairs on {} workers in {:.1f} s".format(len(pairs), n_workers, time.time() - t0))
     return res
 
 
@@ -84,6 +198,7 @@ if __name__ == "__main__":
     # print(similarity)
     np.set_printoptions(suppress=True)
     print(get_distance_matrix(fps))
+    print(get_distance_matrix(fps, align=True))  # dynamic time warping instead of constant dilation
 
     # expected result:
     # [[   0   low   high  lowish  high]
@@ -93,7 +208,7 @@ if __name__ == "__main__":
     #  [                              0]]
 
     # problems:
-    # - only dilates time axis by constant factor rather than "squishing" the durations of similar spectra to match them up
+    # - (without align) only dilates time axis by constant factor rather than "squishing" the durations of similar spectra to match them up
     #     (as with multiple people saying the same word, where length could resemble "aabbbcdd" vs. "abbbbccd", which should be deemed similar)
     # - sees different frequencies as dissimilar, so would reject speakers with different pitch of voice as dissimilar no matter what
     #   - could get around this by normalizing dists (t score of the values)
\ No newline at end of file